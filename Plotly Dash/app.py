@@ -4,7 +4,6 @@ import dash_design_kit as ddk
 import dash
 from dash.exceptions import PreventUpdate
 from databricks import sql
-import os
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -15,6 +14,7 @@ from plotly.tools import mpl_to_plotly
 import plotly.graph_objs as go
 import plotly.graph_objects as go
 import plotly.figure_factory as ff
+from plotly.subplots import make_subplots
 import matplotlib.pylab as plt
 from matplotlib.pylab import rcParams
 import matplotlib.dates as mdates
@@ -31,18 +31,28 @@ from prophet.diagnostics import performance_metrics
 from prophet.plot import plot_cross_validation_metric
 from prophet.plot import plot_plotly, plot_components_plotly
 from prophet.serialize import model_to_json, model_from_json
-import pickle 
 import pyodbc
 import json
 from celery import Celery
-from urllib.parse import urlparse
-import redis
+from urllib.parse import urlencode, urlparse
+from backends import get_many, get_published_version, get_store
+from codec import loads
+from export import register_export_routes
+from artifacts import ModelArtifact
+from baseline import BaselineModel
 from definition_bu import business_unit
 from definition_bu import MSR_ONE
 from definition_bu import MSR_TWO
+from helper_functions import compact_frame, get_current_year
+from hierarchy import get_selection_interval
+from uncertainty import aggregate_samples
+from log import get_logger, shape
+from tables import TABLE_OPTIONS, get_page
 # load the business function definitions
 MSR_ONE.extend(MSR_TWO)
 
+logger = get_logger(__name__)
+
 
 ###############################################################################
 ### Dash Application
@@ -55,8 +65,9 @@ app = Dash(__name__)
 server = app.server
 
 # Defining the Redis instance and using different DB numbers for Workspaces than for the app connected to the workspace
+# STORE_BACKEND=memory or fakeredis replaces redis for local end-to-end runs (see backends.py)
 app.config.suppress_callback_exceptions = True
-redis_client = redis.StrictRedis.from_url(os.environ.get("REDIS_URL", "redis://127.0.0.1:6379"))
+redis_client = get_store()
 #redis_client = redis.Redis(host='localhost', port=6379, db=0)
 
 
@@ -101,6 +112,7 @@ controls = [
     html.Button('Submit', id='submit-val', n_clicks=1),
 
     dcc.Store(id='memory-output'),
+    dcc.Store(id='table-selection'),
 
     html.Br(),
     dcc.Loading(
@@ -116,6 +128,17 @@ controls = [
 
 
 
+# download links of a table: served by the export routes (see export.py), the selection is passed as query arguments
+def get_download_links(kind, selection=None):
+    links = []
+    for export_format, label in [('csv', 'Download CSV'), ('parquet', 'Parquet'), ('xlsx', 'Excel')]:
+        query = urlencode(dict(selection or dict(), format=export_format), doseq=True)
+        links.extend([html.A(label, href='/export/' + kind + '?' + query, target='_blank'), ' '])
+    return html.Div(links[:-1])
+
+
+
+
 app.layout = ddk.App(children=[
 
     ddk.Header([
@@ -163,38 +186,34 @@ app.layout = ddk.App(children=[
                 ddk.Row([
                     ddk.Card(width=100, children=[
                         ddk.CardHeader(title='Data Table'), 
-                        ddk.DataTable(id='data_table', page_size = 25),
+                        ddk.DataTable(id='data_table', page_size = 25, **TABLE_OPTIONS),
                         ddk.CardFooter('Emission predictions provided in tons of CO2'),
-                        html.Button("Download CSV", id="btn_csv"),
-                        dcc.Download(id="download-dataframe-csv")
+                        html.Div(id='download_data_links')
                     ]),
                 ]),
                 ddk.Row([
                     ddk.Card(width=100, children=[
                         ddk.CardHeader(title='SPOT Table'), 
-                        ddk.DataTable(id='spot_table', page_size = 25),
+                        ddk.DataTable(id='spot_table', page_size = 25, **TABLE_OPTIONS),
                         ddk.CardFooter('Emission impacts provided in tons of CO2'),
-                        html.Button("Download CSV", id="btn_spot_csv"),
-                        dcc.Download(id="download-spot-dataframe-csv")
+                        get_download_links('spot')
                     ])
                 ]),
 
                 ddk.Row([
                     ddk.Card(width=100, children=[
                         ddk.CardHeader(title='VPPA Table'), 
-                        ddk.DataTable(id='vppa_table', page_size = 25),
+                        ddk.DataTable(id='vppa_table', page_size = 25, **TABLE_OPTIONS),
                         ddk.CardFooter('Emissions reductions from VPPA'),
-                        html.Button("Download CSV", id="btn_vppa_csv"),
-                        dcc.Download(id="download-vppa-dataframe-csv")
+                        get_download_links('vppa')
                     ]),
                 ]),
                 ddk.Row([
                     ddk.Card(width=100, children=[
                         ddk.CardHeader(title='Flag Table'), 
-                        ddk.DataTable(id='flag_table', page_size = 25),
+                        ddk.DataTable(id='flag_table', page_size = 25, **TABLE_OPTIONS),
                         ddk.CardFooter('List of flagged (divested) sites'),
-                        html.Button("Download CSV", id="btn_flag_csv"),
-                        dcc.Download(id="download-flag-dataframe-csv")
+                        get_download_links('flag')
                     ])
                 ])
             ]) # end block
@@ -276,7 +295,7 @@ def update_input_measure(scope, unit, n_clicks):
         'District Cooling - Usage'
     ]
     if ('Scope 1' in scope and 'Scope 2' not in scope):
-        print('Scope one')
+        logger.debug('Scope one')
         options = options_one
         value = options_one
     elif  ('Scope 2' in scope and 'Scope 1' not in scope):
@@ -354,42 +373,49 @@ def update_input_gms_unit(bu, n_clicks):
 
 
 def load_redis_objects(measure, bu, gms, unit, data_object):
-    print('load redis objects')
+    logger.info('load redis objects')
     
     # extract data from selected measure
     df_measure = pd.DataFrame()
     
+    # one MGET for the objects and predictive samples of all selected measures
+    keys = [data_object+i for i in measure] + ['samples'+i for i in measure if i not in ['Refrigerant Leaks', 'Fleet']]
+    keys += [key for key, name in [('leaks', 'Refrigerant Leaks'), ('fleet', 'Fleet')] if name in measure]
+    blobs = get_many(keys, redis_client)
+    
     # exception leaks
     if 'Refrigerant Leaks' in measure:
         measure.remove('Refrigerant Leaks')
-        df_json = redis_client.get('leaks')
-        df = pickle.loads(df_json)
+        df_json = blobs['leaks']
+        df = loads(df_json)
         #df['Emission Impact Sum', 'Energy Impact Sum'] = 0
         df_measure = df_measure.append(df, ignore_index=True)
     
     # exception fleet
     if 'Fleet' in measure:
         measure.remove('Fleet')
-        df_json = redis_client.get('fleet')
-        df = pickle.loads(df_json)
+        df_json = blobs['fleet']
+        df = loads(df_json)
         df[['Emission Impact Accumulated', 'Energy Impact Accumulated']] = 0
         df_measure = df_measure.append(df, ignore_index=True)
     
     for i in measure:
         try:
-            df_json = redis_client.get(data_object+i)
-            df = pickle.loads(df_json)
+            df_json = blobs[data_object+i]
+            df = loads(df_json)
             df_measure = df_measure.append(df, ignore_index=True)
         except:
             continue
+    # measures with different portfolio owners concatenate to object columns: restore the compact schema
+    df_measure = compact_frame(df_measure)
     #print(df_measure)
     #df_measure.to_csv('./df_measure.csv')
     # filter based on business unit input
-    print('gms filter')
+    logger.debug('gms filter')
     if gms:
         bu.extend(gms)
         bu.remove('GMS')
-    print('bu filter')
+    logger.debug('bu filter')
     if bu:
         list_bu = [business_unit.get(key) for key in bu]
         list_bu = [item for sublist in list_bu for item in sublist]
@@ -398,9 +424,9 @@ def load_redis_objects(measure, bu, gms, unit, data_object):
         df_global = df_measure
  
     # select unit: energy or emission
-    print('unit filter')
+    logger.debug('unit filter')
     if unit == 'CO2 (t)':
-        print('change unit')
+        logger.debug('change unit')
         df_global['y'] = df_global['y_ghg']
         df_global['y_with_spot'] = df_global['y_ghg_with_spot']
     
@@ -417,29 +443,79 @@ def load_redis_objects(measure, bu, gms, unit, data_object):
     df_global['yhat_upper'] = df_global.groupby(['Impact Month', 'PortfolioOwner', 'type'])['yhat_upper'].transform(lambda x: x.sum())
     df_global['Energy Impact Accumulated'] = df_global.groupby(['Impact Month', 'PortfolioOwner', 'type'])['Energy Impact Accumulated'].transform(lambda x: x.sum())
     df_global['Emission Impact Accumulated'] = df_global.groupby(['Impact Month', 'PortfolioOwner', 'type'])['Emission Impact Accumulated'].transform(lambda x: x.sum())
-    print('test')
-    print(df_global)
+    # summed bounds overstate the intervals of a portfolio owner over several measures: use the predictive samples if available
+    interval = load_sample_interval(measure, list(df_global['PortfolioOwner'].unique()), unit, by_portfolio_owner=True, blobs=blobs)
+    if interval is not None:
+        interval = interval.set_index(['Impact Month', 'PortfolioOwner'])
+        index = pd.MultiIndex.from_arrays([pd.to_datetime(df_global['Impact Month']), df_global['PortfolioOwner']])
+        predicted = (df_global['type'] == 'Predicted').values & index.isin(interval.index)
+        df_global.loc[predicted, 'yhat_lower'] = interval['yhat_lower'].reindex(index[predicted]).values
+        df_global.loc[predicted, 'yhat_upper'] = interval['yhat_upper'].reindex(index[predicted]).values
+    logger.debug('df_global %s', shape(df_global))
     #df_global.to_csv('./app_selection_fleet.csv')
     #df_global = pd.read_csv('./app_selection.csv')
     # y_with_spot needs to be recalculated
     df_global['y_with_spot'] = df_global['y'].astype(float)+ df_global[spot_impact].astype(float)
-    print('here')
     df_global.loc[df_global['y_with_spot'] < 0, 'y_with_spot'] = 0
-    print('test two')
     # these columns need to be dropped to avoid duplicates
     df_global = df_global.drop(['Emission Impact Sum', 'Energy Impact Sum', 'y_ghg', 'y_ghg_with_spot'], axis=1)
     df_global = df_global.drop_duplicates()
-    print(df_global)
-    print('test three')
+    logger.debug('df_global %s', shape(df_global))
     # check data
     #df_global.to_csv('./output_data/app_selection.csv')
-    print(df_global)
+    logger.debug('df_global %s', shape(df_global))
     return df_global
 
 
 
 
 
+# predictive samples: sum the draws of the selected portfolio owners and measures and take quantiles
+# blobs: samples already read with the data of the selection (load_redis_objects)
+def load_sample_interval(measure, portfolio_owners, unit, by_portfolio_owner=False, blobs=None):
+    measure = [i for i in measure if i not in ['Refrigerant Leaks', 'Fleet']]
+    if blobs is None:
+        blobs = get_many(['samples'+i for i in measure], redis_client)
+    sample_sets = []
+    for i in measure:
+        samples_json = blobs.get('samples'+i)
+        # every selected measure needs samples, else fall back
+        if samples_json is None:
+            return None
+        sample_sets.append(loads(samples_json))
+    if not sample_sets:
+        return None
+    if unit == 'Energy (GJ)':
+        return aggregate_samples(sample_sets, portfolio_owners, 'y', by_portfolio_owner)
+    return aggregate_samples(sample_sets, portfolio_owners, 'y_ghg', by_portfolio_owner)
+
+
+# hierarchy mode: read the reconciled totals and intervals of the selection instead of summing the portfolio owners
+def load_hierarchy_interval(measure, bu, gms, unit):
+    business_units = list(bu or [])
+    if gms:
+        business_units.extend(gms)
+    if 'GMS' in business_units:
+        business_units.remove('GMS')
+    measure = [i for i in measure if i not in ['Refrigerant Leaks', 'Fleet']]
+    blobs = get_many(['hierarchy'+i for i in measure], redis_client)
+    hierarchies = []
+    for i in measure:
+        hierarchy_json = blobs['hierarchy'+i]
+        # every selected measure must be reconciled, else fall back on the sums
+        if hierarchy_json is None:
+            return None
+        hierarchies.append(loads(hierarchy_json))
+    if not hierarchies:
+        return None
+    if unit == 'Energy (GJ)':
+        return get_selection_interval(hierarchies, business_units, 'y')
+    return get_selection_interval(hierarchies, business_units, 'y_ghg')
+
+
+
+
+
 # create a store for the selected data to work with
 @app.callback(
     Output("memory-output", "data"),
@@ -450,7 +526,7 @@ def load_redis_objects(measure, bu, gms, unit, data_object):
     State("input_unit", "value"))
 def data_store(n_clicks, measure, bu, gms, unit):
     data = load_redis_objects(measure, bu, gms, unit, 'df_global')
-    print(data)
+    logger.debug('data %s', shape(data))
     return data.to_dict('records')
 
 
@@ -465,7 +541,7 @@ def update_input_po(measure):
     # take the selection from measure selection on tab two as measure input (avoid interaction with tab one)
     # load the buildings per measure (not buildings per portfolio owner)
     po_bu_json = redis_client.get('po_bu'+measure)
-    po_bu = pickle.loads(po_bu_json)
+    po_bu = loads(po_bu_json)
     options = po_bu['BUILDING_ID'].unique()
     return dcc.Dropdown(
         id='input_diagnostics_po',
@@ -489,15 +565,11 @@ def update_kpi_one(n_clicks, data, calendar):
     dat['y_global_with_spot'] = dat.groupby(['Impact Month'])['y_with_spot'].transform(lambda x: x.sum())
     dat = dat[['Impact Month', 'y_global_with_spot', 'C_MNTH', 'C_YEAR', 'C_QRTR', 'F_MNTH', 'F_YEAR', 'F_QRTR']].drop_duplicates()
 
-    # determine the current fiscal year
+    # determine the current fiscal or calendar year
+    val_year = get_current_year(calendar)
     if calendar == 'Fiscal Year':
-        if datetime.now().month in [1,2,3]:
-            val_year = datetime.now().year-1
-        else:
-            val_year = datetime.now().year
         val_year_end = round(sum(dat.loc[dat['F_YEAR']==val_year, 'y_global_with_spot']))
     else:
-        val_year = datetime.now().year
         val_year_end = round(sum(dat.loc[dat['C_YEAR']==val_year, 'y_global_with_spot']))
     
     prd_year_end = "The total for the current year is predicted at: {}".format(val_year_end)
@@ -516,7 +588,7 @@ def update_kpi_one(n_clicks, data, calendar):
     State("input_unit", "value"))
 def update_kpi_two(n_clicks, measure, bu, gms, unit):
     rmse_scores = load_redis_objects(measure, bu, gms, unit, 'rmse_prophet')
-    print(rmse_scores)
+    logger.debug('rmse_scores %s', shape(rmse_scores))
     return round(np.mean(rmse_scores['RMSE']),2)
 
 
@@ -531,7 +603,7 @@ def update_kpi_two(n_clicks, measure, bu, gms, unit):
     State("input_unit", "value"))
 def update_KPI_three(n_clicks, measure, bu, gms, unit):
     mape_scores = load_redis_objects(measure, bu, gms, unit, 'mape_prophet')
-    print(mape_scores)
+    logger.debug('mape_scores %s', shape(mape_scores))
     return round(np.mean(mape_scores['MAPE']),2)
 '''
 
@@ -554,10 +626,7 @@ def update_fig_one(n_clicks, data, measure, calendar, unit):
         column_name = 'GHG Emissions (Metric tons)'
 
     # determine the current fiscal year
-    if datetime.now().month in [1,2,3]:
-        fiscal_year = datetime.now().year-1
-    else:
-        fiscal_year = datetime.now().year
+    fiscal_year = get_current_year('Fiscal Year')
     
     # create sums: y with spot per fiscal year or per calendar year. group by x and define x
     if calendar == 'Fiscal Year':
@@ -703,8 +772,11 @@ def update_fig_two(data, n_clicks, timerange, radio, calendar, unit):
     Input('memory-output', 'data'),
     Input("submit-val", "n_clicks"),
     Input('radio_fig_three', 'value'),
-    State('input_unit', 'value'))
-def update_fig_three(data, n_clicks, radio, unit):
+    State('input_unit', 'value'),
+    State('input_measure', 'value'),
+    State('input_bu', 'value'),
+    State('input_gms', 'value'))
+def update_fig_three(data, n_clicks, radio, unit, measure, bu, gms):
 
     dat = pd.DataFrame.from_dict(data)
 
@@ -714,6 +786,7 @@ def update_fig_three(data, n_clicks, radio, unit):
         column_name = 'GHG Emissions (Metric tons)'
 
     if radio == 'Total':
+        portfolio_owners = list(dat['PortfolioOwner'].unique())
         dat['PortfolioOwner'] = 'Global'
         # calculate the sums
         dat['y_global_with_spot'] = dat.groupby(['Impact Month'])['y_with_spot'].transform(lambda x: x.sum())
@@ -722,6 +795,15 @@ def update_fig_three(data, n_clicks, radio, unit):
         dat['lower_global_wo_spot'] = dat.groupby(['Impact Month'])['yhat_lower'].transform(lambda x: x.sum())
         dat = dat[['Impact Month', 'y_global_with_spot', 'y_global_wo_spot', 'upper_global_wo_spot', 'lower_global_wo_spot']].drop_duplicates()
         dat = dat.sort_values(by=['Impact Month'])
+        # summed bounds overstate the interval of the total: use the predictive samples or the reconciled intervals if available
+        interval = load_sample_interval(measure, portfolio_owners, unit)
+        if interval is None:
+            interval = load_hierarchy_interval(measure, bu, gms, unit)
+        if interval is not None:
+            interval = interval.set_index('Impact Month')
+            months = pd.to_datetime(dat['Impact Month'])
+            dat['upper_global_wo_spot'] = months.map(interval['yhat_upper']).values
+            dat['lower_global_wo_spot'] = months.map(interval['yhat_lower']).values
         
         figure = go.Figure().add_trace(
                 go.Scatter(
@@ -773,14 +855,8 @@ def update_fig_three(data, n_clicks, radio, unit):
 
 
 # callback function for data table
-@app.callback(
-    Output('data_table', 'data'),
-    Output('data_table', 'columns'),
-    Input('memory-output', 'data'),
-    Input("submit-val", "n_clicks"),
-    State("input_unit", "value"))
-def update_data_table(data, n_clicks, unit):
-    df = pd.DataFrame.from_dict(data)
+# tables: shared by the DataTables and the exports
+def get_data_table(df, unit):
     # select SPOT Energy Impact if Energy (GJ) is selected, else select Emission Impact
     if unit == 'Energy (GJ)':
         cols = ['Impact Month', 'PortfolioOwner', 'type','y', 'yhat_lower', 'yhat_upper', 'Energy Impact Accumulated', 'y_with_spot']
@@ -789,144 +865,148 @@ def update_data_table(data, n_clicks, unit):
     df = df[cols]
     df.columns = ['Month', 'Portfolio Owner', 'Type', 'Model Prediction', 'Lower CI', 'Upper CI', 'SPOT Impact', 'Prediction (incl. SPOT Impact)']
     df = df.sort_values(by=['Month', 'Portfolio Owner'])
-    columns = [{"name": i, "id": i} for i in df.columns]
-    return df.to_dict('records'), columns
+    return df
 
 
+def load_spot_table():
+    spot_json = redis_client.get('spot')
+    spot = loads(spot_json)
+    spot = spot.sort_values(by=['Impact Month', 'PortfolioOwner'])
+    now = pd.to_datetime(datetime.now().strftime("%Y-%m-%d"))
+    spot = spot.loc[(spot['Impact Month'] > now)]
+    return spot
 
 
+def load_vppa_table():
+    vppa_json = redis_client.get('vppa')
+    vppa = loads(vppa_json)
+    vppa = vppa[['ProblemID', 
+        'ProjectDescription', 
+        'EmissionsImpactRealizationDate',
+        'CalculatedEmissionsImpact', 
+        'EnergyImpact', 
+        'PortfolioOwner']]
+    return vppa
 
-# download button
-@app.callback(
-    Output("download-dataframe-csv", "data"),
-    State('memory-output', 'data'),
-    State("input_unit", "value"),
-    Input("btn_csv", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_data_table(data, n_clicks, unit):
-    df = pd.DataFrame.from_dict(data)
-     # select SPOT Energy Impact if Energy (GJ) is selected, else select Emission Impact
-    if unit == 'Energy (GJ)':
-        cols = ['Impact Month', 'PortfolioOwner', 'type','y', 'yhat_lower', 'yhat_upper', 'Energy Impact Accumulated', 'y_with_spot']
-    else:
-        cols = ['Impact Month', 'PortfolioOwner', 'type','y', 'yhat_lower', 'yhat_upper', 'Emission Impact Accumulated', 'y_with_spot']
-    df = df[cols]
-    df.columns = ['Month', 'Portfolio Owner', 'Type', 'Model Prediction', 'Lower CI', 'Upper CI', 'SPOT Impact', 'Prediction (incl. SPOT Impact)']
-    df = df.sort_values(by=['Month', 'Portfolio Owner'])
-    columns = [{"name": i, "id": i} for i in df.columns]
-    return dcc.send_data_frame(df.to_csv, "ghg_emssions_data.csv")
+
+def load_flag_table():
+    flag_json = redis_client.get('flag')
+    flag = loads(flag_json)
+    return flag
 
 
+# the data table export loads the selection on the server instead of sending the dcc.Store records back
+def load_data_export(selection):
+    unit = (selection.get('unit') or [None])[0]
+    data = load_redis_objects(selection.get('measure', []), selection.get('bu', []), selection.get('gms', []), unit, 'df_global')
+    return get_data_table(data, unit)
 
 
+# the exports are cached per selection and published data version
+register_export_routes(server, {
+    'data': ('ghg_emssions_data', load_data_export),
+    'spot': ('spot_emssions_impact_data', lambda selection: load_spot_table()),
+    'vppa': ('vppa_list', lambda selection: load_vppa_table()),
+    'flag': ('flagged_sites', lambda selection: load_flag_table())
+}, get_version=lambda: get_published_version(redis_client))
 
-# spot table
+
+
+
+
+# the submitted selection of the data table and its downloads, in the format of the export query
 @app.callback(
-    Output('spot_table', 'data'),
-    Output('spot_table', 'columns'),
-    Input("submit-val", "n_clicks"))
-def update_spot_table(n_clicks):
-    spot_json = redis_client.get('spot')
-    spot = pickle.loads(spot_json)
-    spot = spot.sort_values(by=['Impact Month', 'PortfolioOwner'])
-    now = pd.to_datetime(datetime.now().strftime("%Y-%m-%d"))
-    spot = spot.loc[(spot['Impact Month'] > now)]
-    columns = [{"name": i, "id": i} for i in spot.columns]
-    return spot.to_dict('records'), columns
+    Output('table-selection', 'data'),
+    Input("submit-val", "n_clicks"),
+    State('input_measure', 'value'),
+    State('input_bu', 'value'),
+    State('input_gms', 'value'),
+    State("input_unit", "value"))
+def update_table_selection(n_clicks, measure, bu, gms, unit):
+    return {'measure': measure or [], 'bu': bu or [], 'gms': gms or [], 'unit': [unit]}
 
 
 
 
 
-# spot download button
+# data table: server-side pages of the submitted selection
 @app.callback(
-    Output("download-spot-dataframe-csv", "data"),
-    Input("btn_spot_csv", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_spot_table(n_clicks):
-    spot_json = redis_client.get('spot')
-    spot = pickle.loads(spot_json)
-    spot = spot.sort_values(by=['Impact Month', 'PortfolioOwner'])
-    now = pd.to_datetime(datetime.now().strftime("%Y-%m-%d"))
-    spot = spot.loc[(spot['Impact Month'] > now)]
-    columns = [{"name": i, "id": i} for i in spot.columns]
-    return dcc.send_data_frame(spot.to_csv, "spot_emssions_impact_data.csv")
+    Output('data_table', 'data'),
+    Output('data_table', 'columns'),
+    Output('data_table', 'page_count'),
+    Input('table-selection', 'data'),
+    Input('data_table', 'page_current'),
+    Input('data_table', 'page_size'),
+    Input('data_table', 'sort_by'),
+    Input('data_table', 'filter_query'))
+def update_data_table(selection, page_current, page_size, sort_by, filter_query):
+    if selection is None:
+        raise PreventUpdate
+    key = json.dumps(selection, sort_keys=True)
+    # load_redis_objects changes the lists of the selection: build from a copy
+    return get_page(('data', get_published_version(redis_client), key), lambda: load_data_export(json.loads(key)), page_current, page_size, sort_by, filter_query)
 
 
 
 
 
-# vppa table
+# download links of the data table: the submitted selection
 @app.callback(
-    Output('vppa_table', 'data'),
-    Output('vppa_table', 'columns'),
-    Input("submit-val", "n_clicks"))
-def update_vppa_table(n_clicks):
-    vppa_json = redis_client.get('vppa')
-    vppa = pickle.loads(vppa_json)
-    vppa = vppa[['ProblemID', 
-        'ProjectDescription', 
-        'EmissionsImpactRealizationDate',
-        'CalculatedEmissionsImpact', 
-        'EnergyImpact', 
-        'PortfolioOwner']]
-    columns = [{"name": i, "id": i} for i in vppa.columns]
-    return vppa.to_dict('records'), columns
+    Output('download_data_links', 'children'),
+    Input('table-selection', 'data'))
+def update_download_links(selection):
+    return get_download_links('data', selection)
 
 
 
 
 
-# vppa download button
+# spot table
 @app.callback(
-    Output("download-vppa-dataframe-csv", "data"),
-    Input("btn_vppa_csv", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_vppa_table(n_clicks):
-    vppa_json = redis_client.get('vppa')
-    vppa = pickle.loads(vppa_json)
-    vppa = vppa[['ProblemID', 
-        'ProjectDescription', 
-        'EmissionsImpactRealizationDate',
-        'CalculatedEmissionsImpact', 
-        'EnergyImpact', 
-        'PortfolioOwner']]
-    columns = [{"name": i, "id": i} for i in vppa.columns]
-    return dcc.send_data_frame(vppa.to_csv, "vppa_list.csv")
+    Output('spot_table', 'data'),
+    Output('spot_table', 'columns'),
+    Output('spot_table', 'page_count'),
+    Input("submit-val", "n_clicks"),
+    Input('spot_table', 'page_current'),
+    Input('spot_table', 'page_size'),
+    Input('spot_table', 'sort_by'),
+    Input('spot_table', 'filter_query'))
+def update_spot_table(n_clicks, page_current, page_size, sort_by, filter_query):
+    return get_page(('spot', get_published_version(redis_client)), load_spot_table, page_current, page_size, sort_by, filter_query)
 
 
 
 
 
-# flag table
+# vppa table
 @app.callback(
-    Output('flag_table', 'data'),
-    Output('flag_table', 'columns'),
-    Input("submit-val", "n_clicks"))
-def update_flag_table(n_clicks):
-    flag_json = redis_client.get('flag')
-    flag = pickle.loads(flag_json)
-    columns = [{"name": i, "id": i} for i in flag.columns]
-    return flag.to_dict('records'), columns
+    Output('vppa_table', 'data'),
+    Output('vppa_table', 'columns'),
+    Output('vppa_table', 'page_count'),
+    Input("submit-val", "n_clicks"),
+    Input('vppa_table', 'page_current'),
+    Input('vppa_table', 'page_size'),
+    Input('vppa_table', 'sort_by'),
+    Input('vppa_table', 'filter_query'))
+def update_vppa_table(n_clicks, page_current, page_size, sort_by, filter_query):
+    return get_page(('vppa', get_published_version(redis_client)), load_vppa_table, page_current, page_size, sort_by, filter_query)
 
 
 
 
 
-# flag download button
+# flag table
 @app.callback(
-    Output("download-flag-dataframe-csv", "data"),
-    Input("btn_flag_csv", "n_clicks"),
-    prevent_initial_call=True
-)
-def download_flag_table(n_clicks):
-    flag_json = redis_client.get('flag')
-    flag = pickle.loads(flag_json)
-    columns = [{"name": i, "id": i} for i in flag.columns]
-    return dcc.send_data_frame(flag.to_csv, "flagged_sites.csv")
+    Output('flag_table', 'data'),
+    Output('flag_table', 'columns'),
+    Output('flag_table', 'page_count'),
+    Input("submit-val", "n_clicks"),
+    Input('flag_table', 'page_current'),
+    Input('flag_table', 'page_size'),
+    Input('flag_table', 'sort_by'),
+    Input('flag_table', 'filter_query'))
+def update_flag_table(n_clicks, page_current, page_size, sort_by, filter_query):
+    return get_page(('flag', get_published_version(redis_client)), load_flag_table, page_current, page_size, sort_by, filter_query)
 
 
 
@@ -986,7 +1066,7 @@ def update_fig_four(n_clicks, data, top, radio):
 def update_graph_diagnostics(measure, portfolio_owner):
     
     prophet_residuals_json = redis_client.get('prophet_residuals'+measure)
-    prophet_residuals = pickle.loads(prophet_residuals_json)
+    prophet_residuals = loads(prophet_residuals_json)
 
     residuals = prophet_residuals[portfolio_owner]['residual']
     residuals_norm = stats.zscore(residuals.to_list())
@@ -1009,7 +1089,7 @@ def update_graph_diagnostics(measure, portfolio_owner):
 def update_graph_diagnostics(measure, portfolio_owner):
     
     prophet_residuals_json = redis_client.get('prophet_residuals'+measure)
-    prophet_residuals = pickle.loads(prophet_residuals_json)
+    prophet_residuals = loads(prophet_residuals_json)
 
     # Add histogram of residuals
     residuals = prophet_residuals[portfolio_owner]['residual']
@@ -1050,7 +1130,7 @@ def update_graph_diagnostics(measure, portfolio_owner):
 def update_graph_diagnostics(measure, portfolio_owner):
     
     prophet_residuals_json = redis_client.get('prophet_residuals'+measure)
-    prophet_residuals = pickle.loads(prophet_residuals_json)
+    prophet_residuals = loads(prophet_residuals_json)
     
     #data = sarima_models[portfolio_owner].resid().sort_values()
     data = prophet_residuals[portfolio_owner]['residual'].sort_values()
@@ -1073,6 +1153,55 @@ def update_graph_diagnostics(measure, portfolio_owner):
 
 
 
+def plot_baseline(model, fcst):
+    """
+    Plots the forecast and interval of a baseline model (buildings with a short history or a failed Prophet fit).
+    """
+    fig = go.Figure([
+        go.Scatter(x=fcst['ds'], y=fcst['yhat_upper'], mode='lines', line=dict(width=0), showlegend=False),
+        go.Scatter(x=fcst['ds'], y=fcst['yhat_lower'], mode='lines', line=dict(width=0), fill='tonexty', name='interval'),
+        go.Scatter(x=fcst['ds'], y=fcst['yhat'], mode='lines', name='yhat')])
+    fig.update_layout(title='Baseline model: ' + model.method)
+    return fig
+
+
+def plot_artifact(model, fcst):
+    """
+    Plots the history, forecast and interval of a slim Prophet model artifact (as plot_plotly).
+    """
+    fig = go.Figure([
+        go.Scatter(x=model.history['ds'], y=model.history['y'], mode='markers', marker=dict(color='black', size=4), name='Actual'),
+        go.Scatter(x=fcst['ds'], y=fcst['yhat_upper'], mode='lines', line=dict(width=0), showlegend=False),
+        go.Scatter(x=fcst['ds'], y=fcst['yhat_lower'], mode='lines', line=dict(width=0), fill='tonexty',
+            fillcolor='rgba(0, 114, 178, 0.2)', name='interval'),
+        go.Scatter(x=fcst['ds'], y=fcst['yhat'], mode='lines', line=dict(color='#0072B2'), name='Predicted')])
+    fig.update_layout(xaxis_title='ds', yaxis_title='y')
+    return fig
+
+
+def plot_artifact_components(model, fcst):
+    """
+    Plots the components of a slim Prophet model artifact, one row per component (as plot_components_plotly):
+    trend, holidays and regressors over the forecast, seasonalities over one period.
+    """
+    components = [(name, kind) for name, kind in model.components if name in fcst.columns]
+    fig = make_subplots(rows=len(components), cols=1, subplot_titles=[name for name, kind in components])
+    for row, (name, kind) in enumerate(components, start=1):
+        dat = fcst
+        if kind == 'seasonality':
+            period = pd.Timedelta(days=model.metadata['periods'].get(name, 365.25))
+            dat = fcst.loc[fcst['ds'] < fcst['ds'].min() + period]
+        if name + '_lower' in dat.columns and name + '_upper' in dat.columns:
+            fig.add_trace(go.Scatter(x=dat['ds'], y=dat[name + '_upper'], mode='lines', line=dict(width=0), showlegend=False), row=row, col=1)
+            fig.add_trace(go.Scatter(x=dat['ds'], y=dat[name + '_lower'], mode='lines', line=dict(width=0), fill='tonexty',
+                fillcolor='rgba(0, 114, 178, 0.2)', showlegend=False), row=row, col=1)
+        fig.add_trace(go.Scatter(x=dat['ds'], y=dat[name], mode='lines', line=dict(color='#0072B2'), showlegend=False), row=row, col=1)
+    fig.update_layout(height=250 * len(components))
+    return fig
+
+
+
+
 # prophet diagnostics one
 @app.callback(
     Output("prophet_one", "figure"),
@@ -1080,12 +1209,14 @@ def update_graph_diagnostics(measure, portfolio_owner):
     Input("input_diagnostics_po", "value"))
 def update_plot_plotly(measure, portfolio_owner):
     
-    prophet_models_json = redis_client.get('prophet_models'+measure)
-    prophet_models = pickle.loads(prophet_models_json)
-    
-    prophet_fcst_json = redis_client.get('prophet_fcst'+measure)
-    prophet_fcst = pickle.loads(prophet_fcst_json)
-
+    blobs = get_many(['prophet_models'+measure, 'prophet_fcst'+measure], redis_client)
+    prophet_models = loads(blobs['prophet_models'+measure])
+    prophet_fcst = loads(blobs['prophet_fcst'+measure])
+
+    if isinstance(prophet_models[portfolio_owner], BaselineModel):
+        return plot_baseline(prophet_models[portfolio_owner], prophet_fcst[portfolio_owner])
+    if isinstance(prophet_models[portfolio_owner], ModelArtifact):
+        return plot_artifact(prophet_models[portfolio_owner], prophet_fcst[portfolio_owner])
     fig = plot_plotly(prophet_models[portfolio_owner], prophet_fcst[portfolio_owner])
 
     return fig
@@ -1101,12 +1232,15 @@ def update_plot_plotly(measure, portfolio_owner):
     Input('input_diagnostics_po', 'value'))
 def update_plot_components(measure, portfolio_owner):
     
-    prophet_models_json = redis_client.get('prophet_models'+measure)
-    prophet_models = pickle.loads(prophet_models_json)
-    
-    prophet_fcst_json = redis_client.get('prophet_fcst'+measure)
-    prophet_fcst = pickle.loads(prophet_fcst_json)
+    blobs = get_many(['prophet_models'+measure, 'prophet_fcst'+measure], redis_client)
+    prophet_models = loads(blobs['prophet_models'+measure])
+    prophet_fcst = loads(blobs['prophet_fcst'+measure])
     
+    # baseline models have no components: show the forecast
+    if isinstance(prophet_models[portfolio_owner], BaselineModel):
+        return plot_baseline(prophet_models[portfolio_owner], prophet_fcst[portfolio_owner])
+    if isinstance(prophet_models[portfolio_owner], ModelArtifact):
+        return plot_artifact_components(prophet_models[portfolio_owner], prophet_fcst[portfolio_owner])
     fig = plot_components_plotly(prophet_models[portfolio_owner], prophet_fcst[portfolio_owner])
     
     return fig
@@ -1124,7 +1258,7 @@ def update_plot_components(measure, portfolio_owner):
 def update_cv_metric(measure, portfolio_owner, metric):
     
     cv_dict_json = redis_client.get('cv_dict'+measure)
-    cv_dict = pickle.loads(cv_dict_json)
+    cv_dict = loads(cv_dict_json)
 
     fig = plot_cross_validation_metric(cv_dict[portfolio_owner], metric=metric)
     fig = mpl_to_plotly(fig) 
@@ -1142,10 +1276,9 @@ def update_cv_metric(measure, portfolio_owner, metric):
     Input("input_diagnostics_msr", "value"),
     Input('input_diagnostics_po', 'value'))
 def update_model_performance(measure, building_id):
-    rmse_json = redis_client.get('rmse_scores'+measure)
-    rmse = pickle.loads(rmse_json)
-    mape_json = redis_client.get('mape_scores'+measure)
-    mape = pickle.loads(mape_json)
+    blobs = get_many(['rmse_scores'+measure, 'mape_scores'+measure], redis_client)
+    rmse = loads(blobs['rmse_scores'+measure])
+    mape = loads(blobs['mape_scores'+measure])
     # filter for building id
     rmse = rmse.loc[rmse['BUILDING_ID']==building_id]
     # unit conversion: modeling done in joules - results reported in gigajoules
@@ -1154,9 +1287,9 @@ def update_model_performance(measure, building_id):
     mtrc = pd.merge(rmse, mape, on = 'BUILDING_ID')
     mtrc = mtrc[['BUILDING_ID', 'RMSE', 'MAPE']]
     mtrc[['RMSE', 'MAPE']] = round(mtrc[['RMSE', 'MAPE']],6)
-    print(mtrc)
+    logger.debug('mtrc %s', shape(mtrc))
     columns = [{"name": i, "id": i} for i in mtrc.columns]
-    print(columns)
+    logger.debug('columns %s', shape(columns))
     return mtrc.to_dict('records'), columns
 
 
@@ -1171,16 +1304,16 @@ def update_model_performance(measure, building_id):
     Input('input_diagnostics_po', 'value'))
 def update_volume_coefficient(measure, building_id):
     vol_coeff_json = redis_client.get('prophet_reg_coeff'+measure)
-    vol_coeff = pickle.loads(vol_coeff_json)
+    vol_coeff = loads(vol_coeff_json)
     # filter for building id
     vol_coeff = vol_coeff[building_id]
     cols = ['center', 'coef_lower', 'coef', 'coef_upper']
     # unit conversion: modeling done in joules - results reported in gigajoules
     vol_coeff[cols] = vol_coeff[cols]/1000000000
     vol_coeff[cols] = vol_coeff[cols].apply(lambda x: round(x, 6))
-    print(vol_coeff)
+    logger.debug('vol_coeff %s', shape(vol_coeff))
     columns = [{"name": i, "id": i} for i in vol_coeff.columns]
-    print(columns)
+    logger.debug('columns %s', shape(columns))
     return vol_coeff.to_dict('records'), columns
 
 
@@ -0,0 +1,149 @@
+#################
+### artifacts ###
+#################
+
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+from baseline import(
+    BaselineModel
+)
+from log import(
+    get_logger
+)
+from registry import(
+    is_registry_enabled,
+    load_models,
+    save_models
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### slim model artifacts
+# the dashboard plots the forecast and the components of a model and the warm start of the next run
+# reads the history and the fitted parameters; a fitted Prophet object also carries the Stan fit state,
+# copies of the training data and, with MCMC, every posterior sample of every parameter
+# publish_prediction therefore stores per building a ModelArtifact instead of the Prophet object:
+# params: mean of the fitted parameters, shaped as Prophet.params with one sample (get_stan_init)
+# history: the training series (ds, y)
+# extra_regressors: the regressors of the model (Prophet.extra_regressors)
+# components: the components to plot, (name, kind) with kind 'trend', 'seasonality', 'holidays' or 'regressor'
+# metadata: growth, seasonality_mode, mcmc_samples, interval_width, the changepoint, seasonality and holidays
+# priors (compared before a warm start), changepoints, period of the seasonalities
+# and the forecast reduced to the plotted columns in float32; baseline models are stored as they are
+# the full models go to the model registry if MODEL_REGISTRY_DIR is set (see registry.py)
+ModelArtifact = namedtuple('ModelArtifact', ['params', 'history', 'extra_regressors', 'components', 'metadata'])
+PARAM_NAMES = ['k', 'm', 'sigma_obs', 'delta', 'beta']
+FORECAST_COLUMNS = ['yhat', 'yhat_lower', 'yhat_upper']
+
+
+def get_components(model):
+    """
+    Lists the components of a fitted Prophet model in the order of plot_components.
+    """
+    components = [('trend', 'trend')]
+    if getattr(model, 'train_holiday_names', None) is not None:
+        components.append(('holidays', 'holidays'))
+    components += [(name, 'seasonality') for name in getattr(model, 'seasonalities', dict())]
+    components += [(name, 'regressor') for name in getattr(model, 'extra_regressors', dict())]
+    return components
+
+
+def get_model_artifact(model):
+    """
+    Extracts the slim artifact of a fitted Prophet model.
+
+    Args:
+        model (Prophet): The fitted model.
+
+    Returns:
+        ModelArtifact: The artifact.
+    """
+    params = {name: np.mean(np.asarray(model.params[name], dtype=float), axis=0, keepdims=True)
+              for name in PARAM_NAMES if name in model.params}
+    history = model.history[['ds', 'y']].reset_index(drop=True)
+    extra_regressors = {name: dict(regressor) for name, regressor in getattr(model, 'extra_regressors', dict()).items()}
+    metadata = {
+        'growth': getattr(model, 'growth', None),
+        'seasonality_mode': getattr(model, 'seasonality_mode', None),
+        'mcmc_samples': getattr(model, 'mcmc_samples', None),
+        'interval_width': getattr(model, 'interval_width', None),
+        'changepoint_prior_scale': getattr(model, 'changepoint_prior_scale', None),
+        'seasonality_prior_scale': getattr(model, 'seasonality_prior_scale', None),
+        'holidays_prior_scale': getattr(model, 'holidays_prior_scale', None),
+        'changepoints': list(pd.to_datetime(getattr(model, 'changepoints', pd.Series(dtype='datetime64[ns]')))),
+        'periods': {name: seasonality['period'] for name, seasonality in getattr(model, 'seasonalities', dict()).items()}
+    }
+    return ModelArtifact(params, history, extra_regressors, get_components(model), metadata)
+
+
+def get_slim_forecast(fcst, components=None):
+    """
+    Reduces a forecast to ds, the prediction, the plotted components and their bounds (float32).
+    """
+    columns = ['ds'] + FORECAST_COLUMNS
+    for name, kind in components or []:
+        columns += [name, name + '_lower', name + '_upper']
+    fcst = fcst[[col for col in columns if col in fcst.columns]].reset_index(drop=True)
+    values = [col for col in fcst.columns if col != 'ds']
+    return fcst.assign(**{col: fcst[col].astype(np.float32) for col in values})
+
+
+def get_model_artifacts(prophet_models, prophet_fcst):
+    """
+    Slims the models and forecasts of one measure for the result store.
+
+    Args:
+        prophet_models (dict): The model per building (Prophet, BaselineModel or None).
+        prophet_fcst (dict): The forecast per building.
+
+    Returns:
+        models (dict): The ModelArtifact (BaselineModel, None) per building.
+        fcst (dict): The slim forecast per building.
+    """
+    models = dict()
+    fcst = dict()
+    for i, model in prophet_models.items():
+        models[i] = model
+        if model is not None and not isinstance(model, (BaselineModel, ModelArtifact)):
+            try:
+                models[i] = get_model_artifact(model)
+            except:
+                logger.warning('no artifact for %s, store the full model', i)
+        components = models[i].components if isinstance(models[i], ModelArtifact) else None
+        fcst[i] = None if prophet_fcst.get(i) is None else get_slim_forecast(prophet_fcst[i], components)
+    logger.debug('artifacts %s', len(models))
+    return models, fcst
+
+
+
+###############################################################################
+### cold storage
+def write_cold_models(measure, prophet_models, run_id=None):
+    """
+    Registers the full models of one measure in the run run_id (see registry.py); does nothing if
+    MODEL_REGISTRY_DIR is not set.
+
+    Returns:
+        str: The run id (None if the registry is off).
+    """
+    if not is_registry_enabled():
+        return None
+    return save_models(measure, prophet_models, run_id)
+
+
+def load_cold_models(measure, buildings=None, run_id=None):
+    """
+    Loads full models of one measure from the registry (default: all buildings of the newest run);
+    None if the registry is off or has no models of the measure.
+    """
+    if not is_registry_enabled():
+        return None
+    try:
+        return load_models(measure, buildings, run_id)
+    except KeyError:
+        return None
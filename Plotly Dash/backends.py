@@ -0,0 +1,360 @@
+################
+### backends ###
+################
+
+import os
+import pandas as pd
+import re
+import sqlite3
+import threading
+import uuid
+
+from log import(
+    get_logger
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### configuration
+# WAREHOUSE_BACKEND: databricks (default) or sqlite - EDB tables under the same GMS_US_MART names
+# SPOT_BACKEND: sqlserver (default) or sqlite - SPOT tables under the same dbo names
+# STORE_BACKEND: redis (default), memory (in-process) or fakeredis - the result store of pipeline and app
+# FIXTURE_DIR: directory of the sqlite fixture databases, one file per schema (gms_us_mart.sqlite, dbo.sqlite)
+# the sqlite and memory backends need no network: a full ETL -> predict -> publish -> dashboard query run
+# can be timed on one machine (see benchmark.py --e2e)
+DATABRICKS_HOST = 'onetakeda-usprd.cloud.databricks.com'
+DATABRICKS_HTTP_PATH = 'sql/protocolv1/o/2186391591496286/1201-135729-4c9gjccf'
+SPOT_CONNECTION = 'DRIVER={ODBC Driver 18 for SQL Server};SERVER=usze2spotsql001rep.database.windows.net;DATABASE=TOPPMPROD;UID=SPOTEHS;PWD='
+
+
+def get_fixture_dir():
+    return os.environ.get('FIXTURE_DIR', './fixtures')
+
+
+
+###############################################################################
+### sqlite stand-in
+# timestamps written by DataFrame.to_sql are read back as pd.Timestamp, like the dates returned by Databricks
+sqlite3.register_converter('TIMESTAMP', lambda b: pd.Timestamp(b.decode('utf-8')))
+
+
+def connect_sqlite(schemas, fixture_dir=None):
+    """
+    Opens an in-memory sqlite database with the fixture database of every schema attached
+    under the schema name, so that statements written for EDB (GMS_US_MART.TABLE) or SPOT
+    ([dbo].[TABLE]) run unchanged.
+
+    Args:
+        schemas (list): The schema names, e.g. ['gms_us_mart'].
+        fixture_dir (str): Directory of the fixture databases; defaults to FIXTURE_DIR.
+
+    Returns:
+        sqlite3.Connection: The database connection.
+    """
+    fixture_dir = fixture_dir or get_fixture_dir()
+    cnxn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    for schema in schemas:
+        path = os.path.join(fixture_dir, schema + '.sqlite')
+        if not os.path.exists(path):
+            raise FileNotFoundError('fixture database ' + path + ' not found')
+        cnxn.execute('ATTACH DATABASE ? AS ' + schema, (path,))
+    return cnxn
+
+
+class SqliteCursor:
+    """
+    Cursor on the sqlite stand-in with the interface of the Databricks cursor used by run_query:
+    execute() takes pyformat parameters (%(name)s) and returns the cursor, USE statements are ignored.
+    """
+    def __init__(self, cnxn):
+        self.cnxn = cnxn
+        self.cursor = cnxn.cursor()
+
+    def execute(self, statement, params=None):
+        if statement.strip().lower().startswith('use '):
+            return self
+        statement = re.sub(r'%\((\w+)\)s', r':\1', statement).replace('%%', '%')
+        self.cursor.execute(statement, params or {})
+        return self
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+        self.cnxn.close()
+
+
+def load_fixtures(tables, fixture_dir=None):
+    """
+    Writes fixture tables into the sqlite fixture databases (existing tables are replaced).
+
+    Args:
+        tables (dict): DataFrames per schema and table name, e.g.
+            {'gms_us_mart': {'TXN_CNSPN_MTRCS_GLBL': df}, 'dbo': {'EMData': df}}.
+        fixture_dir (str): Directory of the fixture databases; defaults to FIXTURE_DIR.
+    """
+    fixture_dir = fixture_dir or get_fixture_dir()
+    os.makedirs(fixture_dir, exist_ok=True)
+    for schema, frames in tables.items():
+        cnxn = sqlite3.connect(os.path.join(fixture_dir, schema + '.sqlite'))
+        try:
+            for name, dat in frames.items():
+                logger.info('load fixture %s.%s', schema, name)
+                dat.to_sql(name, cnxn, if_exists='replace', index=False)
+            cnxn.commit()
+        finally:
+            cnxn.close()
+
+
+
+###############################################################################
+### warehouse (EDB)
+class DatabricksCursor:
+    """
+    Databricks cursor that owns its connection: close() closes the cursor and the connection, as
+    SqliteCursor does, so every extraction releases its warehouse session.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cursor()
+
+    def execute(self, statement, params=None):
+        self.cursor.execute(statement, params)
+        return self
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        try:
+            self.cursor.close()
+        finally:
+            self.connection.close()
+
+
+def get_edb_cursor_backend():
+    """
+    Returns a cursor on the configured warehouse backend (WAREHOUSE_BACKEND): Databricks or the
+    sqlite stand-in. The Databricks host and http path can be overridden with DATABRICKS_HOST
+    and DATABRICKS_HTTP_PATH.
+
+    Returns:
+        cursor: The database cursor object; closing it closes its connection.
+    """
+    backend = os.environ.get('WAREHOUSE_BACKEND', 'databricks')
+    if backend == 'databricks':
+        from databricks import sql
+        connection = sql.connect(server_hostname = os.environ.get('DATABRICKS_HOST', DATABRICKS_HOST),
+                            http_path = os.environ.get('DATABRICKS_HTTP_PATH', DATABRICKS_HTTP_PATH),
+                            access_token = os.environ.get('ACCESS_TOKEN'))
+        return DatabricksCursor(connection)
+    if backend == 'sqlite':
+        return SqliteCursor(connect_sqlite(['gms_us_mart']))
+    raise ValueError('unknown WAREHOUSE_BACKEND ' + backend)
+
+
+
+###############################################################################
+### SPOT
+def connect_spot():
+    """
+    Opens a connection to the SPOT database (SQL Server) or to its sqlite stand-in (SPOT_BACKEND).
+
+    Returns:
+        Connection: The database connection (pyodbc or sqlite3).
+    """
+    backend = os.environ.get('SPOT_BACKEND', 'sqlserver')
+    if backend == 'sqlserver':
+        import pyodbc
+        return pyodbc.connect(SPOT_CONNECTION + os.environ.get('SPOT_TOKEN'))
+    if backend == 'sqlite':
+        return connect_sqlite(['dbo'])
+    raise ValueError('unknown SPOT_BACKEND ' + backend)
+
+
+
+###############################################################################
+### result store
+class MemoryStore:
+    """
+    In-process stand-in for the redis client with the subset of commands used by the
+    pipeline and the app. Values are stored as bytes, like redis returns them.
+    """
+    def __init__(self):
+        self.data = dict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key)
+
+    def set(self, key, value):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        with self.lock:
+            self.data[key] = value
+        return True
+
+    def delete(self, *keys):
+        with self.lock:
+            return sum(self.data.pop(k, None) is not None for k in keys)
+
+    def exists(self, *keys):
+        with self.lock:
+            return sum(k in self.data for k in keys)
+
+    def keys(self, pattern='*'):
+        regex = re.compile(re.escape(pattern).replace('\\*', '.*') + '$')
+        with self.lock:
+            return [k.encode('utf-8') for k in self.data if regex.match(k)]
+
+    def mget(self, keys, *args):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys] + list(args)
+        with self.lock:
+            return [self.data.get(k) for k in keys]
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+        return True
+
+
+class MemoryPipeline:
+    """
+    Pipeline of the MemoryStore: the buffered commands are applied together under the store lock
+    on execute(), like a redis MULTI/EXEC transaction.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.commands = []
+
+    def set(self, key, value):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        self.commands.append((key, value))
+        return self
+
+    def execute(self):
+        with self.store.lock:
+            for key, value in self.commands:
+                self.store.data[key] = value
+        results = [True] * len(self.commands)
+        self.commands = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.commands = []
+
+
+# REDIS_URL: the redis server (default redis://127.0.0.1:6379)
+# REDIS_MAX_CONNECTIONS: size of the connection pool shared by all users of the store in a process (default 20)
+# one client per process and backend: the in-process stores are shared by the pipeline and the app
+# running in the same process, the redis client reuses the connections of its pool
+_stores = dict()
+
+
+def get_store(backend=None):
+    """
+    Returns the client of the result store (STORE_BACKEND): redis at REDIS_URL (one client per
+    process on a shared connection pool), the in-process MemoryStore or fakeredis (optional dependency).
+
+    Args:
+        backend (str): Overrides STORE_BACKEND.
+
+    Returns:
+        The store client (get and set like redis.StrictRedis).
+    """
+    backend = backend or os.environ.get('STORE_BACKEND', 'redis')
+    if backend not in _stores:
+        if backend == 'redis':
+            import redis
+            pool = redis.ConnectionPool.from_url(os.environ.get("REDIS_URL", "redis://127.0.0.1:6379"),
+                max_connections=int(os.environ.get('REDIS_MAX_CONNECTIONS', 20)))
+            _stores[backend] = redis.StrictRedis(connection_pool=pool)
+        elif backend == 'memory':
+            _stores[backend] = MemoryStore()
+        elif backend == 'fakeredis':
+            import fakeredis
+            _stores[backend] = fakeredis.FakeStrictRedis()
+        else:
+            raise ValueError('unknown STORE_BACKEND ' + backend)
+    return _stores[backend]
+
+
+
+###############################################################################
+### batched reads and writes
+# a selection of several measures or a published measure touches many keys: read them with one MGET
+# and write them in one MULTI/EXEC pipeline, one round trip instead of one per key; readers never see
+# a partially published measure
+def get_many(keys, store=None):
+    """
+    Reads several keys of the result store with one MGET.
+
+    Args:
+        keys (list): The keys.
+        store: The store client (default: get_store()).
+
+    Returns:
+        dict: The value per key (None for missing keys).
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return dict()
+    store = store or get_store()
+    return dict(zip(keys, store.mget(keys)))
+
+
+def set_many(values, store=None):
+    """
+    Writes several keys of the result store in one transactional pipeline (MULTI/EXEC).
+
+    Args:
+        values (dict): The value per key.
+        store: The store client (default: get_store()).
+    """
+    store = store or get_store()
+    pipe = store.pipeline(transaction=True)
+    for key, value in values.items():
+        pipe.set(key, value)
+    pipe.execute()
+
+
+
+###############################################################################
+### published data version
+# every publish of dashboard data writes a new version (PUBLISHED_VERSION) in the same transaction as
+# its values; the dashboard caches (paged tables, exports) are keyed by the version, so they are stale
+# as soon as new data is published instead of after their expiry
+PUBLISHED_VERSION = 'published_version'
+
+
+def publish_many(values, store=None):
+    """
+    Writes several keys of the result store like set_many, together with a new published data version.
+
+    Args:
+        values (dict): The value per key.
+        store: The store client (default: get_store()).
+    """
+    set_many(dict(values, **{PUBLISHED_VERSION: uuid.uuid4().hex}), store)
+
+
+def get_published_version(store=None):
+    """
+    Returns the version of the published data ('' before the first publish).
+    """
+    version = (store or get_store()).get(PUBLISHED_VERSION)
+    if isinstance(version, bytes):
+        return version.decode('utf-8')
+    return version or ''
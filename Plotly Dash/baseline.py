@@ -0,0 +1,246 @@
+################
+### baseline ###
+################
+
+from collections import namedtuple
+import numpy as np
+import os
+import pandas as pd
+from statistics import NormalDist
+import warnings
+
+from log import(
+    get_logger
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### batched baseline forecasters for short or sparse series
+# all series of one method are fitted at once on a (buildings x months) matrix aligned at the
+# last month of every building; the output has the format of a Prophet forecast (ds, yhat,
+# yhat_lower, yhat_upper) covering the history and the forecast horizon
+# rolling_mean: mean of the last 36 months (as for refrigerant leaks and fleet)
+# ses: simple exponential smoothing, smoothing parameter chosen per series on a grid
+# seasonal_naive: value of the same month in the most recent year
+BASELINE_METHODS = ['rolling_mean', 'ses', 'seasonal_naive']
+SES_ALPHAS = np.linspace(0.05, 0.95, 19)
+
+# method and fitted parameters of a baseline model (stored in place of the Prophet model)
+BaselineModel = namedtuple('BaselineModel', ['method', 'params'])
+
+
+def get_min_prophet_months():
+    """
+    Minimum number of months of history for a Prophet fit (MIN_PROPHET_MONTHS, default 24).
+    """
+    return int(os.environ.get('MIN_PROPHET_MONTHS', 24))
+
+
+def choose_model(n_months, min_prophet_months=None):
+    """
+    Routes a series to Prophet or to a baseline forecaster by its history length.
+
+    Args:
+        n_months (int): The number of months with data.
+        min_prophet_months (int): Minimum history for Prophet; defaults to get_min_prophet_months().
+
+    Returns:
+        str: 'prophet' or one of BASELINE_METHODS.
+    """
+    min_prophet_months = min_prophet_months or get_min_prophet_months()
+    if n_months >= min_prophet_months:
+        return 'prophet'
+    return choose_baseline(n_months)
+
+
+def choose_baseline(n_months):
+    """
+    Selects the baseline forecaster for a history length (also used when a Prophet fit fails).
+    """
+    if n_months >= 12:
+        return 'seasonal_naive'
+    if n_months >= 6:
+        return 'ses'
+    return 'rolling_mean'
+
+
+
+###############################################################################
+### series matrix
+def get_series_matrix(df, buildings):
+    """
+    Arranges the monthly values of several buildings in a matrix aligned at the last month of
+    every building (left-padded with NaN; months without data are NaN).
+
+    Args:
+        df (pd.DataFrame): The input data with columns BUILDING_ID, Month and y.
+        buildings (list): The building ids.
+
+    Returns:
+        Y (np.ndarray): The values (buildings x months).
+        first (np.ndarray): The first month of every building (months since year 0).
+        last (np.ndarray): The last month of every building (months since year 0).
+    """
+    dat = df.loc[df['BUILDING_ID'].isin(buildings), ['BUILDING_ID', 'Month', 'y']].dropna()
+    month = pd.to_datetime(dat['Month'])
+    dat = dat.assign(month_number = month.dt.year * 12 + month.dt.month - 1, y = dat['y'].astype(float))
+    # buildings reporting several values per month (e.g. volumetric and energetic gas) are averaged, as seen by Prophet
+    dat = dat.groupby(['BUILDING_ID', 'month_number'], as_index=False)['y'].mean()
+    first = dat.groupby('BUILDING_ID')['month_number'].min().reindex(buildings).values
+    last = dat.groupby('BUILDING_ID')['month_number'].max().reindex(buildings).values
+    n_columns = int((last - first).max()) + 1
+    row = pd.Series(np.arange(len(buildings)), index=buildings)[dat['BUILDING_ID']].values
+    column = n_columns - 1 - (last[row] - dat['month_number'].values)
+    Y = np.full((len(buildings), n_columns), np.nan)
+    Y[row, column] = dat['y'].values
+    return Y, first, last
+
+
+def nanstd(x, axis=1):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanstd(x, axis=axis)
+
+
+
+###############################################################################
+### forecasters: fitted values (buildings x months), forecasts and standard deviations (buildings x horizon)
+def fit_rolling_mean(Y, periods, window=36):
+    """
+    Mean of the last window months, used as flat forecast. The fitted values are the same mean.
+    """
+    recent = Y[:, -window:]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        mean = np.nanmean(recent, axis=1)
+    sigma = nanstd(recent)
+    count = np.sum(~np.isnan(recent), axis=1)
+    fitted = np.repeat(mean[:, None], Y.shape[1], axis=1)
+    forecast = np.repeat(mean[:, None], periods, axis=1)
+    std = np.repeat((sigma * np.sqrt(1 + 1 / np.maximum(count, 1)))[:, None], periods, axis=1)
+    return fitted, forecast, std, [{'mean': m} for m in mean]
+
+
+def fit_ses(Y, periods, alphas=SES_ALPHAS):
+    """
+    Simple exponential smoothing of all series and all smoothing parameters at once; the
+    parameter with the smallest one-step squared error is selected per series. Missing months
+    leave the level unchanged.
+    """
+    n, t = Y.shape
+    # initial level: first value of every series
+    first_value = Y[np.arange(n), np.argmax(~np.isnan(Y), axis=1)]
+    level = np.repeat(first_value[:, None], alphas.shape[0], axis=1)
+    fitted = np.full((n, alphas.shape[0], t), np.nan)
+    for j in range(t):
+        fitted[:, :, j] = level
+        observed = ~np.isnan(Y[:, j])
+        level = np.where(observed[:, None], level + alphas[None, :] * (np.nan_to_num(Y[:, j])[:, None] - level), level)
+    errors = Y[:, None, :] - fitted
+    sse = np.nansum(errors ** 2, axis=2)
+    best = np.argmin(sse, axis=1)
+    rows = np.arange(n)
+    alpha = alphas[best]
+    fitted = fitted[rows, best]
+    sigma = nanstd(errors[rows, best])
+    forecast = np.repeat(level[rows, best][:, None], periods, axis=1)
+    h = np.arange(1, periods + 1)
+    std = sigma[:, None] * np.sqrt(1 + (h[None, :] - 1) * alpha[:, None] ** 2)
+    return fitted, forecast, std, [{'alpha': a, 'level': l} for a, l in zip(alpha, level[rows, best])]
+
+
+def fit_seasonal_naive(Y, periods):
+    """
+    Seasonal naive forecasts: the value of the same month one year (k years for horizons beyond
+    twelve months) before. Missing months are filled with the last available value.
+    """
+    n, t = Y.shape
+    # fill gaps forward along the months
+    index = np.where(~np.isnan(Y), np.arange(t)[None, :], 0)
+    index = np.maximum.accumulate(index, axis=1)
+    filled = Y[np.arange(n)[:, None], index]
+    fitted = np.full((n, t), np.nan)
+    fitted[:, 12:] = filled[:, :-12]
+    sigma = nanstd(Y - fitted)
+    # series without a full seasonal difference: spread of the values
+    sigma = np.where(np.isnan(sigma), nanstd(Y), sigma)
+    h = np.arange(1, periods + 1)
+    years_back = np.ceil(h / 12).astype(int)
+    source = t - 1 + h - 12 * years_back
+    forecast = filled[:, source]
+    std = sigma[:, None] * np.sqrt(years_back)[None, :]
+    return fitted, forecast, std, [{'sigma': s} for s in sigma]
+
+
+FORECASTERS = {
+    'rolling_mean': fit_rolling_mean,
+    'ses': fit_ses,
+    'seasonal_naive': fit_seasonal_naive
+}
+
+
+
+###############################################################################
+### batch fit
+def get_baseline(df, buildings, method, periods=36, interval_width=0.8):
+    """
+    Fits one baseline forecaster to several buildings in one matrix operation.
+
+    Args:
+        df (pd.DataFrame): The input data with columns BUILDING_ID, Month and y.
+        buildings (list): The building ids.
+        method (str): One of BASELINE_METHODS.
+        periods (int): The forecast horizon in months.
+        interval_width (float): The coverage of the intervals (0.8 like Prophet).
+
+    Returns:
+        baseline_models (dict): A BaselineModel per building.
+        baseline_fcst (dict): A forecast per building in the format of a Prophet forecast.
+    """
+    baseline_models = dict()
+    baseline_fcst = dict()
+    if len(buildings) == 0:
+        return baseline_models, baseline_fcst
+    z = NormalDist().inv_cdf(0.5 + interval_width / 2)
+    Y, first, last = get_series_matrix(df, buildings)
+    fitted, forecast, std, params = FORECASTERS[method](Y, periods)
+    n_columns = Y.shape[1]
+    for k, i in enumerate(buildings):
+        n_history = int(last[k] - first[k]) + 1
+        start = pd.Timestamp(year=int(first[k] // 12), month=int(first[k] % 12) + 1, day=1)
+        yhat = np.concatenate([fitted[k, n_columns - n_history:], forecast[k]])
+        sigma = np.concatenate([np.repeat(std[k, 0], n_history), std[k]])
+        baseline_fcst[i] = pd.DataFrame({
+            'ds': pd.date_range(start, periods=n_history + periods, freq='MS'),
+            'yhat': yhat,
+            'yhat_lower': yhat - z * sigma,
+            'yhat_upper': yhat + z * sigma})
+        baseline_models[i] = BaselineModel(method, params[k])
+    return baseline_models, baseline_fcst
+
+
+def get_baselines(df, methods, periods=36):
+    """
+    Fits the baseline forecasters of several buildings, batched per method.
+
+    Args:
+        df (pd.DataFrame): The input data with columns BUILDING_ID, Month and y.
+        methods (dict): The baseline method per building id.
+        periods (int): The forecast horizon in months.
+
+    Returns:
+        baseline_models (dict), baseline_fcst (dict): See get_baseline().
+    """
+    baseline_models = dict()
+    baseline_fcst = dict()
+    for method in BASELINE_METHODS:
+        buildings = [i for i, m in methods.items() if m == method]
+        if buildings:
+            logger.info('fit %s baseline for %s buildings', method, len(buildings))
+            models, fcst = get_baseline(df, buildings, method, periods)
+            baseline_models.update(models)
+            baseline_fcst.update(fcst)
+    return baseline_models, baseline_fcst
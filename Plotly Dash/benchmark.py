@@ -0,0 +1,688 @@
+#################
+### benchmark ###
+#################
+
+# Offline benchmark suite: synthetic data with the schemas of the extract functions,
+# scaled by number of buildings, months and folderpaths. No Databricks, SPOT or Redis needed.
+#
+# Usage:
+#   python benchmark.py --buildings 10 50 100 --months 96 --output bench.json
+#   python benchmark.py --baseline bench.json --tolerance 1.5   # exit code 1 on regression
+#   python benchmark.py --e2e --buildings 20                    # ETL -> predict -> publish -> dashboard query
+#   python benchmark.py --codecs --buildings 20                 # size and decode time of the published objects per codec
+
+import argparse
+from datetime import datetime
+import numpy as np
+import os
+import pandas as pd
+import pickle
+import tempfile
+import time
+
+from backends import(
+    MemoryStore,
+    get_store,
+    load_fixtures
+)
+
+from codec import(
+    dumps,
+    encode,
+    get_available_codecs,
+    loads
+)
+
+from definition_bu import business_unit
+
+from log import(
+    get_logger
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### synthetic data
+COUNTRIES = ['United States', 'Canada', 'Austria', 'Belgium', 'Italy', 'Japan', 'Ireland', 'Singapore']
+PORTFOLIO_OWNERS = [po for pos in business_unit.values() for po in pos]
+MEASURE_ELECTRICITY = 'Purchased Electricity - Usage'
+MEASURE_STANDARD = 'Diesel Stationary - Useage'
+
+
+def make_buildings(n_buildings, n_folderpaths=None, seed=0):
+    """
+    Creates the building master data: building id, country, folderpath and portfolio owner.
+    Several buildings share a folderpath if n_folderpaths < n_buildings.
+
+    Args:
+        n_buildings (int): Number of buildings.
+        n_folderpaths (int): Number of folderpaths; defaults to one per building.
+        seed (int): Random seed.
+
+    Returns:
+        pd.DataFrame: Columns BUILDING_ID, Cntry, FOLDERPATH, PortfolioOwner.
+    """
+    rng = np.random.default_rng(seed)
+    n_folderpaths = n_folderpaths or n_buildings
+    buildings = pd.DataFrame({'BUILDING_ID': ['XX-BLD-' + str(i).zfill(4) for i in range(n_buildings)]})
+    buildings['Cntry'] = rng.choice(COUNTRIES, n_buildings)
+    buildings['FOLDERPATH'] = ['Takeda > SYN > ' + str(i % n_folderpaths).zfill(5) for i in range(n_buildings)]
+    # one portfolio owner per folderpath
+    buildings['PortfolioOwner'] = [PORTFOLIO_OWNERS[(i % n_folderpaths) % len(PORTFOLIO_OWNERS)] for i in range(n_buildings)]
+    return buildings
+
+
+def make_months(n_months, end=None):
+    """
+    Creates the list of month starts for the history, ending with the last complete month.
+    """
+    end = end or (pd.Timestamp(datetime.now().strftime('%Y-%m-01')) - pd.DateOffset(months=1))
+    return pd.date_range(end=end, periods=n_months, freq='MS')
+
+
+def make_series(n_series, n_months, scale=1e12, seed=0):
+    """
+    Creates monthly usage series (trend, yearly seasonality and noise), one row per series.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_months)
+    level = rng.uniform(0.2, 1.0, (n_series, 1)) * scale
+    trend = 1 + rng.normal(0, 0.002, (n_series, 1)) * t
+    season = 1 + 0.2 * np.sin(2 * np.pi * (t + rng.integers(0, 12, (n_series, 1))) / 12)
+    noise = 1 + rng.normal(0, 0.05, (n_series, n_months))
+    return level * trend * season * noise
+
+
+def fiscal_columns(months):
+    """
+    Fiscal year and month of calendar months (the fiscal year starts in April), as reported by Enablon.
+    """
+    fiscal = months - pd.DateOffset(months=3)
+    return fiscal.year, fiscal.month, (fiscal.month - 1) // 3 + 1
+
+
+def make_enablon(buildings, n_months, msr=MEASURE_STANDARD, seed=0):
+    """
+    Synthetic extract_enablon output (one row per building and month).
+    """
+    months = make_months(n_months)
+    values = make_series(buildings.shape[0], n_months, seed=seed)
+    fscl_yr, fscl_mnth, fscl_qrtr = fiscal_columns(months)
+    n = buildings.shape[0]
+    return pd.DataFrame({
+        'MSR': msr,
+        'SYSTM_SPCFIC_MSR': 'Energy.syn',
+        'BUILDING_ID': np.repeat(buildings['BUILDING_ID'].values, n_months),
+        'Cntry': np.repeat(buildings['Cntry'].values, n_months),
+        'FSCL_MNTH_NO': np.tile(fscl_mnth, n),
+        'FSCL_QRTR': np.tile(fscl_qrtr, n),
+        'FSCL_YR': np.tile(fscl_yr, n),
+        'R_MSR_VAL': values.ravel(),
+        'R_MSR_UNT': 'J'})
+
+
+def make_leaks(buildings, n_months, seed=1):
+    """
+    Synthetic extract_leaks output.
+    """
+    dat = make_enablon(buildings, n_months, msr='Emission - Air Refrigerants', seed=seed).drop(columns='Cntry')
+    dat['R_MSR_VAL'] = (dat['R_MSR_VAL'] / 1e9).round()
+    dat['R_MSR_UNT'] = 'kg GHG'
+    return dat
+
+
+def make_fleet(buildings, n_months, seed=2):
+    """
+    Synthetic extract_fleet output.
+    """
+    months = make_months(n_months)
+    n = buildings.shape[0]
+    return pd.DataFrame({
+        'FOLDERPATH': np.repeat(buildings['FOLDERPATH'].values, n_months),
+        'BUILDING_ID': np.repeat(buildings['BUILDING_ID'].values, n_months),
+        'DATE': np.tile(months.values, n),
+        'MSR': 'FLEET',
+        'SYSTM_SPCFIC_MSR': 'FLEET.Scp1.Cot.GHG.M',
+        'R_MSR_VAL': make_series(n, n_months, scale=1e4, seed=seed).ravel(),
+        'R_MSR_UNT': 'kg GHG'})
+
+
+def make_conversion_factors(buildings, n_months, cd_keys, seed=3):
+    """
+    Synthetic extract_ecf / extract_scf output: one factor per folderpath, code key and month.
+    """
+    rng = np.random.default_rng(seed)
+    months = make_months(n_months)
+    folderpaths = buildings['FOLDERPATH'].unique()
+    index = pd.MultiIndex.from_product([folderpaths, cd_keys, months], names=['FOLDERPATH', 'Cd_Key_2', 'Month']).to_frame(index=False)
+    index['Month'] = index['Month'].dt.strftime('%Y-%m-%d')
+    index['Rfrnc_Key'] = 'SYN'
+    index['Unit'] = 'kg/kWh'
+    index['Nmbr_Val'] = rng.uniform(0.1, 0.6, index.shape[0]).round(4)
+    return index[['FOLDERPATH', 'Month', 'Rfrnc_Key', 'Cd_Key_2', 'Unit', 'Nmbr_Val']]
+
+
+def make_ecf(buildings, n_months):
+    """
+    Synthetic extract_ecf output.
+    """
+    return make_conversion_factors(buildings, n_months, ['Energy.EF.2.1.6'])
+
+
+def make_scf(buildings, n_months):
+    """
+    Synthetic extract_scf output.
+    """
+    return make_conversion_factors(buildings, n_months, ['Energy.EF.11.NRG', 'Energy.EF.11.MASS'])
+
+
+def make_tango_fp(buildings):
+    """
+    Synthetic extract_tango output.
+    """
+    return buildings[['BUILDING_ID', 'FOLDERPATH']].copy()
+
+
+def make_spot_fp_po(buildings):
+    """
+    Synthetic preprocess output matching folderpaths with portfolio owners.
+    """
+    return buildings[['FOLDERPATH', 'PortfolioOwner']].drop_duplicates().reset_index(drop=True)
+
+
+def make_flag(buildings):
+    """
+    Synthetic extract_flag output: every 20th building is divested.
+    """
+    flag = buildings.iloc[::20][['BUILDING_ID']].copy()
+    flag['BUILDING_NM'] = flag['BUILDING_ID']
+    flag['BUILDING_STAT_DESC'] = 'Divested'
+    flag['EHS_DATA_SHOW_FLG'] = 'No'
+    return flag
+
+
+def make_cf():
+    """
+    Synthetic Energy_Conversion_Factors.csv (local file).
+    """
+    return pd.DataFrame({
+        'Indicators': [MEASURE_STANDARD, 'Natural Gas - Useage (Reported)', 'Natural Gas - Useage (Reported)'],
+        'Cd_Key_2': ['Energy.syn', 'Energy.2a.vol', 'Energy.2a.nrg'],
+        'CF Final': [74.1, 1.9, 0.18]})
+
+
+def make_spot(buildings, n_projects=None, seed=4):
+    """
+    Synthetic extract_spot output (future GHG emission reduction projects) and the SPOT lookup table.
+    """
+    rng = np.random.default_rng(seed)
+    n_projects = n_projects or max(buildings.shape[0] // 2, 1)
+    now = pd.Timestamp(datetime.now().strftime('%Y-%m-01'))
+    spot = pd.DataFrame({
+        'SPOT ID': np.arange(n_projects),
+        'Environmental Portfolio': rng.choice(buildings['PortfolioOwner'].unique(), n_projects),
+        'Impact Realization Date': now + pd.to_timedelta(rng.integers(30, 1000, n_projects), unit='D'),
+        'EMImpactTonsCO2Year': -rng.uniform(10, 1000, n_projects),
+        'EMUnit': -rng.uniform(100, 10000, n_projects),
+        'EMSourceID': 'SYN',
+        'EM Source Name': rng.choice(['Electricity', 'Diesel'], n_projects)})
+    spot_lookup = pd.DataFrame({
+        'EM Source Name': ['Electricity', 'Diesel'],
+        'Enablon Source Name': [MEASURE_ELECTRICITY, MEASURE_STANDARD]})
+    return spot, spot_lookup
+
+
+def make_prd_df(df, horizon=36, seed=5):
+    """
+    Synthetic get_prd_dataframe output (fitted history and forecast per building), without fitting Prophet.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i, dat in df.groupby('BUILDING_ID'):
+        months = pd.date_range(dat['Month'].min(), dat['Month'].max() + pd.DateOffset(months=horizon), freq='MS')
+        yhat = np.full(months.shape[0], dat['y'].mean()) * rng.normal(1, 0.05, months.shape[0])
+        frames.append(pd.DataFrame({'Impact Month': months, 'yhat': yhat, 'yhat_lower': yhat * 0.9, 'yhat_upper': yhat * 1.1, 'BUILDING_ID': i}))
+    return pd.concat(frames)
+
+
+def make_df_global(buildings, n_months, horizon=36, seed=6):
+    """
+    Synthetic published df_global frame (select_columns output) at portfolio owner level.
+    """
+    rng = np.random.default_rng(seed)
+    months = make_months(n_months).append(pd.date_range(make_months(1)[0] + pd.DateOffset(months=1), periods=horizon, freq='MS'))
+    owners = buildings['PortfolioOwner'].unique()
+    dat = pd.MultiIndex.from_product([owners, months], names=['PortfolioOwner', 'Impact Month']).to_frame(index=False)
+    dat['y'] = rng.uniform(1e3, 1e5, dat.shape[0])
+    dat['type'] = np.where(dat['Impact Month'] > make_months(1)[0], 'Predicted', 'Actuals')
+    dat['yhat_lower'] = np.where(dat['type'] == 'Predicted', dat['y'] * 0.9, np.nan)
+    dat['yhat_upper'] = np.where(dat['type'] == 'Predicted', dat['y'] * 1.1, np.nan)
+    dat['y_ghg'] = dat['y'] * 0.05
+    for col in ['Emission Impact Sum', 'Emission Impact Accumulated', 'Energy Impact Sum', 'Energy Impact Accumulated']:
+        dat[col] = 0.0
+    dat['y_with_spot'] = dat['y']
+    dat['y_ghg_with_spot'] = dat['y_ghg']
+    dat['C_MNTH'] = dat['Impact Month'].dt.month
+    dat['C_YEAR'] = dat['Impact Month'].dt.year
+    dat['C_QRTR'] = (dat['C_MNTH'] - 1) // 3 + 1
+    dat['F_MNTH'] = (dat['C_MNTH'] - 4) % 12 + 1
+    dat['F_YEAR'] = np.where(dat['C_MNTH'] <= 3, dat['C_YEAR'] - 1, dat['C_YEAR'])
+    dat['F_QRTR'] = (dat['F_MNTH'] - 1) // 3 + 1
+    return dat
+
+
+
+###############################################################################
+### timing
+def time_function(function, make_args, repeat=3):
+    """
+    Times function(*make_args()) and returns the fastest of repeat runs in seconds.
+    The arguments are created anew for every run because the pipeline functions modify their inputs.
+    """
+    timings = []
+    for r in range(repeat):
+        args = make_args()
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def copy_args(*args):
+    """
+    Returns a function creating deep copies of DataFrame arguments (other arguments are passed as is).
+    """
+    return lambda: [a.copy() if isinstance(a, pd.DataFrame) else a for a in args]
+
+
+
+###############################################################################
+### benchmarks
+def get_benchmarks(n_buildings, n_months, n_folderpaths=None, repeat=3, only=None):
+    """
+    Runs all benchmarks for one scale and returns the fastest time per benchmark.
+    Benchmarks whose dependencies (prophet, dash) are not installed are skipped.
+
+    Args:
+        n_buildings (int): Number of buildings.
+        n_months (int): Number of history months.
+        n_folderpaths (int): Number of folderpaths; defaults to one per building.
+        repeat (int): Number of runs per benchmark (the fastest is reported).
+        only (list): Run only the benchmarks with these names.
+
+    Returns:
+        dict: Seconds per benchmark name.
+    """
+    from preprocess import prepare_enablon, prepare_ecf, prepare_fleet, prepare_leaks, prepare_scf, prepare_spot
+    from postprocess import add_columns, get_app_dataframe, get_energy_conversion
+
+    buildings = make_buildings(n_buildings, n_folderpaths)
+    tango_fp = make_tango_fp(buildings)
+    spot_fp_po = make_spot_fp_po(buildings)
+    flag = make_flag(buildings)
+    cf = make_cf()
+    enablon = make_enablon(buildings, n_months)
+    ecf = make_ecf(buildings, n_months)
+    scf = make_scf(buildings, n_months)
+    spot, spot_lookup = make_spot(buildings)
+    df = prepare_enablon(enablon.copy(), flag, tango_fp.copy(), spot_fp_po)
+    prd_df = make_prd_df(df)
+    ecf_prepared = prepare_ecf(ecf.copy())
+    scf_prepared = prepare_scf(scf.copy())
+
+    benchmarks = {
+        'prepare_enablon': (prepare_enablon, copy_args(enablon, flag, tango_fp, spot_fp_po)),
+        'prepare_leaks': (prepare_leaks, copy_args(make_leaks(buildings, n_months), tango_fp, spot_fp_po)),
+        'prepare_fleet': (prepare_fleet, copy_args(make_fleet(buildings, n_months))),
+        'prepare_ecf': (prepare_ecf, copy_args(ecf)),
+        'prepare_scf': (prepare_scf, copy_args(scf)),
+        'prepare_spot': (prepare_spot, copy_args(spot, spot_lookup)),
+        'get_app_dataframe': (get_app_dataframe, copy_args(df, prd_df)),
+    }
+    df_app = get_app_dataframe(df.copy(), prd_df.copy())
+    benchmarks['add_columns'] = (add_columns, copy_args(df_app, df))
+    df_columns = add_columns(df_app.copy(), df)
+    benchmarks['get_energy_conversion_standard'] = (get_energy_conversion, copy_args(df_columns, MEASURE_STANDARD, cf, ecf_prepared, scf_prepared))
+    benchmarks['get_energy_conversion_electricity'] = (get_energy_conversion, copy_args(df_columns, MEASURE_ELECTRICITY, cf, ecf_prepared, scf_prepared))
+
+    try:
+        from model import get_prophet
+        # MAP fits only (mcmc_samples=0): MCMC is too slow to benchmark at scale
+        benchmarks['get_prophet_map'] = (lambda df: get_prophet(df, None, mcmc_samples=0), copy_args(df))
+    except ImportError as e:
+        logger.warning('skip get_prophet benchmark: %s', e)
+
+    try:
+        import app
+        client = MemoryStore()
+        client.set('df_global' + MEASURE_STANDARD, dumps(make_df_global(buildings, n_months)))
+        client.set('df_global' + MEASURE_ELECTRICITY, dumps(make_df_global(buildings, n_months, seed=7)))
+        def load_selection():
+            app.redis_client = client
+            return app.load_redis_objects([MEASURE_STANDARD, MEASURE_ELECTRICITY], ['GMS', 'RnD', 'BioLife', 'GREFP', 'VBU', 'Fleet'],
+                ['Plasma', 'Biologics', 'Japan', 'Small Molecule'], 'CO2 (t)', 'df_global')
+        benchmarks['load_redis_objects'] = (load_selection, lambda: [])
+    except ImportError as e:
+        logger.warning('skip load_redis_objects benchmark: %s', e)
+
+    results = dict()
+    for name, (function, make_args) in benchmarks.items():
+        if only and name not in only:
+            continue
+        results[name] = time_function(function, make_args, 1 if name == 'get_prophet_map' else repeat)
+        logger.info('%s buildings=%s months=%s: %.4f s', name, n_buildings, n_months, results[name])
+    return results
+
+
+
+###############################################################################
+### end-to-end run on the local stand-ins (sqlite warehouse and SPOT, in-memory store)
+def make_fixture_tables(buildings, n_months, measure=MEASURE_ELECTRICITY):
+    """
+    Creates the EDB (gms_us_mart) and SPOT (dbo) fixture tables with the raw column names
+    queried by the extract functions (see queries.py).
+
+    Args:
+        buildings (pd.DataFrame): The building master data (make_buildings).
+        n_months (int): Number of history months.
+        measure (str): The Enablon measure of the usage data.
+
+    Returns:
+        dict: DataFrames per schema and table name (input of backends.load_fixtures).
+    """
+    # usage and refrigerant leakage rollups
+    enablon = make_enablon(buildings, n_months, msr=measure)
+    leaks = make_leaks(buildings, n_months)
+    leaks['CTRY_DESC'] = np.repeat(buildings['Cntry'].values, n_months)
+    rollups = pd.concat([enablon.rename(columns={'Cntry': 'CTRY_DESC'}), leaks], ignore_index=True)
+    rollups['RPRTNG_LVL'] = 'GEO'
+    rollups['EHS_FUNC_DESC'] = None
+    rollups['EHS_BU_DESC'] = None
+    # consumption metrics: fleet, electricity and steam conversion factors (one table, as in EDB)
+    fleet = make_fleet(buildings, n_months).rename(columns={'FOLDERPATH': 'FldrPth', 'BUILDING_ID': 'Building_ID', 'DATE': 'Rprtg_Prd_Key_2',
+        'MSR': 'Rfrnc_Key', 'SYSTM_SPCFIC_MSR': 'Cd_Key_2', 'R_MSR_VAL': 'Unvrsl_Val', 'R_MSR_UNT': 'Unvrsl_Unt'})
+    fleet['Cnspn_Typ'] = 'TET_GHG2'
+    factors = pd.concat([make_ecf(buildings, n_months), make_scf(buildings, n_months)], ignore_index=True)
+    factors = factors.rename(columns={'FOLDERPATH': 'FldrPth', 'Month': 'Rprtg_Prd_Key_2'})
+    metrics = pd.concat([fleet, factors], ignore_index=True)
+    metrics['Rprtg_Prd_Key_2'] = pd.to_datetime(metrics['Rprtg_Prd_Key_2'])
+    for col in ['Cntry', 'Unit', 'Nmbr_Val']:
+        if col not in metrics:
+            metrics[col] = None
+    # SPOT: portfolio owners with their folderpaths and emission reduction projects
+    owners = buildings[['FOLDERPATH', 'PortfolioOwner']].drop_duplicates().reset_index(drop=True)
+    owners['PortfolioOwnerID'] = owners.groupby('PortfolioOwner').ngroup()
+    empo = pd.DataFrame({
+        'EMPortfolioOwnerUniqueID': owners.index,
+        'EMPortfolioOwnerGroup': owners['FOLDERPATH'],
+        'EMPortfolioOwnerID': owners['PortfolioOwnerID'],
+        'LocationReferenceID': owners.index,
+        'LocationReferenceName': owners['FOLDERPATH'],
+        'Comments': None})
+    sppo = owners[['PortfolioOwnerID', 'PortfolioOwner']].drop_duplicates()
+    sppo = sppo.assign(PortfolioID=sppo['PortfolioOwnerID'], PortfolioGroup='SYN', OpU='SYN', Country=None, Region=None, PFID=None, IsEmissionPortfolio=1)
+    spot, spot_lookup = make_spot(buildings)
+    projects = pd.DataFrame({
+        'SPOT ID': spot['SPOT ID'],
+        'Project Name': 'Project ' + spot['SPOT ID'].astype(str),
+        'Project Manager': None,
+        'CAPS Project': 'Yes',
+        'Environmental Portfolio': spot['Environmental Portfolio'],
+        'Impact Realization Date': spot['Impact Realization Date'],
+        'Project Phase': 'Active',
+        'Project State': 'Execute',
+        'Emissions Impact (tons CO2)': spot['EMImpactTonsCO2Year']})
+    problems = pd.DataFrame({
+        'ProblemID': spot['SPOT ID'],
+        'ProblemUniqueID': spot['SPOT ID'] + 100000,
+        'ProjectDescription': 'SYN',
+        'IsCapsProject': 1,
+        'EmissionPortfolioID': spot['Environmental Portfolio'].map(sppo.set_index('PortfolioOwner')['PortfolioOwnerID']),
+        'EmissionsImpactRealizationDate': spot['Impact Realization Date'],
+        'CalculatedEmissionsImpact': spot['EMImpactTonsCO2Year'],
+        'EnergyImpact': spot['EMUnit'],
+        'EnergyCostImpactPerYear': 0.0,
+        'NoCarbonImpact': 0})
+    # the first project is a VPPA contract
+    problems.loc[0, 'ProjectDescription'] = 'VPPA'
+    emdata = pd.DataFrame({
+        'ProjectID': problems['ProblemUniqueID'],
+        'EMSourceID': spot['EMSourceID'],
+        'EMImpactTonsCO2Year': spot['EMImpactTonsCO2Year'],
+        'EMUnit': spot['EMUnit']})
+    abatement = pd.DataFrame({
+        'Project ID': spot['SPOT ID'],
+        'EM Source ID': spot['EMSourceID'],
+        'EM Source Name': spot['EM Source Name'],
+        'TonsCO2': spot['EMImpactTonsCO2Year'],
+        'Net Energy GJ': spot['EMUnit']})
+    return {
+        'gms_us_mart': {
+            'TXN_MRT_EHS_TANGO_MSR_ROLLUPS_GLBL': rollups,
+            'TXN_CNSPN_MTRCS_GLBL': metrics,
+            'REF_MRT_EHS_TANGO_FOOTPRINT': make_flag(buildings)},
+        'dbo': {
+            'EMPortfolioOwner': empo,
+            'SPOTPortfolioOwner': sppo,
+            'Z_CAPS_Consolidated_Project_Listing_Carbon': projects,
+            'ProblemCapture': problems,
+            'EMData': emdata,
+            'FWM_CAPS-Emission Data (Projected Emission Abatement)': abatement}}
+
+
+def write_local_files(buildings, n_months, data_dir):
+    """
+    Writes the local input files of get_local_files (volumes, conversion factors, SPOT lookup) to data_dir.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    months = make_months(n_months)
+    volumes = pd.DataFrame(make_series(buildings.shape[0], n_months, scale=1e3), columns=months.strftime('%Y-%m-%d'))
+    volumes.insert(0, 'Product', 'SYN')
+    volumes.insert(0, 'Site', buildings['BUILDING_ID'].values)
+    volumes.to_csv(os.path.join(data_dir, 'Volume_Past.csv'), index=False)
+    volumes.to_csv(os.path.join(data_dir, 'Volume_Future.csv'), index=False)
+    make_cf().to_csv(os.path.join(data_dir, 'Energy_Conversion_Factors.csv'), index=False, encoding='windows-1252')
+    make_spot(buildings)[1].to_csv(os.path.join(data_dir, 'SPOT_LOOKUP_Table.csv'), index=False)
+
+
+def run_end_to_end(n_buildings, n_months, measure=MEASURE_ELECTRICITY, work_dir=None, concurrent=False):
+    """
+    Runs ETL -> predict -> publish -> dashboard query for one measure on the local stand-ins:
+    sqlite fixtures for EDB and SPOT, local files in a work directory and the in-memory store.
+    Prophet is fitted with MAP estimates unless MCMC_SAMPLES is set. Needs no network.
+
+    Args:
+        n_buildings (int): Number of buildings.
+        n_months (int): Number of history months.
+        measure (str): The measure to predict.
+        work_dir (str): Directory of fixtures and local files; defaults to a temporary directory.
+        concurrent (bool): Run the concurrent ETL mode.
+
+    Returns:
+        dict: Seconds per pipeline step.
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix='co2_e2e_')
+    os.environ.update({
+        'WAREHOUSE_BACKEND': 'sqlite',
+        'SPOT_BACKEND': 'sqlite',
+        'STORE_BACKEND': 'memory',
+        'FIXTURE_DIR': os.path.join(work_dir, 'fixtures'),
+        'DATA_DIR': os.path.join(work_dir, 'data'),
+        'QUERY_CACHE': '0'})
+    os.environ.setdefault('MCMC_SAMPLES', '0')
+    buildings = make_buildings(n_buildings)
+    load_fixtures(make_fixture_tables(buildings, n_months, measure))
+    write_local_files(buildings, n_months, os.environ['DATA_DIR'])
+
+    from run_pipeline import run_etl, run_prediction
+    from store import store_data
+    timings = dict()
+    start = time.perf_counter()
+    spot_fp_po, spot, leaks, fleet, tango_fp, flag, vppa, msrs, cf, ecf, scf, vol = run_etl(concurrent)
+    timings['etl'] = time.perf_counter() - start
+    start = time.perf_counter()
+    store_data(leaks, fleet, spot, vppa, flag, vol)
+    timings['store_data'] = time.perf_counter() - start
+    start = time.perf_counter()
+    run_prediction('Scope 2', measure, spot_fp_po, spot, tango_fp, flag, vppa, cf, ecf, scf, vol)
+    timings['predict_publish'] = time.perf_counter() - start
+    try:
+        import app
+        app.redis_client = get_store()
+        start = time.perf_counter()
+        app.load_redis_objects([measure, 'Refrigerant Leaks', 'Fleet'], list(business_unit.keys()), [], 'CO2 (t)', 'df_global')
+        timings['dashboard_query'] = time.perf_counter() - start
+    except ImportError as e:
+        logger.warning('skip dashboard query: %s', e)
+    for name, seconds in timings.items():
+        logger.info('e2e %s buildings=%s months=%s: %.4f s', name, n_buildings, n_months, seconds)
+    return timings
+
+
+
+###############################################################################
+### store payload codecs
+# size and time of the objects published per measure for every installed codec and level; the objects
+# come from an end-to-end run on the local stand-ins (MCMC_SAMPLES sets the posterior samples the models carry)
+# decode_seconds includes unpickling: the time a dashboard callback spends on a value
+CODEC_OBJECTS = ['prophet_models', 'prophet_fcst', 'cv_dict', 'df_global', 'prophet_residuals', 'samples']
+CODEC_LEVELS = {'zlib': [1, 6, 9], 'zstd': [1, 3, 9, 19], 'lz4': [0, 9]}
+
+
+def get_codec_benchmarks(objects, codecs=None, repeat=3):
+    """
+    Encodes and decodes objects with every codec and level.
+
+    Args:
+        objects (dict): The objects per name.
+        codecs (list): The codecs (default: the installed codecs).
+        repeat (int): Number of runs (the fastest is reported).
+
+    Returns:
+        pd.DataFrame: Columns object, codec, level, bytes, ratio (pickle size / encoded size),
+            encode_seconds, decode_seconds.
+    """
+    rows = []
+    for name, obj in objects.items():
+        payload = pickle.dumps(obj)
+        for codec in codecs or get_available_codecs():
+            for level in CODEC_LEVELS.get(codec, [0]):
+                value = encode(payload, codec, level)
+                rows.append({'object': name, 'codec': codec, 'level': level, 'bytes': len(value),
+                    'ratio': len(payload) / len(value),
+                    'encode_seconds': time_function(encode, lambda: [payload, codec, level], repeat),
+                    'decode_seconds': time_function(loads, lambda: [value], repeat)})
+    return pd.DataFrame(rows)
+
+
+def run_codec_benchmarks(n_buildings, n_months, measure=MEASURE_ELECTRICITY, repeat=3):
+    """
+    Publishes the objects of one measure with an end-to-end run and benchmarks the codecs on them.
+    """
+    run_end_to_end(n_buildings, n_months, measure)
+    store = get_store()
+    objects = dict()
+    for name in CODEC_OBJECTS:
+        value = store.get(name + measure)
+        if value is not None:
+            objects[name] = loads(value)
+    codecs = get_codec_benchmarks(objects, repeat=repeat)
+    codecs['buildings'] = n_buildings
+    codecs['months'] = n_months
+    return codecs
+
+
+
+###############################################################################
+### scaling curves
+def get_scaling(timings):
+    """
+    Fits the scaling exponent per benchmark: the slope of log(seconds) over log(buildings).
+    An exponent near 1 means linear scaling; values near 2 indicate quadratic loops.
+
+    Args:
+        timings (pd.DataFrame): Columns benchmark, buildings, seconds.
+
+    Returns:
+        pd.DataFrame: Columns benchmark, exponent.
+    """
+    scaling = []
+    for name, dat in timings.groupby('benchmark'):
+        dat = dat.loc[dat['seconds'] > 0]
+        if dat['buildings'].nunique() < 2:
+            exponent = np.nan
+        else:
+            exponent = np.polyfit(np.log(dat['buildings']), np.log(dat['seconds']), 1)[0]
+        scaling.append({'benchmark': name, 'exponent': round(exponent, 2)})
+    return pd.DataFrame(scaling)
+
+
+def compare_baseline(timings, baseline, tolerance):
+    """
+    Compares the timings with a stored baseline run and returns the regressions:
+    benchmarks slower than tolerance times the baseline at the same scale.
+    """
+    merged = pd.merge(timings, baseline, on=['benchmark', 'buildings', 'months'], suffixes=('', '_baseline'))
+    merged['ratio'] = merged['seconds'] / merged['seconds_baseline']
+    return merged.loc[merged['ratio'] > tolerance]
+
+
+def run_benchmarks(buildings, months, folderpaths=None, repeat=3, only=None):
+    """
+    Runs the benchmarks for every combination of scales.
+
+    Returns:
+        pd.DataFrame: Columns benchmark, buildings, months, seconds.
+    """
+    rows = []
+    for n_months in months:
+        for n_buildings in buildings:
+            results = get_benchmarks(n_buildings, n_months, folderpaths, repeat, only)
+            for name, seconds in results.items():
+                rows.append({'benchmark': name, 'buildings': n_buildings, 'months': n_months, 'seconds': seconds})
+    return pd.DataFrame(rows)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline pipeline benchmarks on synthetic Enablon-shaped data.')
+    parser.add_argument('--buildings', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--months', type=int, nargs='+', default=[96])
+    parser.add_argument('--folderpaths', type=int, default=None, help='number of folderpaths (default: one per building)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', default=None, help='names of the benchmarks to run')
+    parser.add_argument('--output', default=None, help='write the timings to this JSON file')
+    parser.add_argument('--baseline', default=None, help='JSON file of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed slowdown factor versus the baseline')
+    parser.add_argument('--e2e', action='store_true', help='time a full pipeline run on the local stand-ins instead')
+    parser.add_argument('--codecs', action='store_true', help='compare the store codecs on the objects of a pipeline run instead')
+    args = parser.parse_args()
+
+    if args.codecs:
+        codecs = pd.concat([run_codec_benchmarks(n_buildings, n_months, repeat=args.repeat) for n_months in args.months for n_buildings in args.buildings])
+        print(codecs.round(4).to_string(index=False))
+        if args.output:
+            codecs.to_json(args.output, orient='records', indent=2)
+        raise SystemExit(0)
+
+    if args.e2e:
+        rows = []
+        for n_months in args.months:
+            for n_buildings in args.buildings:
+                for name, seconds in run_end_to_end(n_buildings, n_months).items():
+                    rows.append({'benchmark': 'e2e_' + name, 'buildings': n_buildings, 'months': n_months, 'seconds': seconds})
+        timings = pd.DataFrame(rows)
+    else:
+        timings = run_benchmarks(args.buildings, args.months, args.folderpaths, args.repeat, args.only)
+    print(timings.pivot_table(index='benchmark', columns=['months', 'buildings'], values='seconds').round(4).to_string())
+    print(get_scaling(timings).to_string(index=False))
+    if args.output:
+        timings.to_json(args.output, orient='records', indent=2)
+    if args.baseline:
+        regressions = compare_baseline(timings, pd.read_json(args.baseline, orient='records'), args.tolerance)
+        if regressions.shape[0] > 0:
+            print('regressions:')
+            print(regressions.to_string(index=False))
+            raise SystemExit(1)
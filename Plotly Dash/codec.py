@@ -0,0 +1,151 @@
+#############
+### codec ###
+#############
+
+import os
+import pickle
+import struct
+import zlib
+
+from log import(
+    get_logger
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### payload encoding
+# the objects published to the result store (models with their posterior samples, forecasts,
+# cross-validation results, df_global) are pickled and compressed; a compressed value starts with
+# a header: MAGIC, the codec id and the length of the uncompressed payload
+# values without the header (pickles written before the encoding, JSON reports, small payloads) are
+# returned unchanged, so old and new values can be read side by side
+# STORE_CODEC: zstd (default, optional dependency zstandard), lz4 (optional dependency lz4), zlib or none;
+#   a codec that is not installed falls back on zlib
+# STORE_CODEC_LEVEL: compression level (default: the default level of the codec)
+# STORE_CODEC_MIN_BYTES: payloads smaller than this are not compressed (default 1024)
+MAGIC = b'CO2C'
+HEADER = struct.Struct('>4sBQ')
+CODEC_IDS = {'none': 0, 'zlib': 1, 'zstd': 2, 'lz4': 3}
+DEFAULT_LEVELS = {'none': 0, 'zlib': 6, 'zstd': 3, 'lz4': 0}
+
+_missing_codecs = set()
+
+
+def get_codec():
+    return os.environ.get('STORE_CODEC', 'zstd')
+
+
+def get_codec_level(codec):
+    level = os.environ.get('STORE_CODEC_LEVEL')
+    return int(level) if level is not None else DEFAULT_LEVELS[codec]
+
+
+def get_min_bytes():
+    return int(os.environ.get('STORE_CODEC_MIN_BYTES', 1024))
+
+
+def get_available_codecs():
+    """
+    Lists the codecs whose libraries are installed.
+    """
+    codecs = ['none', 'zlib']
+    for codec, module in [('zstd', 'zstandard'), ('lz4', 'lz4.frame')]:
+        try:
+            __import__(module)
+            codecs.append(codec)
+        except ImportError:
+            pass
+    return codecs
+
+
+
+###############################################################################
+### compression
+def compress(payload, codec, level):
+    if codec == 'none':
+        return payload
+    if codec == 'zlib':
+        return zlib.compress(payload, level)
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(payload)
+    if codec == 'lz4':
+        import lz4.frame
+        return lz4.frame.compress(payload, compression_level=level)
+    raise ValueError('unknown codec ' + codec)
+
+
+def decompress(data, codec_id, size):
+    if codec_id == CODEC_IDS['none']:
+        return bytes(data)
+    if codec_id == CODEC_IDS['zlib']:
+        return zlib.decompress(data)
+    if codec_id == CODEC_IDS['zstd']:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+    if codec_id == CODEC_IDS['lz4']:
+        import lz4.frame
+        return lz4.frame.decompress(data)
+    raise ValueError('unknown codec id ' + str(codec_id))
+
+
+def encode(payload, codec=None, level=None):
+    """
+    Compresses a payload and prepends the codec header.
+
+    Args:
+        payload (bytes): The payload (e.g. a pickle).
+        codec (str): The codec (default: STORE_CODEC).
+        level (int): The compression level (default: STORE_CODEC_LEVEL or the codec default).
+
+    Returns:
+        bytes: The encoded value; small payloads and codec 'none' are returned unchanged.
+    """
+    codec = codec or get_codec()
+    if codec == 'none' or len(payload) < get_min_bytes():
+        return payload
+    try:
+        data = compress(payload, codec, get_codec_level(codec) if level is None else level)
+    except ImportError:
+        if codec not in _missing_codecs:
+            logger.warning('codec %s not installed, use zlib', codec)
+            _missing_codecs.add(codec)
+        codec = 'zlib'
+        data = compress(payload, codec, DEFAULT_LEVELS[codec] if level is None else min(max(level, 0), 9))
+    return HEADER.pack(MAGIC, CODEC_IDS[codec], len(payload)) + data
+
+
+def decode(value):
+    """
+    Removes the codec header and decompresses a value; values without header are returned unchanged.
+
+    Args:
+        value (bytes): The stored value (None for missing keys).
+
+    Returns:
+        bytes: The payload.
+    """
+    if value is None or len(value) < HEADER.size or value[:len(MAGIC)] != MAGIC:
+        return value
+    magic, codec_id, size = HEADER.unpack_from(value)
+    return decompress(memoryview(value)[HEADER.size:], codec_id, size)
+
+
+
+###############################################################################
+### objects
+def dumps(obj, codec=None, level=None, protocol=None):
+    """
+    Pickles and encodes an object for the result store.
+    """
+    return encode(pickle.dumps(obj, protocol=protocol), codec, level)
+
+
+def loads(value):
+    """
+    Decodes and unpickles a value of the result store (encoded or written as plain pickle).
+    """
+    return pickle.loads(decode(value))
@@ -0,0 +1,311 @@
+###########
+### dag ###
+###########
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import functools
+import hashlib
+import os
+import pickle
+import types
+
+from log import(
+    get_logger
+)
+
+logger = get_logger(__name__)
+
+
+###############################################################################
+### stage definition
+# name (str): unique name of the stage
+# function (callable): called with the inputs in the declared order
+# inputs (list): names of the stage inputs (outputs of other stages or run inputs)
+# outputs (list): names of the stage outputs; a function with several outputs returns a tuple
+# cache (bool): store the outputs on disk; side-effect stages (e.g. publish to redis) are not cached
+# params (dict): settings the function reads besides its inputs (e.g. environment variables), part of the cache key
+Stage = namedtuple('Stage', ['name', 'function', 'inputs', 'outputs', 'cache', 'params'], defaults=[True, None])
+
+
+
+###############################################################################
+### hashing
+def hash_object(obj):
+    """
+    Hashes a python object through its pickled representation.
+
+    Args:
+        obj: Any picklable object (e.g. a DataFrame or a string).
+
+    Returns:
+        str: The sha256 hex digest.
+    """
+    return hashlib.sha256(pickle.dumps(obj, protocol=4)).hexdigest()
+
+
+def hash_value(value, seen):
+    # callables by their code, other values by their pickle; objects that cannot be pickled (locks,
+    # connections) by their type
+    if callable(value) and not isinstance(value, type):
+        return hash_function(value, seen)
+    try:
+        return hash_object(value)
+    except Exception:
+        return hash_object(type(value).__qualname__)
+
+
+def hash_code(code, globals_, seen):
+    """
+    Hashes a code object: the bytecode, the constants (nested functions and lambdas included), the
+    referenced names and the project functions and module constants they resolve to. Private module
+    state (names starting with _, e.g. caches and locks) is not part of the hash.
+    """
+    parts = [code.co_code.hex(), repr(code.co_names)]
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            parts.append(hash_code(const, globals_, seen))
+        elif isinstance(const, frozenset):
+            # the order of a set depends on the hash seed of the process
+            parts.append(repr(sorted(repr(c) for c in const)))
+        else:
+            parts.append(repr(const))
+    for name in code.co_names:
+        value = globals_.get(name)
+        if value is None or name.startswith('_') or isinstance(value, types.ModuleType):
+            continue
+        if isinstance(value, (types.FunctionType, functools.partial)):
+            parts.append(name + hash_function(value, seen))
+        elif callable(value):
+            # classes and library functions by their name
+            parts.append(name + (getattr(value, '__module__', None) or '') + (getattr(value, '__qualname__', None) or ''))
+        else:
+            parts.append(name + hash_value(value, seen))
+    return hashlib.sha256(''.join(parts).encode('utf-8')).hexdigest()
+
+
+def hash_function(function, seen=None):
+    """
+    Hashes a stage function for the cache key: its code with constants, default arguments and
+    closure cells, the wrapped function of partials and decorators, and recursively the functions
+    of this project (modules next to dag.py) it calls. Classes and library functions are identified
+    by name.
+
+    Args:
+        function (callable): The function.
+        seen (dict): Hashes of the functions already visited (breaks recursion cycles).
+
+    Returns:
+        str: The sha256 hex digest.
+    """
+    seen = dict() if seen is None else seen
+    if id(function) in seen:
+        return seen[id(function)]
+    seen[id(function)] = 'cycle'
+    if isinstance(function, functools.partial):
+        parts = [hash_function(function.func, seen), hash_value(function.args, seen), hash_value(function.keywords, seen)]
+    elif isinstance(function, types.MethodType):
+        parts = [hash_function(function.__func__, seen), hash_value(function.__self__, seen)]
+    elif isinstance(function, types.FunctionType) and is_project_code(function.__code__):
+        parts = [hash_code(function.__code__, function.__globals__, seen),
+                 hash_value(function.__defaults__, seen), hash_value(function.__kwdefaults__, seen)]
+        for cell in function.__closure__ or ():
+            try:
+                parts.append(hash_value(cell.cell_contents, seen))
+            except ValueError:
+                # empty cell
+                parts.append('')
+        if hasattr(function, '__wrapped__'):
+            parts.append(hash_function(function.__wrapped__, seen))
+    else:
+        parts = [getattr(function, '__module__', None) or '', getattr(function, '__qualname__', None) or repr(type(function))]
+    seen[id(function)] = hashlib.sha256(''.join(parts).encode('utf-8')).hexdigest()
+    return seen[id(function)]
+
+
+def is_project_code(code):
+    return os.path.dirname(os.path.abspath(code.co_filename)) == os.path.dirname(os.path.abspath(__file__))
+
+
+def get_stage_keys(stages, inputs):
+    """
+    Derives the cache key of every stage from the hashes of its inputs, its function (see
+    hash_function) and its params. Outputs of a stage are identified by the key of the producing
+    stage, so downstream keys change whenever an upstream input, the code, closure or params of an
+    upstream stage change - without hashing large intermediate objects such as fitted models.
+    Settings a function reads from the environment are only seen through the stage params.
+
+    Args:
+        stages (list): The Stage definitions.
+        inputs (dict): The run inputs (name: value).
+
+    Returns:
+        dict: The cache key per stage name.
+    """
+    producer = get_producers(stages, inputs)
+    input_hashes = {name: hash_object(value) for name, value in inputs.items()}
+    keys = dict()
+    seen = dict()
+    for stage in sort_stages(stages, inputs):
+        parts = [stage.name, hash_function(stage.function, seen), hash_object(sorted((stage.params or dict()).items()))]
+        for i in stage.inputs:
+            if i in input_hashes:
+                parts.append(input_hashes[i])
+            else:
+                parts.append(keys[producer[i].name] + i)
+        keys[stage.name] = hashlib.sha256(''.join(parts).encode('utf-8')).hexdigest()[:20]
+    return keys
+
+
+
+###############################################################################
+### graph helpers
+def get_producers(stages, inputs):
+    """
+    Maps every output name to the stage producing it and checks that all inputs are available.
+
+    Args:
+        stages (list): The Stage definitions.
+        inputs (dict): The run inputs (name: value).
+
+    Returns:
+        dict: The producing Stage per output name.
+    """
+    producer = dict()
+    for stage in stages:
+        for o in stage.outputs:
+            if o in producer or o in inputs:
+                raise ValueError('output ' + o + ' is produced more than once')
+            producer[o] = stage
+    for stage in stages:
+        for i in stage.inputs:
+            if i not in producer and i not in inputs:
+                raise ValueError('input ' + i + ' of stage ' + stage.name + ' is not available')
+    return producer
+
+
+def sort_stages(stages, inputs):
+    """
+    Sorts the stages topologically (every stage after the stages producing its inputs).
+
+    Args:
+        stages (list): The Stage definitions.
+        inputs (dict): The run inputs (name: value).
+
+    Returns:
+        list: The sorted stages.
+    """
+    producer = get_producers(stages, inputs)
+    sorted_stages = []
+    done = set()
+    def visit(stage, path):
+        if stage.name in done:
+            return
+        if stage.name in path:
+            raise ValueError('cycle in stage ' + stage.name)
+        for i in stage.inputs:
+            if i in producer:
+                visit(producer[i], path + [stage.name])
+        done.add(stage.name)
+        sorted_stages.append(stage)
+    for stage in stages:
+        visit(stage, [])
+    return sorted_stages
+
+
+
+###############################################################################
+### executor
+def run_dag(stages, inputs, targets=None, cache_dir=None, max_workers=4):
+    """
+    Runs a pipeline declared as stages with inputs and outputs. Stages whose inputs are
+    available run concurrently in a thread pool. With a cache_dir, the outputs of every
+    finished stage are pickled to disk under its input hash: a failed run that is started
+    again resumes from the last good stages, and only stages with changed inputs are rerun.
+
+    Args:
+        stages (list): The Stage definitions.
+        inputs (dict): The run inputs (name: value).
+        targets (list): The output names to return; defaults to the outputs of all stages.
+        cache_dir (str): Directory of the stage output cache; no caching if None.
+        max_workers (int): Maximum number of stages running at the same time.
+
+    Returns:
+        dict: The requested outputs (name: value).
+    """
+    stages = sort_stages(stages, inputs)
+    producer = get_producers(stages, inputs)
+    keys = get_stage_keys(stages, inputs) if cache_dir is not None else dict()
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    if targets is None:
+        targets = [o for stage in stages for o in stage.outputs]
+
+    def cache_path(stage):
+        return os.path.join(cache_dir, stage.name.replace('/', '_') + '_' + keys[stage.name] + '.pkl')
+
+    def is_cached(stage):
+        return cache_dir is not None and stage.cache and os.path.exists(cache_path(stage))
+
+    # find the stages that must run: non-cached stages producing a target or an input of a stage that must run
+    required = set()
+    def require(stage):
+        if stage.name in required:
+            return
+        required.add(stage.name)
+        if is_cached(stage):
+            return
+        for i in stage.inputs:
+            if i in producer:
+                require(producer[i])
+    for o in targets:
+        if o in producer:
+            require(producer[o])
+    # side-effect stages always run
+    for stage in stages:
+        if not stage.cache:
+            require(stage)
+
+    results = dict(inputs)
+    pending = [stage for stage in stages if stage.name in required]
+    # load cached stages
+    for stage in list(pending):
+        if is_cached(stage):
+            logger.info('dag: load cached stage %s', stage.name)
+            with open(cache_path(stage), 'rb') as f:
+                results.update(pickle.load(f))
+            pending.remove(stage)
+
+    def execute(stage):
+        logger.info('dag: run stage %s', stage.name)
+        value = stage.function(*[results[i] for i in stage.inputs])
+        if len(stage.outputs) == 1:
+            value = (value,)
+        elif len(stage.outputs) == 0:
+            value = ()
+        outputs = dict(zip(stage.outputs, value))
+        if cache_dir is not None and stage.cache:
+            with open(cache_path(stage) + '.tmp', 'wb') as f:
+                pickle.dump(outputs, f)
+            os.replace(cache_path(stage) + '.tmp', cache_path(stage))
+        return outputs
+
+    # run the remaining stages as soon as their inputs are available
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    running = dict()
+    try:
+        while pending or running:
+            for stage in list(pending):
+                if all(i in results for i in stage.inputs):
+                    running[executor.submit(execute, stage)] = stage
+                    pending.remove(stage)
+            if not running:
+                raise ValueError('stages cannot be scheduled: ' + ', '.join(s.name for s in pending))
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                running.pop(future)
+                # re-raise the exception of a failed stage; finished stages stay cached for the next run
+                results.update(future.result())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return {o: results[o] for o in targets if o in results}
@@ -0,0 +1,195 @@
+##############
+### export ###
+##############
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from flask import(
+    Response,
+    request,
+    stream_with_context
+)
+
+from log import(
+    get_logger,
+    shape
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### export service
+# the dashboard downloads are served by flask routes on the dash server (/export/<kind>?format=...&<selection>)
+# instead of dcc.Download callbacks: the table is built from the server-side data, CSV is streamed in
+# chunks while it is written to the export cache, parquet and xlsx (optional dependencies pyarrow and
+# openpyxl) are written to the cache first; a request for the same selection and published data version
+# (backends.get_published_version) within EXPORT_MAX_AGE seconds (default 900) streams the cached file;
+# expired files are deleted before a new export is written
+# EXPORT_DIR: directory of the export cache (default: <tmp>/co2_exports)
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+CSV_CHUNK_ROWS = 10000
+FILE_CHUNK_BYTES = 1 << 16
+
+
+def get_export_dir():
+    export_dir = os.environ.get('EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'co2_exports'))
+    os.makedirs(export_dir, exist_ok=True)
+    return export_dir
+
+
+def get_export_max_age():
+    return int(os.environ.get('EXPORT_MAX_AGE', 900))
+
+
+def get_selection_hash(kind, selection, version=''):
+    """
+    Hashes an export kind, its selection (query arguments without the format) and the version of the
+    published data.
+    """
+    key = json.dumps({'kind': kind, 'selection': selection, 'version': version}, sort_keys=True, default=str)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def get_cached_export(path, max_age=None):
+    """
+    Returns the path of a cached export younger than max_age seconds, None otherwise.
+    """
+    max_age = get_export_max_age() if max_age is None else max_age
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age:
+        return path
+    return None
+
+
+def remove_expired_exports(export_dir=None, max_age=None):
+    """
+    Deletes the exports (and abandoned temporary files) older than max_age seconds.
+
+    Returns:
+        int: The number of deleted files.
+    """
+    export_dir = export_dir or get_export_dir()
+    max_age = get_export_max_age() if max_age is None else max_age
+    now = time.time()
+    removed = 0
+    for file_name in os.listdir(export_dir):
+        path = os.path.join(export_dir, file_name)
+        try:
+            if os.path.isfile(path) and now - os.path.getmtime(path) >= max_age:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            # removed by a concurrent request
+            continue
+    if removed:
+        logger.info('removed %s expired exports', removed)
+    return removed
+
+
+
+###############################################################################
+### writers
+def get_temporary_path(path):
+    # concurrent requests of the same selection write their own file; the last rename wins
+    return path + '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+
+
+def iter_csv(dat, path, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Yields a table as CSV in chunks of rows and writes the chunks to the export cache.
+
+    Args:
+        dat (pd.DataFrame): The table.
+        path (str): The cache file.
+        chunk_rows (int): The number of rows per chunk.
+
+    Yields:
+        str: The CSV chunks (the first one with the header).
+    """
+    temporary = get_temporary_path(path)
+    try:
+        with open(temporary, 'w', newline='', encoding='utf-8') as f:
+            for start in range(0, max(dat.shape[0], 1), chunk_rows):
+                chunk = dat.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0)
+                f.write(chunk)
+                yield chunk
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def write_export(dat, path, export_format):
+    """
+    Writes a table to the export cache as parquet or xlsx.
+    """
+    temporary = get_temporary_path(path)
+    try:
+        if export_format == 'parquet':
+            dat.to_parquet(temporary, index=False)
+        else:
+            dat.to_excel(temporary, index=False, engine='openpyxl')
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def iter_file(path, chunk_bytes=FILE_CHUNK_BYTES):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            yield chunk
+
+
+
+###############################################################################
+### routes
+def register_export_routes(server, loaders, url_base='/export/', get_version=None):
+    """
+    Adds the export route to the flask server of the dash app.
+
+    Args:
+        server (flask.Flask): The server (app.server).
+        loaders (dict): Per export kind a tuple (file name without extension, function building the
+            table from the selection: a dict of the query arguments, each a list of values).
+        url_base (str): The route prefix.
+        get_version (callable): Returns the version of the published data (part of the cache key).
+    """
+    def export(kind):
+        if kind not in loaders:
+            return Response('unknown export ' + kind, status=404)
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response('unknown format ' + export_format, status=400)
+        selection = {key: request.args.getlist(key) for key in sorted(request.args) if key != 'format'}
+        file_name, load_table = loaders[kind]
+        version = get_version() if get_version is not None else ''
+        path = os.path.join(get_export_dir(), kind + '_' + get_selection_hash(kind, selection, version) + '.' + export_format)
+        headers = {'Content-Disposition': 'attachment; filename="' + file_name + '.' + export_format + '"'}
+        if get_cached_export(path) is not None:
+            logger.info('export %s %s from cache', kind, export_format)
+            return Response(iter_file(path), mimetype=EXPORT_FORMATS[export_format], headers=headers)
+        remove_expired_exports()
+        dat = load_table(selection)
+        logger.info('export %s %s %s', kind, export_format, shape(dat))
+        if export_format == 'csv':
+            return Response(stream_with_context(iter_csv(dat, path)), mimetype=EXPORT_FORMATS[export_format], headers=headers)
+        try:
+            write_export(dat, path, export_format)
+        except ImportError as e:
+            logger.warning('export %s not available: %s', export_format, e)
+            return Response('format ' + export_format + ' not available', status=501)
+        return Response(iter_file(path), mimetype=EXPORT_FORMATS[export_format], headers=headers)
+    server.add_url_rule(url_base + '<kind>', 'export', export)
@@ -7,7 +7,18 @@ from dateutil.relativedelta import relativedelta
 import numpy as np
 import os
 import pandas as pd
-import pickle
+
+from log import(
+    get_logger
+)
+from registry import(
+    load_models,
+    load_run_object,
+    save_models,
+    save_run_objects
+)
+
+logger = get_logger(__name__)
 
 
 # get the yearly quarter
@@ -29,16 +40,118 @@ def get_fiscal_month(x):
         return x - 3
 
 
+
+###############################################################################
+### month dimension
+# calendar and fiscal year/quarter/month of every month, computed once and shared by the pipeline
+# (date_conversion) and the app (get_current_year); the fiscal year starts in April and is named
+# after the calendar year it starts in (January 2024 is month 10 of fiscal year 2023)
+# rows are keyed by year * 12 + month - 1; the table covers MONTH_DIMENSION_YEARS and is extended
+# when a frame reaches beyond them
+FISCAL_YEAR_START = 4
+MONTH_DIMENSION_YEARS = (2000, 2060)
+_month_dimensions = dict()
+
+
+def get_month_dimension(first_year=None, last_year=None):
+    """
+    Returns the month dimension table covering at least the given years.
+    
+    Args:
+        first_year (int): The first calendar year needed.
+        last_year (int): The last calendar year needed.
+    
+    Returns:
+        pd.DataFrame: Columns Month, C_MNTH, C_YEAR, C_QRTR, F_MNTH, F_YEAR, F_QRTR (int16), indexed by the month key.
+    """
+    first_year = min(first_year or MONTH_DIMENSION_YEARS[0], MONTH_DIMENSION_YEARS[0])
+    last_year = max(last_year or MONTH_DIMENSION_YEARS[1], MONTH_DIMENSION_YEARS[1])
+    if (first_year, last_year) not in _month_dimensions:
+        month = pd.date_range(str(first_year) + '-01-01', str(last_year) + '-12-01', freq='MS')
+        c_mnth = month.month.values
+        f_mnth = (c_mnth - FISCAL_YEAR_START) % 12 + 1
+        dimension = pd.DataFrame({
+            'Month': month,
+            'C_MNTH': c_mnth,
+            'C_YEAR': month.year.values,
+            'C_QRTR': (c_mnth - 1) // 3 + 1,
+            'F_MNTH': f_mnth,
+            'F_YEAR': month.year.values - (c_mnth < FISCAL_YEAR_START),
+            'F_QRTR': (f_mnth - 1) // 3 + 1},
+            index=pd.Index(month.year.values * 12 + c_mnth - 1, name='month_key'))
+        for col in ['C_MNTH', 'C_YEAR', 'C_QRTR', 'F_MNTH', 'F_YEAR', 'F_QRTR']:
+            dimension[col] = dimension[col].astype(np.int16)
+        _month_dimensions[(first_year, last_year)] = dimension
+    return _month_dimensions[(first_year, last_year)]
+
+
 def date_conversion(dat):
     try:
-        dat['C_MNTH'] = dat['Impact Month'].dt.month
-        dat['C_YEAR'] = dat['Impact Month'].dt.year
-        dat['C_QRTR'] = dat['Impact Month'].dt.month.apply(get_quarter)
-        dat['F_MNTH'] = dat['Impact Month'].dt.month.apply(get_fiscal_month)
-        dat['F_YEAR'] = np.where((dat['Impact Month'].dt.month.isin([1,2,3])), dat['Impact Month'].dt.year - 1, dat['Impact Month'].dt.year)
-        dat['F_QRTR'] = dat['F_MNTH'].apply(get_quarter)
+        month = dat['Impact Month']
+        month_key = month.dt.year * 12 + month.dt.month - 1
+        years = month.dt.year.dropna()
+        dimension = get_month_dimension(int(years.min()), int(years.max())) if len(years) else get_month_dimension()
+        values = dimension.reindex(month_key.values)
+        for col in ['C_MNTH', 'C_YEAR', 'C_QRTR', 'F_MNTH', 'F_YEAR', 'F_QRTR']:
+            dat[col] = values[col].values
     except:
-        print('failed date_conversion()')
+        logger.warning('failed date_conversion()')
+    return dat
+
+
+def get_current_year(calendar='Fiscal Year', now=None):
+    """
+    Looks up the current fiscal or calendar year in the month dimension.
+    
+    Args:
+        calendar (str): 'Fiscal Year' or 'Calendar Year'.
+        now (datetime): The reference date (default: now).
+    
+    Returns:
+        int: The year.
+    """
+    now = now or datetime.now()
+    row = get_month_dimension(now.year, now.year).loc[now.year * 12 + now.month - 1]
+    return int(row['F_YEAR'] if calendar == 'Fiscal Year' else row['C_YEAR'])
+
+
+
+###############################################################################
+### compact schema of the published frames
+# df_global (per measure), leaks and fleet are published to redis and loaded and filtered on every
+# dashboard request: categories for the labels, int16 for the calendar and fiscal columns, float32
+# for the values; missing values (e.g. failed energy conversions, missing factors) stay NaN so the
+# dashboard shows gaps, as do missing interval bounds (actuals); missing SPOT impacts are zeros
+PUBLISHED_CATEGORIES = ['PortfolioOwner', 'type']
+PUBLISHED_INTEGERS = ['C_MNTH', 'C_YEAR', 'C_QRTR', 'F_MNTH', 'F_YEAR', 'F_QRTR']
+PUBLISHED_VALUES = ['y', 'y_with_spot', 'y_ghg', 'y_ghg_with_spot']
+PUBLISHED_IMPACTS = ['Emission Impact Sum', 'Emission Impact Accumulated', 'Energy Impact Sum', 'Energy Impact Accumulated']
+PUBLISHED_INTERVALS = ['yhat_lower', 'yhat_upper']
+
+
+def compact_frame(dat):
+    """
+    Converts a published frame to the compact schema (columns not in the schema are kept as they are).
+    
+    Args:
+        dat (pd.DataFrame): The frame (df_global, leaks or fleet).
+    
+    Returns:
+        pd.DataFrame: The frame with compact dtypes.
+    """
+    dat = dat.copy()
+    for col in PUBLISHED_CATEGORIES:
+        if col in dat.columns:
+            dat[col] = dat[col].astype('category')
+    for col in PUBLISHED_INTEGERS:
+        if col in dat.columns:
+            dat[col] = pd.to_numeric(dat[col], errors='coerce').fillna(0).astype(np.int16)
+    for col in PUBLISHED_IMPACTS:
+        if col in dat.columns:
+            dat[col] = pd.to_numeric(dat[col], errors='coerce').fillna(0).astype(np.float32)
+    for col in PUBLISHED_VALUES + PUBLISHED_INTERVALS:
+        if col in dat.columns:
+            dat[col] = pd.to_numeric(dat[col], errors='coerce').astype(np.float32)
     return dat
 
 
@@ -46,34 +159,31 @@ def date_conversion(dat):
 ###############################################################################
 ### save objects
 ###############################################################################
-def save_objects(prophet_models, prophet_fcst, cv_dict, pm_dict):
-    prophet_models_filtered = {k: v for k, v in prophet_models.items() if v is not None}
-    for i in prophet_models_filtered.keys():
-        with open('serialized_model'+i+'.json', 'w') as fout:
-            fout.write(model_to_json(prophet_models_filtered[i]))
-    with open('prophet_fcst.pkl', 'wb') as f:
-        pickle.dump(prophet_fcst, f)
-    with open('cross_validation.pkl', 'wb') as f:
-        pickle.dump(cv_dict, f)
-    with open('performance_metric.pkl', 'wb') as f:
-        pickle.dump(pm_dict, f)
-    return
+def save_objects(prophet_models, prophet_fcst, cv_dict, pm_dict, measure, run_id=None):
+    """
+    Writes the models (one file per building), forecasts and cross-validation results of one measure
+    to the model registry (see registry.py).
+
+    Returns:
+        str: The run id.
+    """
+    run_id = save_models(measure, prophet_models, run_id)
+    save_run_objects(measure, {'prophet_fcst': prophet_fcst, 'cv_dict': cv_dict, 'pm_dict': pm_dict}, run_id)
+    return run_id
 
 
 
 ###############################################################################
 ### load objects
 ###############################################################################
-def load_objects(df):
-    prophet_models = dict()
-    for i in df['PortfolioOwner'].unique(): # ['Site-Hikari', 'Global-BioLife US']
-        with open('serialized_model'+i+'.json', 'r') as fin:
-            prophet_models[i] = model_from_json(fin.read())  # Load model
-    with open('prophet_fcst.pkl', 'rb') as f:
-        prophet_fcst = pickle.load(f)
-    with open('cross_validation.pkl', 'rb') as f:
-        cv_dict = pickle.load(f)
-    with open('performance_metric.pkl', 'rb') as f:
-        pm_dict = pickle.load(f)
+def load_objects(df, measure, run_id=None):
+    """
+    Loads the models of the buildings in df (BUILDING_ID, as saved), the forecasts and the
+    cross-validation results of one measure from the model registry (default: the newest run).
+    """
+    prophet_models = load_models(measure, list(df['BUILDING_ID'].unique()), run_id)
+    prophet_fcst = load_run_object(measure, 'prophet_fcst', run_id)
+    cv_dict = load_run_object(measure, 'cv_dict', run_id)
+    pm_dict = load_run_object(measure, 'pm_dict', run_id)
     return prophet_models, prophet_fcst, cv_dict, pm_dict
 
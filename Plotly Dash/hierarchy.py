@@ -0,0 +1,395 @@
+#################
+### hierarchy ###
+#################
+
+import numpy as np
+import pandas as pd
+from statistics import NormalDist
+import warnings
+
+from log import(
+    get_logger,
+    shape
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### hierarchy: building -> PortfolioOwner -> business unit -> global
+# the models are fitted per building (bottom level); the upper levels are sums of the buildings
+# the summing matrix S (nodes x buildings) maps the building values to the values of all nodes
+# rows are ordered top-down: global, business units, portfolio owners, buildings
+LEVELS = ['global', 'business_unit', 'PortfolioOwner', 'building']
+RECONCILIATION_METHODS = ['bottom_up', 'ols', 'wls', 'mint']
+
+
+def get_summing_matrix(bottom, business_unit):
+    """
+    Builds the nodes of the hierarchy and the summing matrix.
+
+    Args:
+        bottom (pd.DataFrame): One row per bottom node with columns node and PortfolioOwner.
+        business_unit (dict): The portfolio owners per business unit (definition_bu.business_unit).
+            Portfolio owners without business unit are assigned to 'Other'.
+
+    Returns:
+        nodes (pd.DataFrame): Columns level, node, PortfolioOwner, business_unit (one row per node).
+        S (np.ndarray): The summing matrix (nodes x bottom nodes).
+    """
+    po_bu = dict()
+    for bu, portfolio_owners in business_unit.items():
+        for po in portfolio_owners:
+            po_bu.setdefault(po, bu)
+    bottom = bottom[['node', 'PortfolioOwner']].reset_index(drop=True)
+    bottom['business_unit'] = bottom['PortfolioOwner'].map(po_bu).fillna('Other')
+    bottom['level'] = 'building'
+    portfolio_owners = bottom[['PortfolioOwner', 'business_unit']].drop_duplicates('PortfolioOwner').sort_values('PortfolioOwner')
+    portfolio_owners = portfolio_owners.assign(level='PortfolioOwner', node=portfolio_owners['PortfolioOwner'])
+    business_units = pd.DataFrame({'business_unit': sorted(bottom['business_unit'].unique())})
+    business_units = business_units.assign(level='business_unit', node=business_units['business_unit'], PortfolioOwner=None)
+    top = pd.DataFrame({'level': ['global'], 'node': ['Global'], 'PortfolioOwner': [None], 'business_unit': [None]})
+    nodes = pd.concat([top, business_units, portfolio_owners, bottom], ignore_index=True)[['level', 'node', 'PortfolioOwner', 'business_unit']]
+    S = np.vstack([
+        np.ones((1, bottom.shape[0])),
+        (business_units['business_unit'].values[:, None] == bottom['business_unit'].values[None, :]),
+        (portfolio_owners['PortfolioOwner'].values[:, None] == bottom['PortfolioOwner'].values[None, :]),
+        np.eye(bottom.shape[0])]).astype(float)
+    return nodes, S
+
+
+
+def nanstd(x):
+    """
+    Column-wise standard deviation ignoring NaN; NaN for columns without values (no warning).
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanstd(x, axis=0)
+
+
+
+###############################################################################
+### reconciliation
+def shrink_correlation(residuals):
+    """
+    Estimates the correlation matrix of the base forecast errors with shrinkage towards the
+    identity (Schäfer & Strimmer), which keeps it positive definite when there are more
+    nodes than months. Missing residuals are ignored (treated as zero after standardizing).
+
+    Args:
+        residuals (np.ndarray): The in-sample residuals (months x nodes), NaN if missing.
+
+    Returns:
+        np.ndarray: The shrunk correlation matrix (nodes x nodes).
+    """
+    std = nanstd(residuals)
+    std[~(std > 0)] = 1
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        z = np.nan_to_num((residuals - np.nanmean(residuals, axis=0)) / std)
+    t = max(z.shape[0], 2)
+    corr = z.T @ z / t
+    np.fill_diagonal(corr, 1)
+    # variance of the correlation estimates: sum_k (z_ki z_kj - r_ij)^2 = (z^2)'(z^2) - t r^2
+    z2 = z ** 2
+    var_corr = np.clip(z2.T @ z2 - t * corr ** 2, 0, None) * t / (t - 1) ** 3
+    off_diagonal = ~np.eye(corr.shape[0], dtype=bool)
+    denominator = (corr[off_diagonal] ** 2).sum()
+    shrinkage = 1.0 if denominator == 0 else min(1.0, max(0.0, var_corr[off_diagonal].sum() / denominator))
+    corr = (1 - shrinkage) * corr
+    np.fill_diagonal(corr, 1)
+    logger.debug('correlation shrinkage %.3f', shrinkage)
+    return corr
+
+
+def reconcile(base, sigma, S, corr=None, method='mint', keep=None, chunk_bytes=64 * 1024**2):
+    """
+    Reconciles base forecasts of all nodes with y = S G base, where G = (S' W^-1 S)^-1 S' W^-1
+    and W = D R D is the covariance of the base forecast errors (standard deviations D per horizon,
+    correlation R). The covariance of the reconciled forecasts is S G W G' S'; it is only evaluated
+    for the variances of all nodes and the covariance block of the kept nodes (via the bottom level
+    covariance G W G', never nodes x nodes). All horizons are reconciled in batched matrix operations
+    (in chunks of horizons to bound the memory).
+
+    Args:
+        base (np.ndarray): The base forecasts (horizons x nodes).
+        sigma (np.ndarray): The standard deviations of the base forecast errors (horizons x nodes).
+        S (np.ndarray): The summing matrix (nodes x bottom nodes).
+        corr (np.ndarray): The correlation of the base forecast errors (nodes x nodes); identity if None.
+        method (str): bottom_up, ols (W = I), wls (W = D^2) or mint (W = D R D).
+        keep (np.ndarray): The indices of the nodes whose covariance is returned; none if None.
+
+    Returns:
+        y (np.ndarray): The reconciled forecasts (horizons x nodes).
+        var (np.ndarray): The variance of the reconciled forecasts (horizons x nodes).
+        cov (np.ndarray): The covariance of the reconciled forecasts of the kept nodes (horizons x kept x kept).
+    """
+    if method not in RECONCILIATION_METHODS:
+        raise ValueError('unknown reconciliation method ' + str(method))
+    n_nodes, n_bottom = S.shape
+    keep = np.empty(0, dtype=int) if keep is None else np.asarray(keep, dtype=int)
+    corr = np.eye(n_nodes) if corr is None else corr
+    corr_inv = np.linalg.inv(corr)
+    y = np.empty(base.shape)
+    var = np.empty(base.shape)
+    cov = np.empty((base.shape[0], keep.shape[0], keep.shape[0]))
+    chunk = max(1, int(chunk_bytes // (8 * n_nodes * n_nodes)))
+    for start in range(0, base.shape[0], chunk):
+        sl = slice(start, start + chunk)
+        d = sigma[sl]
+        if method == 'bottom_up':
+            G = np.broadcast_to(np.hstack([np.zeros((n_bottom, n_nodes - n_bottom)), np.eye(n_bottom)]), (d.shape[0], n_bottom, n_nodes))
+        else:
+            if method == 'ols':
+                W_inv = np.broadcast_to(np.eye(n_nodes), (d.shape[0], n_nodes, n_nodes))
+            elif method == 'wls':
+                W_inv = np.eye(n_nodes)[None, :, :] / (d ** 2)[:, :, None]
+            else:
+                W_inv = corr_inv[None, :, :] / d[:, :, None] / d[:, None, :]
+            StW = np.matmul(S.T, W_inv)
+            G = np.linalg.solve(np.matmul(StW, S), StW)
+        W = corr[None, :, :] * d[:, :, None] * d[:, None, :]
+        # covariance of the reconciled bottom level (horizons x bottom x bottom)
+        cov_bottom = np.matmul(np.matmul(G, W), np.swapaxes(G, 1, 2))
+        y[sl] = np.matmul(S, np.matmul(G, base[sl][:, :, None]))[:, :, 0]
+        var[sl] = (np.matmul(S, cov_bottom) * S[None, :, :]).sum(axis=2)
+        cov[sl] = np.matmul(np.matmul(S[keep], cov_bottom), S[keep].T)
+    return y, var, cov
+
+
+
+###############################################################################
+### base forecasts of the aggregated nodes
+def get_seasonal_naive(values, complete, months_ahead):
+    """
+    Seasonal naive forecasts of the aggregated nodes: the value of the same month in the most
+    recent complete year. Vectorized over months and nodes.
+
+    Args:
+        values (np.ndarray): The aggregated values (months x nodes).
+        complete (np.ndarray): True where all children of a node are actuals (months x nodes).
+        months_ahead (int): The maximum number of months after the last complete month.
+
+    Returns:
+        forecast (np.ndarray): The seasonal naive forecasts (months x nodes), NaN if unavailable.
+        years_back (np.ndarray): The number of years between forecast and source month (variance factor).
+    """
+    forecast = np.full(values.shape, np.nan)
+    years_back = np.full(values.shape, np.nan)
+    for k in range(1, months_ahead // 12 + 2):
+        lag = 12 * k
+        if lag >= values.shape[0]:
+            break
+        source = np.full(values.shape, np.nan)
+        source[lag:] = np.where(complete[:-lag], values[:-lag], np.nan)
+        fill = np.isnan(forecast) & ~np.isnan(source)
+        forecast[fill] = source[fill]
+        years_back[fill] = k
+    return forecast, years_back
+
+
+def get_base_forecasts(values, status, sigma_bottom, residuals_bottom, S):
+    """
+    Assembles the base forecasts, their error standard deviations and the in-sample residuals
+    of all nodes. Buildings use their model forecasts; aggregated nodes use seasonal naive
+    forecasts of their complete history (bottom-up sums where no full year is available).
+
+    Args:
+        values (np.ndarray): The building values, actuals or predictions (months x buildings).
+        status (np.ndarray): 0 missing, 1 actual, 2 predicted (months x buildings).
+        sigma_bottom (np.ndarray): The forecast standard deviations of the buildings (months x buildings).
+        residuals_bottom (np.ndarray): The in-sample residuals of the buildings (months x buildings).
+        S (np.ndarray): The summing matrix.
+
+    Returns:
+        tuple: base, sigma and residuals (months x nodes) and the mask of predicted node-months.
+    """
+    n_aggregate = S.shape[0] - S.shape[1]
+    S_aggregate = S[:n_aggregate]
+    aggregated = values @ S_aggregate.T
+    predicted = np.hstack([(status == 2).astype(float) @ S_aggregate.T > 0, status == 2])
+    complete = ~predicted[:, :n_aggregate]
+    # seasonal naive forecasts and residuals of the aggregated nodes
+    months_ahead = int(predicted.sum(axis=0).max()) if predicted.any() else 0
+    naive, years_back = get_seasonal_naive(aggregated, complete, months_ahead)
+    residuals_aggregate = np.full(aggregated.shape, np.nan)
+    residuals_aggregate[12:] = np.where(complete[12:] & complete[:-12], aggregated[12:] - aggregated[:-12], np.nan)
+    # buildings without model interval: standard deviation of the in-sample residuals
+    sigma_bottom = np.where((status == 2) & ~(np.nan_to_num(sigma_bottom) > 0), nanstd(residuals_bottom)[None, :], sigma_bottom)
+    # fall back on the bottom-up sums with independent errors
+    sigma_bottom_up = np.sqrt((np.nan_to_num(sigma_bottom) ** 2) @ S_aggregate.T)
+    sigma_naive = nanstd(residuals_aggregate)
+    available = ~np.isnan(naive) & (np.sum(~np.isnan(residuals_aggregate), axis=0) >= 3)[None, :]
+    base_aggregate = np.where(complete, aggregated, np.where(available, naive, aggregated))
+    sigma_aggregate = np.where(available, sigma_naive[None, :] * np.sqrt(np.nan_to_num(years_back)), sigma_bottom_up)
+    base = np.hstack([base_aggregate, values])
+    sigma = np.hstack([sigma_aggregate, sigma_bottom])
+    residuals = np.hstack([residuals_aggregate, residuals_bottom])
+    # known values (actuals, missing buildings) get a small error floor instead of zero to keep W invertible
+    floor = 0.01 * np.nan_to_num(nanstd(residuals))
+    floor[~(floor > 0)] = 1e-6
+    sigma = np.where(predicted & (np.nan_to_num(sigma) > 0), sigma, floor[None, :])
+    return base, sigma, residuals, predicted
+
+
+def reconcile_values(values, status, sigma_bottom, residuals_bottom, S, method, z, keep=None):
+    """
+    Reconciles one value column (e.g. energy or emissions) for all forecast months.
+
+    Returns:
+        y, lower, upper (np.ndarray): The coherent values and interval bounds (months x nodes);
+            bounds are NaN where a node has no predicted children.
+        cov (np.ndarray): The covariance of the reconciled forecasts of the kept nodes (forecast months x kept x kept).
+        forecast_months (np.ndarray): The indices of the forecast months.
+    """
+    base, sigma, residuals, predicted = get_base_forecasts(values, status, sigma_bottom, residuals_bottom, S)
+    y = values @ S.T
+    lower = np.full(y.shape, np.nan)
+    upper = np.full(y.shape, np.nan)
+    forecast_months = np.where(predicted.any(axis=1))[0]
+    if forecast_months.shape[0] == 0:
+        n_keep = 0 if keep is None else len(keep)
+        return y, lower, upper, np.empty((0, n_keep, n_keep)), forecast_months
+    corr = shrink_correlation(residuals) if method == 'mint' else None
+    y_rec, var, cov = reconcile(base[forecast_months], sigma[forecast_months], S, corr, method, keep)
+    std = np.sqrt(np.clip(var, 0, None))
+    y[forecast_months] = y_rec
+    lower[forecast_months] = np.where(predicted[forecast_months], y_rec - z * std, np.nan)
+    upper[forecast_months] = np.where(predicted[forecast_months], y_rec + z * std, np.nan)
+    return y, lower, upper, cov, forecast_months
+
+
+
+###############################################################################
+### reconcile the building forecasts of one measure
+def reconcile_hierarchy(df_app, prophet_residuals, business_unit, method='mint', interval_width=0.8):
+    """
+    Hierarchical forecasting mode: reconciles the building forecasts (after energy conversion)
+    at the building, PortfolioOwner, business unit and global level in one pass. Point forecasts
+    are coherent (every node equals the sum of its children) and the intervals are derived from
+    the covariance of the reconciled forecasts instead of summing the bounds of the children.
+    Energy (y) and emissions (y_ghg) are reconciled separately.
+
+    Args:
+        df_app (pd.DataFrame): get_energy_conversion output (building level, actuals and predictions).
+        prophet_residuals (dict): The in-sample residuals per building (get_prophet_residuals).
+        business_unit (dict): The portfolio owners per business unit.
+        method (str): The reconciliation method (see RECONCILIATION_METHODS).
+        interval_width (float): The coverage of the intervals (0.8 like the Prophet intervals).
+
+    Returns:
+        dict:
+            - forecast (pd.DataFrame): One row per node and month with columns level, node, PortfolioOwner,
+              business_unit, Impact Month, type, y, yhat_lower, yhat_upper, y_ghg, y_ghg_lower, y_ghg_upper.
+            - covariance (dict): The reconciled covariance between the business units per forecast month
+              ('months', 'nodes', 'y', 'y_ghg'); the interval of any selection of business units can be
+              derived from it.
+            - method (str), interval_width (float).
+    """
+    z = NormalDist().inv_cdf(0.5 + interval_width / 2)
+    dat = df_app[['Impact Month', 'BUILDING_ID', 'SYSTM_SPCFIC_MSR', 'PortfolioOwner', 'y', 'yhat_lower', 'yhat_upper', 'y_ghg', 'type']]\
+        .drop_duplicates().dropna(subset=['PortfolioOwner'])
+    dat = dat.assign(node = dat['BUILDING_ID'].astype(str) + ' | ' + dat['SYSTM_SPCFIC_MSR'].fillna('').astype(str),
+                     predicted = (dat['type'] == 'Predicted').astype(int) + 1)
+    for col in ['y', 'yhat_lower', 'yhat_upper', 'y_ghg']:
+        dat[col] = dat[col].astype(float)
+    bottom = dat[['node', 'BUILDING_ID', 'PortfolioOwner']].drop_duplicates('node').sort_values('node').reset_index(drop=True)
+    nodes, S = get_summing_matrix(bottom, business_unit)
+    months = pd.DatetimeIndex(sorted(dat['Impact Month'].unique()))
+    grouped = dat.groupby(['Impact Month', 'node'])
+    def pivot(values):
+        return values.unstack('node').reindex(index=months, columns=bottom['node']).values
+    values = np.nan_to_num(pivot(grouped['y'].sum()))
+    values_ghg = np.nan_to_num(pivot(grouped['y_ghg'].sum()))
+    status = np.nan_to_num(pivot(grouped['predicted'].max())).astype(int)
+    sigma = pivot(grouped['yhat_upper'].sum() - grouped['yhat_lower'].sum()) / (2 * z)
+    # emission factor per building and month to convert the energy errors into emission errors
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = pd.DataFrame(np.where(values != 0, values_ghg / values, np.nan))
+    ratio = ratio.fillna(ratio.mean()).fillna(0).values
+    # in-sample residuals (actual - fitted) of the buildings in the converted unit (J -> GJ)
+    residuals = np.full(values.shape, np.nan)
+    for j, building in enumerate(bottom['BUILDING_ID']):
+        resid = prophet_residuals.get(building) if prophet_residuals is not None else None
+        if resid is None or resid.shape[0] == 0:
+            continue
+        resid = pd.Series(resid['residual'].values, index=pd.to_datetime(resid['ds'])).dropna()
+        resid = resid.loc[~resid.index.duplicated()]
+        residuals[:, j] = -resid.reindex(months).values / 1000000000
+    # only the covariance between the business units is kept
+    bu_index = np.where(nodes['level'] == 'business_unit')[0]
+    y, lower, upper, cov, forecast_months = reconcile_values(values, status, sigma, residuals, S, method, z, bu_index)
+    y_ghg, lower_ghg, upper_ghg, cov_ghg, _ = reconcile_values(values_ghg, status, sigma * ratio, residuals * ratio, S, method, z, bu_index)
+    # long format: one row per node and month
+    n_months, n_nodes = y.shape
+    forecast = pd.DataFrame({
+        'level': np.tile(nodes['level'].values, n_months),
+        'node': np.tile(nodes['node'].values, n_months),
+        'PortfolioOwner': np.tile(nodes['PortfolioOwner'].values, n_months),
+        'business_unit': np.tile(nodes['business_unit'].values, n_months),
+        'Impact Month': np.repeat(months.values, n_nodes),
+        'y': y.ravel(),
+        'yhat_lower': lower.ravel(),
+        'yhat_upper': upper.ravel(),
+        'y_ghg': y_ghg.ravel(),
+        'y_ghg_lower': lower_ghg.ravel(),
+        'y_ghg_upper': upper_ghg.ravel()})
+    forecast['type'] = np.where(forecast['yhat_lower'].notna(), 'Predicted', 'Actuals')
+    # nodes without data in a month (e.g. before the first report of a building) are dropped
+    present = np.hstack([(status > 0).astype(float) @ S[:S.shape[0] - S.shape[1]].T > 0, status > 0]).ravel()
+    forecast = forecast.loc[present].reset_index(drop=True)
+    covariance = {
+        'months': months[forecast_months],
+        'nodes': list(nodes['node'].values[bu_index]),
+        'y': cov,
+        'y_ghg': cov_ghg}
+    logger.debug('hierarchy forecast %s', shape(forecast))
+    return {'forecast': forecast, 'covariance': covariance, 'method': method, 'interval_width': interval_width}
+
+
+def get_portfolio_dataframe(hierarchy):
+    """
+    Selects the reconciled PortfolioOwner level in the format of aggregate_on_portfolio_level().
+
+    Args:
+        hierarchy (dict): reconcile_hierarchy output.
+
+    Returns:
+        pd.DataFrame: Columns Impact Month, PortfolioOwner, SYSTM_SPCFIC_MSR, y, yhat_lower, yhat_upper, y_ghg, type.
+    """
+    forecast = hierarchy['forecast']
+    df = forecast.loc[forecast['level'] == 'PortfolioOwner', ['Impact Month', 'PortfolioOwner', 'y', 'yhat_lower', 'yhat_upper', 'y_ghg', 'type']]
+    df.insert(2, 'SYSTM_SPCFIC_MSR', None)
+    return df.reset_index(drop=True)
+
+
+def get_selection_interval(hierarchies, business_units, unit='y'):
+    """
+    Derives the interval of the total of a selection of business units over one or several
+    measures from the reconciled covariances (measures are assumed independent).
+
+    Args:
+        hierarchies (list): reconcile_hierarchy outputs, one per measure.
+        business_units (list): The selected business units; all business units if empty.
+        unit (str): 'y' (energy) or 'y_ghg' (emissions).
+
+    Returns:
+        pd.DataFrame: Columns Impact Month, y, yhat_lower, yhat_upper (forecast months only).
+    """
+    frames = []
+    for hierarchy in hierarchies:
+        covariance = hierarchy['covariance']
+        z = NormalDist().inv_cdf(0.5 + hierarchy['interval_width'] / 2)
+        nodes = business_units if business_units else covariance['nodes']
+        selected = np.isin(covariance['nodes'], nodes)
+        variance = covariance[unit][:, selected][:, :, selected].sum(axis=(1, 2))
+        forecast = hierarchy['forecast']
+        total = forecast.loc[(forecast['level'] == 'business_unit') & forecast['node'].isin(nodes)]\
+            .groupby('Impact Month')[unit].sum().reindex(covariance['months'])
+        frames.append(pd.DataFrame({'Impact Month': covariance['months'], 'y': total.values, 'variance': variance, 'z': z}))
+    dat = pd.concat(frames).groupby('Impact Month').agg({'y': 'sum', 'variance': 'sum', 'z': 'first'}).reset_index()
+    dat['yhat_lower'] = dat['y'] - dat['z'] * np.sqrt(dat['variance'])
+    dat['yhat_upper'] = dat['y'] + dat['z'] * np.sqrt(dat['variance'])
+    return dat[['Impact Month', 'y', 'yhat_lower', 'yhat_upper']]
@@ -0,0 +1,150 @@
+##################
+### instrument ###
+##################
+
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import pandas as pd
+import resource
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+
+###############################################################################
+### memory
+def get_rss_mb():
+    """
+    Returns the current resident set size (RSS) of the process in MB.
+    Uses psutil if installed, else /proc (Linux); None if neither is available.
+    """
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss / 1024**2
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024**2
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_peak_rss_mb():
+    """
+    Returns the peak resident set size of the process in MB (ru_maxrss is reported in kB on Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+
+###############################################################################
+### row counts
+def count_rows(obj):
+    """
+    Counts the rows of a stage input or output: the length of a DataFrame, the summed length
+    of the DataFrames in a dictionary (per building results) or the number of non-empty entries
+    of any other dictionary (e.g. fitted models). Tuples are counted element-wise.
+
+    Args:
+        obj: The object to count.
+
+    Returns:
+        int, list or None: The row count.
+    """
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.shape[0])
+    if isinstance(obj, dict):
+        values = [v for v in obj.values() if v is not None]
+        if values and all(isinstance(v, pd.DataFrame) for v in values):
+            return int(sum(v.shape[0] for v in values))
+        return len(values)
+    if isinstance(obj, tuple):
+        return [count_rows(i) for i in obj]
+    return None
+
+
+
+###############################################################################
+### run report
+class RunReport:
+    """
+    Collects stage timings, memory usage, row counts and per-building fit times of one run
+    of run_prediction and serializes them to a JSON run report.
+
+    Example:
+        report = RunReport(measure)
+        df = report.call('load_enablon', load_enablon, measure, ...)
+        report.to_json()
+    """
+    def __init__(self, measure):
+        self.measure = measure
+        self.started = datetime.now()
+        self.stages = []
+        self.buildings = dict()
+        self.summaries = dict()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Times the enclosed block and records memory usage. The yielded record can be
+        completed by the caller, e.g. record['rows_out'] = df.shape[0].
+        """
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None, 'status': 'ok'}
+        rss_start = get_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            record['status'] = 'failed'
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 3)
+            rss_end = get_rss_mb()
+            record['rss_mb'] = round(rss_end, 1) if rss_end is not None else None
+            record['rss_delta_mb'] = round(rss_end - rss_start, 1) if rss_end is not None and rss_start is not None else None
+            record['peak_rss_mb'] = round(get_peak_rss_mb(), 1)
+            self.stages.append(record)
+
+    def call(self, name, function, *args, rows_in=None):
+        """
+        Runs function(*args) as an instrumented stage. Rows in are counted on the first
+        argument unless given, rows out on the return value.
+        """
+        if rows_in is None and args:
+            rows_in = count_rows(args[0])
+        with self.stage(name, rows_in) as record:
+            result = function(*args)
+            record['rows_out'] = count_rows(result)
+            if result is None:
+                record['status'] = 'no output'
+        return result
+
+    def add_building_times(self, name, times):
+        """
+        Adds per-building times (building id: seconds) of a stage, e.g. the fit time per model.
+        """
+        self.buildings[name] = {k: round(v, 3) for k, v in times.items()}
+
+    def add_summary(self, name, summary):
+        """
+        Adds a summary of a stage (dictionary), e.g. the warm start speedup of the fits.
+        """
+        self.summaries[name] = summary
+
+    def to_dict(self):
+        return {
+            'measure': self.measure,
+            'started': self.started.isoformat(timespec='seconds'),
+            'seconds': round(sum(s['seconds'] for s in self.stages), 3),
+            'peak_rss_mb': round(get_peak_rss_mb(), 1),
+            'stages': self.stages,
+            'buildings': self.buildings,
+            'summaries': self.summaries
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, default=str)
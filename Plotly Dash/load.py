@@ -25,11 +25,81 @@ from preprocess import(
     prepare_steam,
 )
 
-from databricks import sql
+from backends import(
+    get_edb_cursor_backend
+)
+
 import numpy as np
 import os
 import pandas as pd
 
+from log import(
+    get_logger
+)
+
+logger = get_logger(__name__)
+
+
+
+
+
+###############################################################################
+### connection to EDB
+def get_edb_cursor():
+    """
+    Opens a connection to EDB (Databricks, or the sqlite stand-in selected with WAREHOUSE_BACKEND)
+    and returns a cursor on the gms_us_mart schema.
+    A cursor must not be shared between threads: open one cursor per concurrent extraction.
+    
+    Returns:
+        cursor: The database cursor object.
+    """
+    cursor = get_edb_cursor_backend()
+    cursor.execute("USE gms_us_mart;")
+    return cursor
+
+
+
+def extract_edb(extract_function, *args):
+    """
+    Runs a single EDB extract function on its own cursor and connection (used by the concurrent ETL mode);
+    both are closed when the extraction ends, also if it fails.
+    
+    Args:
+        extract_function (callable): The extract function, e.g. extract_leaks.
+        *args: Additional arguments passed after the cursor.
+    
+    Returns:
+        pandas.DataFrame: The extracted data.
+    """
+    cursor = get_edb_cursor()
+    try:
+        dat = extract_function(cursor, *args)
+    finally:
+        cursor.close()
+    return dat
+
+
+
+# EDB extract functions per output name (the order matches the return value of get_edb)
+EDB_EXTRACTS = {
+    'leaks': extract_leaks,
+    'fleet': extract_fleet,
+    'tango_fp': extract_tango,
+    'flag': extract_flag,
+    'msrs': extract_measures,
+    'ecf': extract_ecf,
+    'scf': extract_scf
+}
+
+# SPOT extract functions per output name (the order matches the return value of get_spot)
+SPOT_EXTRACTS = {
+    'Spot_EMPortfolioOwner': extract_spot_empo,
+    'Spot_SpotPortfolioOwner': extract_spot_sppo,
+    'spot': extract_spot,
+    'vppa': extract_vppa
+}
+
 
 
 
@@ -49,30 +119,26 @@ def get_edb():
             - ecf (pandas.DataFrame): DataFrame containing energy conversion factors.
     """
     #create connection and cursor
-    print('open connection and establish cursor')
-    connection = sql.connect(server_hostname = "onetakeda-usprd.cloud.databricks.com",
-                        http_path = "sql/protocolv1/o/2186391591496286/1201-135729-4c9gjccf",
-                        access_token = os.environ.get('ACCESS_TOKEN'))
-    cursor = connection.cursor()
-    cursor.execute("USE gms_us_mart;")
-    print('start data extraction')
-    print('leaks')
+    logger.info('open connection and establish cursor')
+    cursor = get_edb_cursor()
+    logger.info('start data extraction')
+    logger.info('leaks')
     leaks = extract_leaks(cursor)
-    print('fleet')
+    logger.info('fleet')
     fleet = extract_fleet(cursor)
-    print('tango')
+    logger.info('tango')
     tango_fp = extract_tango(cursor)
-    print('flag')
+    logger.info('flag')
     flag = extract_flag(cursor)
-    print('measures')
+    logger.info('measures')
     msrs = extract_measures(cursor)
-    print('energy conversion factors')
+    logger.info('energy conversion factors')
     ecf = extract_ecf(cursor)
-    print('steam conversion factors')
+    logger.info('steam conversion factors')
     scf = extract_scf(cursor)
-    print('end data extraction')
+    logger.info('end data extraction')
     # close cursor connection
-    print('close connection')
+    logger.info('close connection')
     cursor.close()
     return leaks, fleet, tango_fp, flag, msrs, ecf, scf
 
@@ -93,7 +159,7 @@ def get_spot():
             - spot (pandas.DataFrame): DataFrame containing SPOT (Single Point of Truth) data - information GHG emission reduction projects.
             - vppa (pandas.DataFrame): DataFrame containing VPPA (Virtual Power Purchase Agreement) data.
     """
-    print('spot database')
+    logger.info('spot database')
     Spot_EMPortfolioOwner = extract_spot_empo() # contains folderpath
     #Spot_EMPortfolioOwner = pd.read_csv('./input_data/Spot_EMPortfolioOwner.csv') # contains folderpath
     Spot_SpotPortfolioOwner = extract_spot_sppo() # contains portfolio owner
@@ -101,10 +167,24 @@ def get_spot():
     spot = extract_spot()
     #spot = pd.read_csv('./input_data/spot.csv')
     vppa = extract_vppa()
-    # manual change of vppa impact realization data due to faulty data input in database
+    vppa = fix_vppa(vppa)
+    return Spot_EMPortfolioOwner, Spot_SpotPortfolioOwner, spot, vppa
+
+
+
+def fix_vppa(vppa):
+    """
+    Manual change of the vppa impact realization date due to faulty data input in the SPOT database.
+    
+    Args:
+        vppa (pandas.DataFrame): DataFrame containing VPPA (Virtual Power Purchase Agreement) data.
+    
+    Returns:
+        pandas.DataFrame: The VPPA data with corrected impact realization date.
+    """
     vppa['EmissionsImpactRealizationDate'] = '2023-03-31'
     vppa['EmissionsImpactRealizationDate'] = pd.to_datetime(vppa['EmissionsImpactRealizationDate'])
-    return Spot_EMPortfolioOwner, Spot_SpotPortfolioOwner, spot, vppa
+    return vppa
 
 
 
@@ -114,19 +194,20 @@ def get_spot():
 ### load data from local files
 def get_local_files():
     """
-    Load data from local files.
+    Load data from local files in DATA_DIR (default ./data).
     
     Returns:
         pd.DataFrame: The loaded data from the Energy_Conversion_Factors.csv file.
     """
+    data_dir = os.environ.get('DATA_DIR', './data')
     #vol = pd.read_csv('./data/ProductionVolumesRawData.csv', index_col=0, encoding='windows-1252')
-    vol_past = pd.read_csv('./data/Volume_Past.csv')
-    vol_future = pd.read_csv('./data/Volume_Future.csv')
+    vol_past = pd.read_csv(os.path.join(data_dir, 'Volume_Past.csv'))
+    vol_future = pd.read_csv(os.path.join(data_dir, 'Volume_Future.csv'))
     # conversion factors
-    cf = pd.read_csv('./data/Energy_Conversion_Factors.csv', encoding='windows-1252')
+    cf = pd.read_csv(os.path.join(data_dir, 'Energy_Conversion_Factors.csv'), encoding='windows-1252')
     # steam conversion factors
     #scf = pd.read_csv('./data/Steam_Conversion_Factors.csv')
-    spot_lookup = pd.read_csv('./data/SPOT_LOOKUP_Table.csv')
+    spot_lookup = pd.read_csv(os.path.join(data_dir, 'SPOT_LOOKUP_Table.csv'))
     return cf, spot_lookup, vol_past, vol_future
 
 
@@ -158,14 +239,10 @@ def load_enablon(measure, tango_fp, spot_fp_po, flag, cf, ecf, scf):
     Raises:
         Exception: If any error occurs during the extraction or preprocessing.
     """
-    print('start load_enablon')
+    logger.info('start load_enablon')
     #create connection and cursor
-    connection = sql.connect(server_hostname = "onetakeda-usprd.cloud.databricks.com",
-                http_path = "sql/protocolv1/o/2186391591496286/1201-135729-4c9gjccf",
-                access_token = os.environ.get('ACCESS_TOKEN'))
-    cursor = connection.cursor()
-    cursor.execute("USE gms_us_mart;")
-    print('extract enablon indicator')
+    cursor = get_edb_cursor()
+    logger.info('extract enablon indicator')
     # extract enablon data from EDB for the provided measure/indicator (dat_enablon)
     if measure == 'Natural Gas - Useage (Reported)':
         dat_enablon = extract_natural_gas(cursor)
@@ -182,7 +259,7 @@ def load_enablon(measure, tango_fp, spot_fp_po, flag, cf, ecf, scf):
         df = prepare_enablon(dat_enablon, flag, tango_fp, spot_fp_po)
     #close cursor
     cursor.close()
-    print('end load_enablon')
+    logger.info('end load_enablon')
     return df
 
 # need to keep the Cntry level information
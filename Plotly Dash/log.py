@@ -0,0 +1,82 @@
+###########
+### log ###
+###########
+
+import logging
+import os
+import sys
+
+
+###############################################################################
+### logging profiles
+# debug: progress messages, loop keys and frame summaries (level DEBUG)
+# default: progress messages only (level INFO)
+# production: warnings and errors only; the hot paths skip all message formatting (level WARNING)
+# select the profile with the LOG_PROFILE environment variable, or override the level with LOG_LEVEL
+LOG_PROFILES = {
+    'debug': logging.DEBUG,
+    'default': logging.INFO,
+    'production': logging.WARNING
+}
+
+LOGGER_NAME = 'co2'
+
+
+def configure_logging(profile=None, level=None):
+    """
+    Configures the level and handler of the pipeline and app loggers.
+
+    Args:
+        profile (str): One of LOG_PROFILES; defaults to the LOG_PROFILE environment variable or 'default'.
+        level (str or int): Explicit log level overriding the profile (e.g. 'DEBUG'); defaults to LOG_LEVEL.
+    """
+    profile = profile or os.environ.get('LOG_PROFILE', 'default')
+    level = level or os.environ.get('LOG_LEVEL') or LOG_PROFILES[profile]
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    return logger
+
+
+def get_logger(name):
+    """
+    Returns the logger of a module, e.g. logger = get_logger(__name__).
+    Messages must use lazy %-formatting (logger.debug('%s', shape(df))): arguments are
+    only formatted if the level is enabled.
+    """
+    if not logging.getLogger(LOGGER_NAME).handlers:
+        configure_logging()
+    return logging.getLogger(LOGGER_NAME + '.' + name)
+
+
+
+###############################################################################
+### lazy summaries
+class shape:
+    """
+    Lazy summary of a DataFrame (or dictionary of results) for log messages. Only the shape
+    is formatted, never the data, and only when the message is actually emitted.
+
+    Example:
+        logger.debug('dat_enablon %s', shape(dat_enablon))
+    """
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        obj = self.obj
+        if obj is None:
+            return 'None'
+        if hasattr(obj, 'shape') and len(obj.shape) == 2:
+            return type(obj).__name__ + '[' + str(obj.shape[0]) + ' rows x ' + str(obj.shape[1]) + ' columns]'
+        if hasattr(obj, 'shape'):
+            return type(obj).__name__ + '[' + ' x '.join(str(i) for i in obj.shape) + ']'
+        if isinstance(obj, dict):
+            return 'dict[' + str(len(obj)) + ' keys]'
+        if hasattr(obj, '__len__'):
+            return type(obj).__name__ + '[' + str(len(obj)) + ']'
+        return type(obj).__name__
@@ -17,95 +17,284 @@ from scipy import stats
 from scipy.signal import detrend
 from sklearn import preprocessing
 from sklearn.metrics import mean_squared_error
+import time
 
+from regressors import(
+    REGRESSORS,
+    get_building_regressors,
+    get_regressor_table
+)
+from artifacts import(
+    ModelArtifact
+)
+from baseline import(
+    BaselineModel,
+    choose_baseline,
+    choose_model,
+    get_baselines
+)
+from log import(
+    get_logger,
+    shape
+)
+
+logger = get_logger(__name__)
+
+# number of MCMC samples of the Prophet fits; MCMC_SAMPLES=0 fits the MAP estimate (local end-to-end runs)
+def get_mcmc_samples():
+    return int(os.environ.get('MCMC_SAMPLES', 300))
+
+# Prophet configuration of buildings without tuned parameters (see tuning.py)
+DEFAULT_PROPHET_PARAMS = {'seasonality_mode': 'multiplicative'}
+
+
+
+###############################################################################
+### warm start
+# the nightly refit starts the optimizer (MAP) or the MCMC chains at the parameters of the previous
+# run's model of the same building when its series is largely unchanged: the same first month, at
+# most WARM_START_MAX_NEW_MONTHS new months (default 3) and a mean relative change of the known
+# months of at most WARM_START_TOLERANCE (default 0.05); WARM_START=0 disables warm starts
+# the previous model must also have the regressors and the configuration (WARM_START_CONFIG) of the new one
+WARM_START_CONFIG = ['growth', 'seasonality_mode', 'changepoint_prior_scale', 'seasonality_prior_scale', 'holidays_prior_scale']
+
+
+def get_warm_start():
+    return os.environ.get('WARM_START', '1') != '0'
+
+
+def get_model_config(model):
+    """
+    Returns the configuration of a Prophet model or ModelArtifact compared before a warm start
+    (WARM_START_CONFIG; None for settings the model does not record).
+    """
+    if isinstance(model, ModelArtifact):
+        return {name: model.metadata.get(name) for name in WARM_START_CONFIG}
+    return {name: getattr(model, name, None) for name in WARM_START_CONFIG}
+
+
+def is_series_unchanged(previous, df_prophet, tolerance=None, max_new_months=None):
+    """
+    Checks whether the series of a building is largely unchanged since the previous fit.
+    
+    Args:
+        previous (Prophet): The fitted model of the previous run.
+        df_prophet (pd.DataFrame): The new series (ds, y).
+        tolerance (float): Maximum mean relative change of the months known to the previous model.
+        max_new_months (int): Maximum number of months added since the previous fit.
+    
+    Returns:
+        bool: True if the previous parameters are a good starting point.
+    """
+    tolerance = tolerance if tolerance is not None else float(os.environ.get('WARM_START_TOLERANCE', 0.05))
+    max_new_months = max_new_months if max_new_months is not None else int(os.environ.get('WARM_START_MAX_NEW_MONTHS', 3))
+    history = getattr(previous, 'history', None)
+    if history is None or df_prophet.shape[0] == 0:
+        return False
+    old = history.groupby('ds')['y'].mean()
+    new = df_prophet.assign(ds = pd.to_datetime(df_prophet['ds'])).groupby('ds')['y'].mean().astype(float)
+    if new.index.min() != old.index.min() or (new.index > old.index.max()).sum() > max_new_months:
+        return False
+    known = new.reindex(old.index)
+    if known.isna().any():
+        return False
+    change = (known - old).abs() / old.abs().clip(lower=1e-9)
+    return bool(change.mean() <= tolerance)
+
+
+def get_stan_init(previous):
+    """
+    Returns the parameters of a fitted model as initial values for the next fit
+    (the mean over the MCMC samples; the MAP estimate has a single sample).
+    
+    Args:
+        previous (Prophet): The fitted model of the previous run.
+    
+    Returns:
+        dict: k, m, sigma_obs, delta and beta as expected by Prophet.fit(df, init=...).
+    """
+    init = dict()
+    for name in ['k', 'm', 'sigma_obs']:
+        init[name] = float(np.mean(previous.params[name]))
+    for name in ['delta', 'beta']:
+        init[name] = np.mean(previous.params[name], axis=0).tolist()
+    return init
+
+
+def fit_prophet(new_model, df_prophet, init=None):
+    """
+    Fits a new Prophet model, starting at init if given. A warm start that fails (e.g. a different
+    number of changepoints than the previous model) is repeated without init.
+    
+    Args:
+        new_model (callable): Returns a new, configured Prophet model.
+        df_prophet (pd.DataFrame): The training data.
+        init (dict): The initial parameters (get_stan_init()).
+    
+    Returns:
+        m (Prophet): The fitted model.
+        warm (bool): True if the fit started at init.
+    """
+    if init is not None:
+        try:
+            m = new_model()
+            m.fit(df_prophet, init=init)
+            return m, True
+        except:
+            logger.debug('warm start failed, fit without init')
+    m = new_model()
+    m.fit(df_prophet)
+    return m, False
+
+
+def get_warm_start_summary(fit_times, warm_starts, previous_fit_times=None):
+    """
+    Summarizes the fit times of warm and cold started buildings. With the fit times of the previous
+    run (run report), the speedup of every warm started building against its previous fit is reported.
+    
+    Args:
+        fit_times (dict): The fit time in seconds per building (get_prophet).
+        warm_starts (dict): True per building if the fit started at the previous parameters (get_prophet).
+        previous_fit_times (dict): The fit time per building of the previous run.
+    
+    Returns:
+        dict: The number of warm and cold fits, their mean fit time and the median speedup.
+    """
+    warm = [fit_times[i] for i, w in warm_starts.items() if w and i in fit_times]
+    cold = [fit_times[i] for i, w in warm_starts.items() if not w and i in fit_times]
+    summary = {
+        'warm_fits': len(warm),
+        'cold_fits': len(cold),
+        'warm_mean_seconds': round(float(np.mean(warm)), 3) if warm else None,
+        'cold_mean_seconds': round(float(np.mean(cold)), 3) if cold else None,
+        'median_speedup': None}
+    if previous_fit_times:
+        speedup = [previous_fit_times[i] / fit_times[i] for i, w in warm_starts.items()
+                   if w and fit_times.get(i) and previous_fit_times.get(i)]
+        if speedup:
+            summary['median_speedup'] = round(float(np.median(speedup)), 2)
+    return summary
 
 
 
 ###############################################################################
 ### Prophet models and forecast
-def get_prophet(df, vol):
+def get_prophet(df, vol, fit_times=None, mcmc_samples=None, min_prophet_months=None, previous_models=None, warm_starts=None, prophet_params=None):
     """
     Generates prophet models and forecasts for each unique PortfolioOwner in the given DataFrame.
     Models are fitted per indicator and per portfolio owner
     The input data contains all portfolio owners for one indicator
     For example: complete data set for natural gas indicator: 
     contains all portfolio owners -> loop through the portfolio owners
+    Buildings with a short history (fewer than min_prophet_months months) and buildings whose
+    Prophet fit fails get a baseline forecast instead (see baseline.py), fitted in one batch per method.
     
     Args:
         df (pd.DataFrame): The input data containing the time series data.
+        vol (pd.DataFrame): The regressor table (regressors.get_regressor_table()) or the production volumes (prepare_volume output).
+        fit_times (dict): Optional; filled with the fit and predict time in seconds per building.
+        mcmc_samples (int): Number of MCMC samples (default: MCMC_SAMPLES environment variable or 300); 0 fits the MAP estimate (much faster, used by the benchmarks).
+        min_prophet_months (int): Minimum history for a Prophet fit (default: MIN_PROPHET_MONTHS environment variable or 24).
+        previous_models (dict): Optional; the models of the previous run, used to warm start the fits of unchanged series.
+        warm_starts (dict): Optional; filled with True per building if its fit started at the previous parameters.
+        prophet_params (dict): Optional; the tuned Prophet parameters per building (tune_prophet()), else DEFAULT_PROPHET_PARAMS.
     
     Returns:
-        prophet_models (dict): A dictionary containing Prophet models for each unique PortfolioOwner.
+        prophet_models (dict): A dictionary containing Prophet models (or BaselineModel records) for each unique PortfolioOwner.
         prophet_fcst (dict): A dictionary containing Prophet forecasts for each unique PortfolioOwner (monthly).
     """
+    if mcmc_samples is None:
+        mcmc_samples = get_mcmc_samples()
     prophet_models = dict()
     prophet_fcst = dict()
     prophet_reg_coeff = dict()
-    plasma_buildings = ['AT-VIE-TEMP-01', 'IT-PIS-01', 'IT-RIE-01', 'BE-LES-TEMP-01', 'US-LOA-01', 'US-COV-02', 'US-ROL-01']
-    #for i in plasma_buildings:
-    for i in df['BUILDING_ID'].unique():
-        print(i)
-        df_prophet = df.copy()
-        #df_prophet = df_prophet.reset_index()
-        df_prophet = df_prophet.loc[df_prophet['BUILDING_ID']==i]
-        if i in plasma_buildings:
-            print('include volume')
-            # add regressor
-            df_prophet = df_prophet.merge(vol, on=['Month', 'BUILDING_ID'], how='left').sort_values('Month').dropna()
-            df_prophet = df_prophet[['Month', 'y', 'Volume']]
-            df_prophet.columns = ['ds', 'y', 'vol']
-        else:
-            df_prophet = df_prophet[['Month', 'y']]
-            df_prophet.columns = ['ds', 'y']
-            print(df_prophet)
+    # regressors (e.g. production volume) of the buildings, looked up in one indexed table
+    regressor_table = get_regressor_table(vol)
+    buildings_with_regressors = set(regressor_table.index.get_level_values('BUILDING_ID'))
+    # route every building to Prophet or a baseline forecaster by the number of months with data
+    buildings = df['BUILDING_ID'].unique()
+    n_months = df.dropna(subset=['y']).groupby('BUILDING_ID')['Month'].nunique().reindex(buildings, fill_value=0)
+    methods = {i: choose_model(n_months[i], min_prophet_months) for i in buildings}
+    if previous_models is None or not get_warm_start():
+        previous_models = dict()
+    if prophet_params is None:
+        prophet_params = dict()
+    def new_model(building, regressors):
+        params = dict(DEFAULT_PROPHET_PARAMS, **prophet_params.get(building, {}).get('params', {}))
+        m = Prophet(mcmc_samples=mcmc_samples, **params)
+        for name in regressors:
+            m.add_regressor(name, mode=REGRESSORS[name]['mode'])
+        return m
+    def get_init(i, df_prophet, regressors):
+        # previous parameters fit only models with the same regressors and configuration
+        previous = previous_models.get(i)
+        if previous is None or isinstance(previous, BaselineModel) or set(getattr(previous, 'extra_regressors', {})) != set(regressors):
+            return None
+        try:
+            if get_model_config(previous) != get_model_config(new_model(i, regressors)):
+                logger.debug('configuration of %s changed, no warm start', i)
+                return None
+            if is_series_unchanged(previous, df_prophet):
+                return get_stan_init(previous)
+        except:
+            logger.debug('no warm start for %s', i)
+        return None
+    for i in buildings:
+        if methods[i] != 'prophet':
+            continue
+        logger.debug('%s', i)
+        start = time.perf_counter()
+        df_prophet = df.loc[df['BUILDING_ID']==i, ['Month', 'y']]
+        df_prophet.columns = ['ds', 'y']
+        df_prophet['ds'] = pd.to_datetime(df_prophet['ds'])
+        # regressors covering the history and the forecast horizon of the building
+        regressors, regressor_values = get_building_regressors(regressor_table, buildings_with_regressors, i, pd.DatetimeIndex(df_prophet['ds'].unique()))
+        if regressors:
+            logger.debug('include regressors %s', regressors)
+            df_prophet = df_prophet.join(regressor_values, on='ds').dropna().sort_values('ds')
+        logger.debug('df_prophet %s', shape(df_prophet))
         try:
-            print('model')
-            m = Prophet(seasonality_mode='multiplicative', mcmc_samples=300)
-            if i in plasma_buildings:
-                try:
-                    # try to model with volume
-                    print('add regressor')
-                    m.add_regressor('vol', mode='additive')
-                    print('model volume')
-                    m.fit(df_prophet)
-                    future = m.make_future_dataframe(periods=36, freq='MS') # need for future volume data
-                    future['BUILDING_ID'] = i
-                    print(future)
-                    future = future.rename(columns={'ds':'Month'})
-                    future = pd.merge(future, vol, on=['Month', 'BUILDING_ID'], how='left')
-                    future = future[['Month', 'Volume']]
-                    future.columns = ['ds', 'vol']
-                    print(future)
-                    print('predict')
-                    fcst = m.predict(future)
-                    reg_coef = regressor_coefficients(m)
-                    print(reg_coef)
-                    print('volume prediction completed')
-                except:
-                    print('except')
-                    # try to model without volume
-                    df_prophet = df.copy()
-                    df_prophet = df_prophet.loc[df_prophet['BUILDING_ID']==i]
-                    df_prophet = df_prophet[['Month', 'y']]
-                    df_prophet.columns = ['ds', 'y']
-                    m = Prophet(seasonality_mode='multiplicative', mcmc_samples=300)
-                    m.fit(df_prophet)
-                    future = m.make_future_dataframe(periods=36, freq='MS') # no need for future data
-                    fcst = m.predict(future)
-                    reg_coef = None
+            logger.debug('model')
+            m, warm = fit_prophet(lambda: new_model(i, regressors), df_prophet, get_init(i, df_prophet, regressors))
+            if regressors:
+                # history and horizon months with regressor values (coverage of the horizon checked above)
+                future = regressor_values.dropna().rename_axis('ds').reset_index()
             else:
-                m.fit(df_prophet)
-                future = m.make_future_dataframe(periods=36, freq='MS') # no need for future data
-                fcst = m.predict(future)
-                reg_coef = None
+                future = m.make_future_dataframe(periods=36, freq='MS')
+            logger.debug('predict')
+            fcst = m.predict(future)
+            reg_coef = regressor_coefficients(m) if regressors else None
         except:
-            print('modeling failed')
-            m = None
-            fcst = None
-            reg_coef = None
+            logger.warning('modeling failed, use baseline')
+            methods[i] = choose_baseline(n_months[i])
+            if fit_times is not None:
+                fit_times[i] = time.perf_counter() - start
+            continue
         prophet_models[i] = m
         prophet_fcst[i] = fcst
         prophet_reg_coeff[i] = reg_coef
+        if warm_starts is not None:
+            warm_starts[i] = warm
+        if fit_times is not None:
+            fit_times[i] = time.perf_counter() - start
+    # baseline forecasts of the short histories and failed Prophet fits
+    baseline = {i: method for i, method in methods.items() if method != 'prophet' and n_months[i] > 0}
+    start = time.perf_counter()
+    baseline_models, baseline_fcst = get_baselines(df, baseline)
+    for i in baseline:
+        prophet_models[i] = baseline_models[i]
+        prophet_fcst[i] = baseline_fcst[i]
+        prophet_reg_coeff[i] = None
+        if fit_times is not None:
+            # failed Prophet fits keep their time; the batch time is split over the buildings
+            fit_times[i] = fit_times.get(i, 0) + (time.perf_counter() - start) / len(baseline)
+    # buildings without any data: no model
+    for i in buildings:
+        if n_months[i] == 0:
+            logger.warning('no data for %s', i)
+    prophet_models = {i: prophet_models.get(i) for i in buildings}
+    prophet_fcst = {i: prophet_fcst.get(i) for i in buildings}
+    prophet_reg_coeff = {i: prophet_reg_coeff.get(i) for i in buildings}
     return prophet_models, prophet_fcst, prophet_reg_coeff
 
 
@@ -115,7 +304,24 @@ def get_prophet(df, vol):
 
 ###############################################################################
 ### Cross-validation and performance metrics
-def get_cv(df, prophet_models):
+# first cutoff two years after the first month, last cutoff one year before the last month, every 36 months
+CV_HORIZON = '360 days'
+
+
+def get_cutoffs(ds):
+    """
+    Returns the cross-validation cutoffs of a series (also used by the hyperparameter search).
+    
+    Args:
+        ds (pd.Series): The months of the series.
+    
+    Returns:
+        pd.DatetimeIndex: The cutoffs.
+    """
+    return pd.date_range(start=min(ds)+relativedelta(years=2), end=max(ds)-relativedelta(years=1), freq='36MS')
+
+
+def get_cv(df, prophet_models, cv_times=None):
     """
     Perform cross-validation and compute performance metrics for a set of Prophet models.
     See the prophet documentation for more information on timeseries cross-validation.
@@ -124,6 +330,7 @@ def get_cv(df, prophet_models):
     Args:
         df (pandas.DataFrame): DataFrame containing the data for the models.
         prophet_models (dict): Dictionary of Prophet models.
+        cv_times (dict): Optional; filled with the cross-validation time in seconds per building.
     
     Returns:
         tuple: A tuple containing two dictionaries:
@@ -133,16 +340,20 @@ def get_cv(df, prophet_models):
     cv_dict = dict()
     pm_dict = dict()
     for i in prophet_models.keys():
-        print(i)
+        logger.debug('%s', i)
+        start = time.perf_counter()
         df_prophet = df.copy()
         df_prophet = df_prophet.reset_index()
         df_prophet = df_prophet.loc[df_prophet['BUILDING_ID']==i, ['Month', 'y']]
         df_prophet.columns = ['ds', 'y']
-        print(df_prophet)
+        logger.debug('df_prophet %s', shape(df_prophet))
         try:
-            cutoffs = pd.date_range(start=min(df_prophet['ds'])+relativedelta(years=2), end=max(df_prophet['ds'])-relativedelta(years=1), freq='36MS')
+            # baseline models are not cross-validated
+            if prophet_models[i] is None or isinstance(prophet_models[i], BaselineModel):
+                raise ValueError('no Prophet model')
+            cutoffs = get_cutoffs(df_prophet['ds'])
             # perform cross-validation
-            df_cv = cross_validation(model=prophet_models[i], horizon='360 days', cutoffs=cutoffs)
+            df_cv = cross_validation(model=prophet_models[i], horizon=CV_HORIZON, cutoffs=cutoffs)
             # compute performance metrics
             df_p = performance_metrics(df_cv)
         except:
@@ -150,6 +361,8 @@ def get_cv(df, prophet_models):
             df_p = None
         cv_dict[i] = df_cv
         pm_dict[i] = df_p
+        if cv_times is not None:
+            cv_times[i] = time.perf_counter() - start
     return cv_dict, pm_dict
 
 
@@ -3,11 +3,21 @@
 ###################
 
 from datetime import date, datetime, timedelta
-from dateutil.relativedelta import relativedelta
 import numpy as np
 import os
 import pandas as pd
 
+from helper_functions import(
+    compact_frame
+)
+
+from log import(
+    get_logger,
+    shape
+)
+
+logger = get_logger(__name__)
+
 
 # convert prediction dictionary into dataframe
 def get_prd_dataframe(prd_dic):
@@ -23,13 +33,13 @@ def get_prd_dataframe(prd_dic):
     prd_dic = {k: v for k, v in prd_dic.items() if v is not None}
     try:
         for i in prd_dic.keys():
-            print(i)
+            logger.debug('%s', i)
             prd_dic[i]['BUILDING_ID'] = i
             prd_dic[i] = prd_dic[i][['ds', 'yhat' ,'yhat_lower', 'yhat_upper', 'BUILDING_ID']]
         prd_df = pd.concat(prd_dic.values(), ignore_index=False)
         prd_df = prd_df.rename(columns={'ds':'Impact Month'})
         prd_df['Impact Month'] = pd.to_datetime(prd_df['Impact Month'])
-        print('end get_prd_dataframe')
+        logger.info('end get_prd_dataframe')
     except:
         prd_df = None
     return prd_df
@@ -56,25 +66,21 @@ def get_app_dataframe(df, prd_df):
         df_hist['type'] = 'Actuals'
         df_hist[['yhat_lower', 'yhat_upper']] = np.nan
         df_hist = df_hist[['y', 'yhat_lower', 'yhat_upper', 'BUILDING_ID', 'type']]
-        print('df_hist')
-        print(df_hist)
+        logger.debug('df_hist %s', shape(df_hist))
         # prepare predictions to merge with actuals
         df_prd = prd_df.copy()
         df_prd['type'] = 'Predicted'
         df_prd = df_prd.rename(columns={'yhat':'y'})
         df_prd = df_prd[['Impact Month', 'y', 'yhat_lower', 'yhat_upper','BUILDING_ID', 'type']]
         df_prd = df_prd.set_index('Impact Month')
-        print('df_prd')
-        print(df_prd)
+        logger.debug('df_prd %s', shape(df_prd))
         # replace predictions with actuals: df_hist contains all actuals
         temp_df = pd.DataFrame()
         for i in df_prd['BUILDING_ID'].unique():
             temp_hist = df_hist.loc[df_hist['BUILDING_ID']==i]
-            print('temp_hist')
-            print(temp_hist)
+            logger.debug('temp_hist %s', shape(temp_hist))
             temp_prd = df_prd.loc[df_prd['BUILDING_ID']==i]
-            print('temp_prd')
-            print(temp_prd)
+            logger.debug('temp_prd %s', shape(temp_prd))
             temp_df = temp_df.append(temp_prd[~temp_prd.index.isin(temp_hist.index)])
         df_app = pd.concat([df_hist, temp_df])
         df_app = df_app.reset_index()
@@ -109,7 +115,7 @@ def add_columns(dat, df):
         #dat_add[(dat_add['PortfolioOwner']=='Site-Rieti') & (dat_add['SYSTM_SPCFIC_MSR']=='Energy.2a.nrg')]
         # need to expand the dat_add till the end of the predictions (at least three years)
         for i in dat_add['BUILDING_ID'].unique():
-            print(i)
+            logger.debug('%s', i)
             for j in range(0, 40):
                 new_row = dat_add[dat_add['BUILDING_ID']==i].tail(1)
                 new_row['Impact Month'] = new_row['Impact Month'] + pd.DateOffset(months=1)
@@ -122,7 +128,7 @@ def add_columns(dat, df):
         # the country information is available in the steam extract from enablon (df)
         dat = pd.merge(dat, dat_add, on=['BUILDING_ID', 'Impact Month'], how='left') # rieti creates duplicates, also global biolife us
     except:
-        print('post-processing failed in add_columns()')
+        logger.warning('post-processing failed in add_columns()')
         dat = None
     return dat
 
@@ -138,7 +144,127 @@ def add_columns(dat, df):
 # requirements are measure, cf, ecf, po_fp - all loaded in etl function
 # apply energy conversion in load_enablon function
 
-def get_energy_conversion(df, measure, cf, ecf, scf):
+# all conversions are looked up in one factor table: tons of GHG per joule, keyed on the measure,
+# SYSTM_SPCFIC_MSR, country group and FOLDERPATH, and valid from a month (valid_from = year * 12 + month - 1)
+# the keys a measure does not depend on are ANY, in the table and in the rows of that measure, so the
+# rows of all measures find their factor in one as-of join: the factor of the key with the latest
+# valid_from up to the month of the row; fixed factors are valid from ANY_MONTH (always)
+# CONVERSION_KEYS: the keys the factors of a measure depend on (default: the measure only)
+# rows without a factor keep an empty y_ghg, except for electricity (rows without a grid factor are dropped)
+MEASURE_NATURAL_GAS = 'Natural Gas - Useage (Reported)'
+MEASURE_STEAM = 'Purchased Steam - Usage'
+MEASURE_ELECTRICITY = 'Purchased Electricity - Usage'
+CONVERSION_KEYS = {
+    MEASURE_NATURAL_GAS: ['SYSTM_SPCFIC_MSR', 'country_group'],
+    MEASURE_STEAM: ['SYSTM_SPCFIC_MSR', 'FOLDERPATH'],
+    MEASURE_ELECTRICITY: ['FOLDERPATH']
+}
+DROP_WITHOUT_FACTOR = [MEASURE_ELECTRICITY]
+FACTOR_KEYS = ['measure', 'SYSTM_SPCFIC_MSR', 'country_group', 'FOLDERPATH']
+ANY = '*'
+ANY_MONTH = -1
+# natural gas reported in volumetric units: joules per cubic meter depend on the country (CAN/US or ROW)
+NORTH_AMERICA = ['Canada', 'United States', 'Biolife US']
+GAS_JOULES_PER_M3 = {'north_america': 38116087.31, 'rest_of_world': 34390174.57}
+# steam reported in mass units: joules per kg
+STEAM_JOULES_PER_KG = 2326006.377
+KWH_PER_J = 277.778 / 1000000000
+
+
+def get_conversion_factors(cf, ecf=None, scf=None):
+    """
+    Joins the conversion factors of all measures into one table of tons GHG per joule.
+    
+    Args:
+        cf (pd.DataFrame): The data containing conversion factors (flat file upload).
+        ecf (pd.DataFrame): The electricity conversion factor intervals (prepare_ecf()).
+        scf (pd.DataFrame): The steam conversion factor intervals (prepare_scf()).
+    Returns:
+        factors (pd.DataFrame): Columns FACTOR_KEYS, valid_from and factor, one row per key and valid_from.
+    """
+    def table(measure, factor, valid_from=ANY_MONTH, **keys):
+        dat = pd.DataFrame({'factor': factor}).assign(measure = measure, valid_from = valid_from)
+        for key in FACTOR_KEYS[1:]:
+            dat[key] = keys.get(key, ANY)
+        return dat[FACTOR_KEYS + ['valid_from', 'factor']]
+    def month_key(month):
+        month = pd.to_datetime(month)
+        return (month.dt.year * 12 + month.dt.month - 1).values
+    factors = []
+    cf = cf.assign(factor = cf['CF Final'].astype(float) / 1000000000 / 1000)
+    # measures with one physical/fixed factor (cf: kg GHG/GJ)
+    standard = cf.loc[~cf['Indicators'].isin(CONVERSION_KEYS.keys())].drop_duplicates('Indicators')
+    factors.append(table(standard['Indicators'].values, standard['factor'].values))
+    # natural gas (cf: kg GHG/L for Energy.2a.vol, kg GHG/GJ for Energy.2a.nrg): joules to cubic meters to liters
+    gas = cf.loc[cf['Indicators'] == MEASURE_NATURAL_GAS].drop_duplicates('Cd_Key_2').set_index('Cd_Key_2')['factor']
+    for country_group, joules_per_m3 in GAS_JOULES_PER_M3.items():
+        if 'Energy.2a.nrg' in gas.index:
+            factors.append(table(MEASURE_NATURAL_GAS, [gas['Energy.2a.nrg']], SYSTM_SPCFIC_MSR='Energy.2a.nrg', country_group=country_group))
+        if 'Energy.2a.vol' in gas.index:
+            factors.append(table(MEASURE_NATURAL_GAS, [gas['Energy.2a.vol'] * 1000000000 / joules_per_m3 * 1000], SYSTM_SPCFIC_MSR='Energy.2a.vol', country_group=country_group))
+    # steam (scf: kg GHG/kWh for Energy.11a.nrg, kg GHG/kg for Energy.11a.mass), per folderpath and month
+    if scf is not None and len(scf):
+        per_joule = np.where(scf['SYSTM_SPCFIC_MSR'] == 'Energy.11a.mass', 1 / STEAM_JOULES_PER_KG, KWH_PER_J)
+        factors.append(table(MEASURE_STEAM, scf['Nmbr_Val'].astype(float).values * per_joule / 1000,
+            SYSTM_SPCFIC_MSR=scf['SYSTM_SPCFIC_MSR'].values, FOLDERPATH=scf['FOLDERPATH'].values, valid_from=month_key(scf['Valid From'])))
+    # electricity (ecf: kg GHG/kWh), per folderpath and month
+    if ecf is not None and len(ecf):
+        factors.append(table(MEASURE_ELECTRICITY, ecf['Nmbr_Val'].astype(float).values * KWH_PER_J / 1000,
+            FOLDERPATH=ecf['FOLDERPATH'].values, valid_from=month_key(ecf['Valid From'])))
+    factors = pd.concat(factors, ignore_index=True).dropna(subset=['factor']).drop_duplicates(FACTOR_KEYS + ['valid_from'])
+    logger.debug('conversion factors %s', shape(factors))
+    return factors
+
+
+def get_factor_positions(df, measure, factors):
+    """
+    Looks up the factor table row of every row (-1 without a factor). The keys are encoded as codes
+    of the factor table values and combined into one integer key (keys the measure of a row does
+    not depend on are ANY), the factor valid in the month of the row is found with an as-of join.
+    
+    Args:
+        df (pd.DataFrame): The dataframe containing usage data.
+        measure (str): The measure of all rows; None uses the column measure.
+        factors (pd.DataFrame): The factor table (get_conversion_factors()).
+    Returns:
+        positions (np.ndarray): The factor table row per row.
+        measures (np.ndarray): The measure per row.
+    """
+    measures = pd.Series(measure, index=df.index) if isinstance(measure, str) else df['measure']
+    country = df['Cntry'] if 'Cntry' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    values = {
+        'measure': measures,
+        'SYSTM_SPCFIC_MSR': df['SYSTM_SPCFIC_MSR'],
+        'country_group': np.where(country.isin(NORTH_AMERICA), 'north_america', 'rest_of_world'),
+        'FOLDERPATH': df['FOLDERPATH']}
+    measure_categories = pd.Index(factors['measure'].unique())
+    measure_codes = measure_categories.get_indexer(measures)
+    row_key = np.zeros(len(df), np.int64)
+    factor_key = np.zeros(len(factors), np.int64)
+    unknown = np.zeros(len(df), bool)
+    for key in FACTOR_KEYS:
+        categories = pd.Index(factors[key].unique())
+        codes = categories.get_indexer(values[key])
+        if key != 'measure':
+            # rows of measures without this key use ANY (the appended False serves unknown measures)
+            used = np.array([key in CONVERSION_KEYS.get(m, []) for m in measure_categories] + [False])[measure_codes]
+            codes = np.where(used, codes, categories.get_indexer([ANY])[0])
+        unknown |= codes < 0
+        row_key = row_key * len(categories) + codes
+        factor_key = factor_key * len(categories) + categories.get_indexer(factors[key])
+    row_key[unknown] = -1
+    # as-of join on the month: both sides sorted by month, matched within the same key
+    month_key = (df['Impact Month'].dt.year * 12 + df['Impact Month'].dt.month - 1).fillna(ANY_MONTH).astype(np.int64).values
+    rows = pd.DataFrame({'key': row_key, 'month_key': month_key, 'row': np.arange(len(df))}).sort_values('month_key', kind='stable')
+    table = pd.DataFrame({'key': factor_key, 'month_key': factors['valid_from'].values.astype(np.int64), 'position': np.arange(len(factors))})\
+        .sort_values('month_key', kind='stable')
+    matched = pd.merge_asof(rows, table, on='month_key', by='key', direction='backward')
+    positions = np.full(len(df), -1)
+    positions[matched['row'].values] = matched['position'].fillna(-1).astype(int).values
+    return positions, measures.values
+
+
+def get_energy_conversion(df, measure, cf, ecf, scf, factors=None):
     """
     Apply energy conversion to the given dataframe (from Joules to GHG). There are four different cases:
     Natural gas conversion factors depend on whether gas is reported in volumetric (m3) or energetic (J) units
@@ -146,68 +272,40 @@ def get_energy_conversion(df, measure, cf, ecf, scf):
     Steam conversion factors depend on whether steam is reported in mass (kg) or energy units (J)
     Electricity conversion factors depend on the energy grid (geographic location); defined by folderpaths
     Convert all other indicators simply with the pyhsical/fixed conversion factor
+    All cases are looked up in one factor table (get_conversion_factors()) and applied in one multiplication.
     
     Args:
         df (pd.DataFrame): The dataframe containing usage data.
-        measure (str): The measure/indicator for which unit conversion to CO2 needs to be applied.
+        measure (str): The measure/indicator for which unit conversion to CO2 needs to be applied;
+            None converts the rows of several measures at once (column measure).
         cf (pd.DataFrame): The data containing conversion factors (flat file upload).
         ecf (pd.DataFrame): The data containing electricity conversion factors (EDB).
         scf (pd.DataFrame): The data containing steam conversion factors (EDB).
+        factors (pd.DataFrame): A prepared factor table; built from cf, ecf and scf if None.
     Returns:
         df (pd.DataFrame): The dataframe with energy conversion applied.
     """
     try:
-        # create a new columne in data frame for emissions (kg GHG)
-        df['y_ghg'] = None 
-        # convert Natural Gas - Usage: the conversion factors depend on unit of measurement (volumetric or energetic)
-        if measure == 'Natural Gas - Useage (Reported)':
-            # convert joules to gigajoules for Energy.2a.nrg
-            df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.2a.nrg', 'y_ghg'] = df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.2a.nrg', 'y']/1000000000
-            # convert cubic meters to liters
-            #df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.2a.vol', 'y'] = df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.2a.vol', 'y']*100
-            # convert joules to cubic meteres (requires country information) and convert cubic meters to liters (*1000)
-            df.loc[(df['Cntry'].isin(['Canada', 'United States', 'Biolife US'])) & (df['SYSTM_SPCFIC_MSR']=='Energy.2a.vol'), 'y_ghg'] = df.loc[(df['Cntry'].isin(['Canada', 'United States', 'Biolife US'])) & (df['SYSTM_SPCFIC_MSR']=='Energy.2a.vol'), 'y'].astype(float) * 1/38116087.31 * 1000
-            df.loc[~(df['Cntry'].isin(['Canada', 'United States', 'Biolife US'])) & (df['SYSTM_SPCFIC_MSR']=='Energy.2a.vol'), 'y_ghg'] = df.loc[~(df['Cntry'].isin(['Canada', 'United States', 'Biolife US'])) & (df['SYSTM_SPCFIC_MSR']=='Energy.2a.vol'), 'y'].astype(float) * 1/34390174.57 * 1000
-            # extract coefficients from cf data frame
-            coeff_vol = cf.loc[(cf['Indicators']==measure)&(cf['Cd_Key_2']=='Energy.2a.vol')][['CF Final']].values[0].item()
-            coeff_nrg = cf.loc[(cf['Indicators']==measure)&(cf['Cd_Key_2']=='Energy.2a.nrg')][['CF Final']].values[0].item()
-            df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.2a.vol', 'y_ghg'] = df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.2a.vol', 'y_ghg'].astype(float)*coeff_vol # cf: kg GHG/L
-            df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.2a.nrg', 'y_ghg'] = df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.2a.nrg', 'y_ghg'].astype(float)*coeff_nrg # cf: kg GHG/kWh
-            print('end convert natural gas')
-        # convert Purchased Steam - Usage: the conversion factors depend on unit of measurement (mass or energy) and location; defined by folderpath
-        elif measure == 'Purchased Steam - Usage':
-            # find Number Value based on FOLDERPATH, SYSTM_SPCFIC_MSR (mass or energy) and Month (steam cf change over time)
-            df = pd.merge(df, scf, on = ['FOLDERPATH', 'SYSTM_SPCFIC_MSR', 'Impact Month'], how='left').drop_duplicates()
-            # convert the energy units to kWh for Energy.11a.nrg
-            df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.11a.nrg','y_ghg'] = df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.11a.nrg','y'].astype(float)/1000000000*277.778 
-            # convert the energy unit from GJ back to kg for Energy.11a.mass
-            df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.11a.mass','y_ghg'] = df.loc[df['SYSTM_SPCFIC_MSR']=='Energy.11a.mass','y'].astype(float)*1/2326006.377
-            df['y_ghg'] = df['y_ghg'].astype(float) * df['Nmbr_Val'].astype(float) # cf: kg GHG/kWh (Energy.11a.nrg) or kg GHG/kg (Energy.11a.mass)
-            print('end convert steam')
-        # convert Purchased Electricity - Usage: the conversion factors depend on time and geographic location; defined by date and folderpath
-        elif measure == 'Purchased Electricity - Usage':
-            # apply electricity conversion factor based on folderpath and month (conversion factor changes with time)
-            df = pd.merge(df, ecf, on = ['FOLDERPATH', 'Impact Month']).drop_duplicates() # not date available : go up to three years past current date
-            # convert J to GJ (*10^9) and GJ into kWh (*277.778), then multiply the energy usage with the conversion factor
-            df['y_ghg'] = df['y']/1000000000 * 277.778 * df['Nmbr_Val'].astype(float)# cf: kg GHG/kwH
-            print('end convert electricity')
-        # convert all indicators which are not equal to Purchased - Electricity - Usage and not equal to Natural Gas - Useage (Reported) and not equal to Purchased Steam - Usage
-        else:
-            # find coefficient based on measure in cf (measure is identical with indicator)
-            coeff = cf.loc[cf['Indicators']==measure][['CF Final']].values[0].item()
-            print(coeff)
-            # multiply with conversion factor
-            df['y_ghg'] = df['y'].astype(float)/1000000000*coeff
-            print('end convert standard indicator')
-        # convert kg into tons of CO2
-        df['y_ghg'] = df['y_ghg']/1000
+        if factors is None:
+            factors = get_conversion_factors(cf, ecf, scf)
+        df['Impact Month'] = pd.to_datetime(df['Impact Month'])
+        positions, measures = get_factor_positions(df, measure, factors)
+        factor = np.where(positions >= 0, factors['factor'].values[positions], np.nan)
+        # convert joules into tons of CO2
+        df['y_ghg'] = df['y'].astype(float).values * factor
+        missing = np.isnan(factor)
+        drop = missing & np.isin(measures, DROP_WITHOUT_FACTOR)
+        if missing.any():
+            logger.warning('no conversion factor for %s rows (%s dropped)', int(missing.sum()), int(drop.sum()))
+        if drop.any():
+            df = df.loc[~drop].copy()
         # convert joules into gigajoules
         df['y'] = df['y']/1000000000
         df['yhat_lower'] = df['yhat_lower']/1000000000
         df['yhat_upper'] = df['yhat_upper']/1000000000
-        print('end energy conversion')
+        logger.info('end energy conversion')
     except:
-        print('energy conversion failed in get_energy_conversion()')
+        logger.warning('energy conversion failed in get_energy_conversion()')
         df = None
     return df
 
@@ -254,7 +352,7 @@ def aggregate_on_portfolio_level(df):
         df['y_ghg'] = df.groupby(['PortfolioOwner', 'Impact Month'])['y_ghg'].transform('sum')
         df = df.drop_duplicates()
     except:
-        print('aggregate on portfolio level failed')
+        logger.warning('aggregate on portfolio level failed')
         df = None
     return df
 
@@ -291,19 +389,17 @@ def add_spot(dat, spot, measure):
             spot = spot.loc[spot['Enablon Source Name']==measure] # use the added Enablon Source Name instead of EM Source Name
             # add the SPOT data: based on impact realization date and PortfolioOwner
             dat_spot = pd.merge(dat, spot, how='left', on=['Impact Month', 'PortfolioOwner'])
-            print('test three')
             # add spot emission impacts
             dat_spot['Emission Impact Sum'] = dat_spot['Emission Impact Sum'].fillna(0)
             dat_spot['Emission Impact Accumulated'] = dat_spot.groupby('PortfolioOwner')['Emission Impact Sum'].cumsum()
             # aggregate every month (should happen after predictions are merged with actuals)
             dat_spot['y_ghg_with_spot'] = dat_spot['y_ghg'] + dat_spot['Emission Impact Accumulated']
-            print('test four')
             # add spot energy impacts
             dat_spot['Energy Impact Sum'] = dat_spot['Energy Impact Sum'].fillna(0)
             dat_spot['Energy Impact Accumulated'] = dat_spot.groupby('PortfolioOwner')['Energy Impact Sum'].cumsum()
             # aggregate every month (should happen after predictions are merged with actuals)
             dat_spot['y_with_spot'] = dat_spot['y'] + dat_spot['Energy Impact Accumulated']
-            print('end add spot')
+            logger.info('end add spot')
         except:
             dat_spot = dat
             dat_spot['Emission Impact Sum'] = 0
@@ -311,7 +407,7 @@ def add_spot(dat, spot, measure):
             dat_spot['y_with_spot'] = dat_spot['y']
             dat_spot['y_ghg_with_spot'] = dat_spot['y_ghg']
     else:
-        print('spot not included')
+        logger.warning('spot not included')
         dat_spot = None
     return dat_spot
 
@@ -326,6 +422,10 @@ def add_vppa(dat, vppa, usage_coeff):
     as emissions (tons of GHG) or energy (kWh). Goal of this function is to find the overage.
     Compare the total use of energy to the vppa value. In case, there is an overhead, it is
     divided evenly into 12 months to replace the original predictions.
+    All contracts are joined with the months of their portfolio owner in their 12-month window at
+    once; the totals are taken before any contract is applied. Where the windows of several contracts
+    of a portfolio owner overlap, the contract with the latest start (the last one on equal starts)
+    replaces the predictions.
     
     Args:
         dat (DataFrame): the data containing historical values and predicitons
@@ -336,29 +436,31 @@ def add_vppa(dat, vppa, usage_coeff):
         DataFrame: The DataFrame with VPPA project impacts added to the timeseries forecasts
     """
     try:
-        df_vppa = vppa.copy()
-        # find the overage for each site
-        overhead = []
-        for i in range(0,vppa.shape[0]):
-            portfolio_owner = vppa['PortfolioOwner'][i]
-            # find starting date of vppa
-            vppa_start = vppa['EmissionsImpactRealizationDate'][i]
-            vppa_end = vppa_start + relativedelta(months=12)
-            # find the total energy usage of the portfolio owner for the year starting from the vppa start year
-            e_total = dat.loc[dat['PortfolioOwner']==portfolio_owner]
-            e_total = e_total.loc[(e_total['Impact Month']>vppa_start) & (e_total['Impact Month']<=vppa_end)]
-            e_total = e_total['y_ghg_with_spot'].sum()
-            vppa_total = df_vppa['CalculatedEmissionsImpact'][i] * usage_coeff
-            # energy difference between usage (actual & predict) and vppa total
-            e_diff = (e_total + vppa_total)
-            # split up per month
-            overhead_monthly = e_diff/12
-            overhead.append(overhead_monthly)
-            # replace the prediction from beginning of vppa contract till the end of the contract
-            dat.loc[(dat['Impact Month']>vppa_start) & (dat['Impact Month']<=vppa_end) & (dat['PortfolioOwner']==portfolio_owner), 'y_ghg_with_spot'] = overhead_monthly
-            print('vppa included')
+        contracts = vppa[['PortfolioOwner', 'EmissionsImpactRealizationDate', 'CalculatedEmissionsImpact']].reset_index(drop=True)
+        contracts['contract'] = np.arange(contracts.shape[0])
+        # contract window: the 12 months after the vppa start
+        contracts['vppa_start'] = pd.to_datetime(contracts['EmissionsImpactRealizationDate'])
+        contracts['vppa_end'] = contracts['vppa_start'] + pd.DateOffset(months=12)
+        rows = pd.DataFrame({
+            'row': np.arange(dat.shape[0]),
+            'PortfolioOwner': dat['PortfolioOwner'].values,
+            'Impact Month': pd.to_datetime(dat['Impact Month']).values,
+            'y_ghg_with_spot': dat['y_ghg_with_spot'].astype(float).values})
+        window = pd.merge(rows, contracts[['contract', 'PortfolioOwner', 'vppa_start', 'vppa_end']], on='PortfolioOwner')
+        window = window.loc[(window['Impact Month'] > window['vppa_start']) & (window['Impact Month'] <= window['vppa_end'])]
+        # find the total energy usage of the portfolio owner for the year starting from the vppa start
+        e_total = window.groupby('contract')['y_ghg_with_spot'].sum().reindex(contracts['contract'], fill_value=0).values
+        vppa_total = contracts['CalculatedEmissionsImpact'].astype(float).values * usage_coeff
+        # energy difference between usage (actual & predict) and vppa total, split up per month
+        overhead_monthly = (e_total + vppa_total) / 12
+        # replace the prediction from beginning of vppa contract till the end of the contract
+        window = window.sort_values(['vppa_start', 'contract']).drop_duplicates('row', keep='last')
+        y_ghg_with_spot = dat['y_ghg_with_spot'].values.copy()
+        y_ghg_with_spot[window['row'].values] = overhead_monthly[window['contract'].values]
+        dat['y_ghg_with_spot'] = y_ghg_with_spot
+        logger.info('vppa included: %s contracts, %s months replaced', contracts.shape[0], window.shape[0])
     except:
-        print('vppa not included')
+        logger.warning('vppa not included')
     return dat
 
 
@@ -383,7 +485,7 @@ def negative_to_zero(dat):
         dat.loc[dat['y_ghg']<0, 'y_ghg'] = 0
         dat.loc[dat['y_ghg_with_spot']<0, 'y_ghg_with_spot'] = 0
     except:
-        print('failed negative_to_zero()')
+        logger.warning('failed negative_to_zero()')
     return dat
 
 
@@ -414,4 +516,4 @@ def select_columns(dat):
         dat = dat[columns]
     else:
         dat = pd.DataFrame(columns=columns)
-    return dat
\ No newline at end of file
+    return compact_frame(dat)
\ No newline at end of file
@@ -9,9 +9,16 @@ import os
 import pandas as pd
 
 from helper_functions import(
+    compact_frame,
     date_conversion
 )
 
+from log import(
+    get_logger
+)
+
+logger = get_logger(__name__)
+
 
 
 ###############################################################################
@@ -162,7 +169,7 @@ def prepare_leaks(leaks, tango_fp, spot_fp_po):
         'F_MNTH', 
         'F_YEAR', 
         'F_QRTR']]
-    return leaks
+    return compact_frame(leaks)
 
 
 
@@ -251,8 +258,34 @@ def prepare_fleet(fleet):
         'F_MNTH', 
         'F_YEAR', 
         'F_QRTR']]
-    print('end fleet preparation')
-    return fleet
+    logger.info('end fleet preparation')
+    return compact_frame(fleet)
+
+
+
+###############################################################################
+### conversion factor validity intervals
+# electricity and steam conversion factors change over time: every factor is stored as an interval
+# per folderpath (and code key) from the month it was reported (Valid From) until the month a
+# different factor was reported (Valid To, exclusive; NaT for the last factor, which stays valid
+# for all future months); consecutive months reporting the same factor are one interval
+# the intervals are applied with an as-of join in get_energy_conversion(), no future months are stored
+def get_validity_intervals(dat, keys):
+    """
+    Compresses monthly conversion factors into validity intervals.
+    
+    Args:
+        dat (pd.DataFrame): The factors with columns keys, Month and Nmbr_Val.
+        keys (list): The columns identifying a factor series (e.g. FOLDERPATH).
+    Returns:
+        dat (pd.DataFrame): One row per interval with columns Valid From and Valid To instead of Month.
+    """
+    dat = dat.sort_values(keys + ['Month']).drop_duplicates(keys + ['Month']).reset_index(drop=True)
+    series = dat[keys].ne(dat[keys].shift()).any(axis=1)
+    change = series | dat['Nmbr_Val'].ne(dat['Nmbr_Val'].shift())
+    dat = dat.loc[change].rename(columns={'Month': 'Valid From'}).reset_index(drop=True)
+    dat['Valid To'] = dat.groupby(keys, dropna=False)['Valid From'].shift(-1)
+    return dat
 
 
 
@@ -260,44 +293,24 @@ def prepare_fleet(fleet):
 ### preprocess energy conversion factors
 def prepare_ecf(ecf):
     """
-    Preprocess energy conversion factors.
+    Preprocess energy conversion factors into validity intervals per folderpath.
     
     Args:
         ecf (pd.DataFrame): The energy conversion factors data frame.
     Returns:
-        ecf (pd.DataFrame): The preprocessed energy conversion factors DataFrame.
+        ecf (pd.DataFrame): The preprocessed energy conversion factors DataFrame (get_validity_intervals()).
     """
     ecf['Month'] = pd.to_datetime(ecf['Month'])
+    ecf['Nmbr_Val'] = ecf['Nmbr_Val'].astype(float)
     ### special case izumisano: izumisano reported multiple conversion factors per month
-    # filter for the highest conversion factor in izumisano per month
-    df_filtered = ecf.loc[ecf['FOLDERPATH']=='Takeda > APAC > JPN > JPN.20 > 42105']
-    # Group the DataFrame by month
-    df_grouped = df_filtered.groupby('Month')
-    # Define a function to perform the desired action for each group
-    def filter_highest_value(group):
-        group_sorted = group.sort_values('Nmbr_Val', ascending=False)
-        return group_sorted.head(1)
-    # Apply the function to each group
-    ecf_izumisano = df_grouped.apply(filter_highest_value)
-    # drop all reported izumisano values
-    ecf = ecf.drop(ecf.loc[ecf['FOLDERPATH']=='Takeda > APAC > JPN > JPN.20 > 42105'].index)
-    # replace with the highest reported value only
-    ecf = ecf.append(ecf_izumisano)
+    # keep the highest conversion factor in izumisano per month
+    izumisano = ecf['FOLDERPATH']=='Takeda > APAC > JPN > JPN.20 > 42105'
+    ecf_izumisano = ecf.loc[izumisano].sort_values('Nmbr_Val', ascending=False).drop_duplicates('Month')
+    ecf = pd.concat([ecf.loc[~izumisano], ecf_izumisano])
     ### electricity conversion factors are required for future months to convert predictions into units of CO2
-    # find the overall max date of electricity data and extend by three years (required for energy conversion)
-    max_date = ecf['Month'].max() + pd.DateOffset(years=3) 
-    ecf = ecf.reset_index(drop=True)
-    # take the last/most recent available ecf value for each folderpath and extend it to the max_date (required for energy conversion)
-    for i in ecf['FOLDERPATH'].unique():
-        print(i)
-        max_date_folderpath = ecf.loc[ecf['FOLDERPATH']==i]['Month'].max() # max date per folderpath
-        last_ecf_val = ecf.loc[(ecf['FOLDERPATH']==i) & (ecf['Month']==max_date_folderpath), 'Nmbr_Val'].iloc[0] # last ecf value per folderpath
-        while (max_date.year - max_date_folderpath.year) * 12 + (max_date.month - max_date_folderpath.month) > 0:
-            new_row = ecf.loc[(ecf['FOLDERPATH']==i) & (ecf['Month']==max_date_folderpath) & (ecf['Nmbr_Val']==last_ecf_val)]
-            new_row['Month'] = new_row['Month'] + pd.DateOffset(months=1)
-            ecf = ecf.append(new_row, ignore_index=True)
-            max_date_folderpath = ecf.loc[ecf['FOLDERPATH']==i, 'Month'].max()
-    ecf = ecf.rename(columns={'Month': 'Impact Month'})
+    # the last reported factor of every folderpath stays valid after its last month
+    ecf = get_validity_intervals(ecf, ['FOLDERPATH'])
+    logger.debug('ecf intervals %s', ecf.shape)
     return ecf
 
 
@@ -307,52 +320,62 @@ def prepare_ecf(ecf):
 ### preprocess steam conversion factors
 def prepare_scf(scf):
     """
-    Preprocess steam conversion factors. Similar to prepare_ecf(), although with modifications.
+    Preprocess steam conversion factors into validity intervals per folderpath and code key.
     
     Args:
         scf (pd.DataFrame): The steam conversion factors data frame.
     Returns:
-        scf (pd.DataFrame): The preprocessed steam conversion factors DataFrame.
+        scf (pd.DataFrame): The preprocessed steam conversion factors DataFrame (get_validity_intervals()).
     """
     # data wrangling:
     # data type
     scf['Month'] = pd.to_datetime(scf['Month'])
-    # rename columns
-    scf = scf.rename(columns={'Month':'Impact Month'})
+    scf['Nmbr_Val'] = scf['Nmbr_Val'].astype(float)
     # drop NA
-    scf.dropna(subset=['Nmbr_Val'], inplace=True)
-    scf = scf[scf['Nmbr_Val'] != 0]
+    scf = scf.dropna(subset=['Nmbr_Val'])
+    scf = scf.loc[scf['Nmbr_Val'] != 0].copy()
     # derive SYSTM_SPCFIC_MSR from Code_Key_2; required for merging with Enablon data later
     scf['SYSTM_SPCFIC_MSR'] = None
     scf.loc[scf['Cd_Key_2'] == 'Energy.EF.11.MASS', 'SYSTM_SPCFIC_MSR'] = 'Energy.11a.mass'
     scf.loc[scf['Cd_Key_2']=='Energy.EF.11.NRG', 'SYSTM_SPCFIC_MSR'] = 'Energy.11a.nrg'
     # steam conversion factors are required for future months to convert predictions into units of CO2
-    # take the last/most recent available scf value for each folderpath and extend it by three years (required for energy conversion)
-    scf = scf.sort_values('Impact Month')
-    scf = scf.drop_duplicates()
-    # max_date: three years ahead of current max date
-    max_date = scf['Impact Month'].max() + pd.DateOffset(years=3)
-    # perform the same action for both Cd_Key_2 ('Energy.EF.11.MASS', 'Energy.EF.11.NRG')
-    # every folder path has its own steam conversion factor that needs to be extended by three years into the future
-    for j in scf['Cd_Key_2'].unique():
-        print(j)
-        for i in scf['FOLDERPATH'].unique():
-            try:
-                print(i)
-                max_date_folderpath = scf.loc[(scf['FOLDERPATH']==i) & (scf['Cd_Key_2']==j)]['Impact Month'].max() # max date per folderpath
-                min_date_folderpath = scf.loc[(scf['FOLDERPATH']==i) & (scf['Cd_Key_2']==j)]['Impact Month'].min() # min date per folderpath
-                last_scf_row = scf.loc[(scf['FOLDERPATH']==i) & (scf['Cd_Key_2']==j) & (scf['Impact Month']==max_date_folderpath)] # last scf row
-                diff_months = (max_date.year - max_date_folderpath.year) * 12 + (max_date.month - max_date_folderpath.month) # difference in months
-                scf = pd.concat([scf, pd.concat([last_scf_row]*diff_months)]) # replicate the last row by this number
-                date_list = pd.date_range(min_date_folderpath, max_date,freq='MS') # create date range list
-                scf.loc[(scf['FOLDERPATH']==i) & (scf['Cd_Key_2']==j), 'Impact Month'] = date_list
-            except:
-                continue
+    # every folder path has its own steam conversion factor per code key ('Energy.EF.11.MASS', 'Energy.EF.11.NRG'),
+    # the last reported factor stays valid after its last month
+    scf = get_validity_intervals(scf, ['FOLDERPATH', 'Cd_Key_2'])
+    logger.debug('scf intervals %s', scf.shape)
     return scf
 
 
 
 
+###############################################################################
+### preprocess spot: folderpath and portfolio owner
+def prepare_spot_fp_po(Spot_EMPortfolioOwner, Spot_SpotPortfolioOwner):
+    """
+    Matches the environmental portfolio owners with their folderpaths.
+    
+    Args:
+        Spot_EMPortfolioOwner (pd.DataFrame): DataFrame containing folderpath - required to match environmental portfolio owner with folderpath.
+        Spot_SpotPortfolioOwner (pd.DataFrame): DataFrame containing portoflio owner - required to match environmental portfolio owner with folderpath.
+    Returns:
+        spot_fp_po (pd.DataFrame): The environmental portfolio owners with the associated folderpaths.
+    """
+    # rename column from EMPortfolioOwnerID to PortfolioOwnerID
+    Spot_EMPortfolioOwner = Spot_EMPortfolioOwner.rename(columns={"EMPortfolioOwnerID": "PortfolioOwnerID"})
+    # add FOLDERPATH (EMPortfolioOwnerGroup) on PortfolioOwnerID: # spot_fp_po contains the environmental portfolio owner with the associated folderpaths
+    spot_fp_po = pd.merge(Spot_EMPortfolioOwner, Spot_SpotPortfolioOwner, on='PortfolioOwnerID')
+    # rename EMPortfolioOwnerGroup to FOLDERPATH
+    spot_fp_po = spot_fp_po.rename(columns={'EMPortfolioOwnerGroup': 'FOLDERPATH'})
+    # the folderpath for Site-Vashi does not match with the tango_fp. Manually change folderpath
+    spot_fp_po.loc[spot_fp_po['FOLDERPATH']=='Takeda > APAC > IND > Temp.Vash','FOLDERPATH'] = 'Takeda > APAC > IND > 43101'
+    # make sure there are no duplicates for Vashi in case the folderpath is corrected in the raw data in the future
+    spot_fp_po = spot_fp_po.drop_duplicates()
+    spot_fp_po = spot_fp_po[['FOLDERPATH', 'PortfolioOwner']]
+    return spot_fp_po
+
+
+
+
 ###############################################################################
 ### run all preprocess functions
 def preprocess(Spot_EMPortfolioOwner, Spot_SpotPortfolioOwner, spot, msrs, leaks, fleet, tango_fp, ecf, scf, vol_past, vol_future, spot_lookup):
@@ -373,31 +396,21 @@ def preprocess(Spot_EMPortfolioOwner, Spot_SpotPortfolioOwner, spot, msrs, leaks
         leaks (pd.DataFrame): The preprocessed leaks data.
         ecf (pd.DataFrame): The preprocessed electricity conversion factors.
     """
-    print('start data preprocessing')
-    # rename column from EMPortfolioOwnerID to PortfolioOwnerID
-    Spot_EMPortfolioOwner = Spot_EMPortfolioOwner.rename(columns={"EMPortfolioOwnerID": "PortfolioOwnerID"})
-    # add FOLDERPATH (EMPortfolioOwnerGroup) on PortfolioOwnerID: # spot_fp_po contains the environmental portfolio owner with the associated folderpaths
-    spot_fp_po = pd.merge(Spot_EMPortfolioOwner, Spot_SpotPortfolioOwner, on='PortfolioOwnerID')
-    # rename EMPortfolioOwnerGroup to FOLDERPATH
-    spot_fp_po = spot_fp_po.rename(columns={'EMPortfolioOwnerGroup': 'FOLDERPATH'})
-    # the folderpath for Site-Vashi does not match with the tango_fp. Manually change folderpath
-    spot_fp_po.loc[spot_fp_po['FOLDERPATH']=='Takeda > APAC > IND > Temp.Vash','FOLDERPATH'] = 'Takeda > APAC > IND > 43101'
-    # make sure there are no duplicates for Vashi in case the folderpath is corrected in the raw data in the future
-    spot_fp_po = spot_fp_po.drop_duplicates()
-    spot_fp_po = spot_fp_po[['FOLDERPATH', 'PortfolioOwner']]
-    print('prepare spot')
+    logger.info('start data preprocessing')
+    spot_fp_po = prepare_spot_fp_po(Spot_EMPortfolioOwner, Spot_SpotPortfolioOwner)
+    logger.info('prepare spot')
     spot = prepare_spot(spot, spot_lookup)
-    print('prepare volume')
+    logger.info('prepare volume')
     vol = prepare_volume(vol_past, vol_future)
-    print('prepare leaks')
+    logger.info('prepare leaks')
     leaks = prepare_leaks(leaks, tango_fp, spot_fp_po)
-    print('prepare fleet')
+    logger.info('prepare fleet')
     fleet = prepare_fleet(fleet)
-    print('prepare ecf')
+    logger.info('prepare ecf')
     ecf = prepare_ecf(ecf)
-    print('prepare scf')
+    logger.info('prepare scf')
     scf = prepare_scf(scf)
-    print('end data preprocessing')
+    logger.info('end data preprocessing')
     return spot_fp_po, spot, leaks, fleet, ecf, scf, vol
 
 
@@ -424,7 +437,7 @@ def prepare_enablon(dat_enablon, flag, tango_fp, spot_fp_po):
     Returns:
         df (pd.DataFrame): The preprocessed data for the Enablon (energy usage) data.
     """
-    print('preprocess enablon indicator')
+    logger.info('preprocess enablon indicator')
     ### merge Enablon (energy usage data) and Tango (tango folderpath - tango_fp)
     # add FOLDERPATH based on BUILDING_ID
     tango_fp['BUILDING_ID'] = tango_fp['BUILDING_ID'].str.upper()
@@ -471,7 +484,7 @@ def prepare_natural_gas(dat, flag, spot_fp_po):
     Returns:
     - dat (pd.DataFrame): The preprocessed natural gas data for the Enablon system.
     """
-    print('start prepare natural gas')
+    logger.info('start prepare natural gas')
     dat['Month'] = pd.to_datetime(dat['Month'])
     # conversion from cubic meters to joules
     dat.loc[(dat['Cntry'].isin(['Canada', 'United States', 'Biolife US'])) & (dat['SYSTM_SPCFIC_MSR']=='Energy.2a.vol'), 'y'] = dat.loc[(dat['Cntry'].isin(['Canada', 'United States', 'Biolife US'])) & (dat['SYSTM_SPCFIC_MSR']=='Energy.2a.vol'), 'y'].astype(float) * 38116087.31
@@ -483,7 +496,7 @@ def prepare_natural_gas(dat, flag, spot_fp_po):
     dat = dat[~dat['BUILDING_ID'].isin(flag['BUILDING_ID'])]
     # filter and sort data (data often does not have a portfolio owner associated with folderpath)
     dat = dat.dropna(how='all', axis=1).query("PortfolioOwner.notna()", engine="python").sort_values(['Month', 'BUILDING_ID'])
-    print('end prepare natural gas')
+    logger.info('end prepare natural gas')
     return dat
 
 
@@ -509,7 +522,7 @@ def prepare_steam(dat, flag, spot_fp_po):
     Returns:
     - dat (pd.DataFrame): The preprocessed steam for the Enablon system.
     """
-    print('start prepare steam')
+    logger.info('start prepare steam')
     dat['Month'] = pd.to_datetime(dat['Month'])
     # conversion from original unit to joules
     dat.loc[dat['SYSTM_SPCFIC_MSR']=='Energy.11a.mass','y'] = dat.loc[dat['SYSTM_SPCFIC_MSR']=='Energy.11a.mass','y'].astype(float)*2326006.377
@@ -522,5 +535,5 @@ def prepare_steam(dat, flag, spot_fp_po):
     dat = dat[~dat['BUILDING_ID'].isin(flag['BUILDING_ID'])]
     # filter and sort data (data often does not have a portfolio owner associated with folderpath)
     dat = dat.dropna(how='all', axis=1).query("PortfolioOwner.notna()", engine="python").sort_values(['Month', 'BUILDING_ID'])
-    print('end prepare steam')
+    logger.info('end prepare steam')
     return dat
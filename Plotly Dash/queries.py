@@ -0,0 +1,432 @@
+###############
+### queries ###
+###############
+
+from datetime import datetime
+import hashlib
+import os
+import pandas as pd
+import pickle
+
+
+
+###############################################################################
+### query registry
+# named, parameterized statements shared by all extract functions
+# EDB (Databricks) statements use the pyformat parameter style: %(name)s
+# SPOT (SQL Server) statements are read with pd.read_sql_query and take no parameters
+QUERIES = {
+    'enablon': {
+        'sql': """
+            select distinct
+                MSR,
+                SYSTM_SPCFIC_MSR,
+                BUILDING_ID,
+                CTRY_DESC,
+                FSCL_MNTH_NO,
+                FSCL_QRTR,
+                FSCL_YR,
+                R_MSR_VAL,
+                R_MSR_UNT
+            from GMS_US_MART.TXN_MRT_EHS_TANGO_MSR_ROLLUPS_GLBL
+            where
+            R_MSR_UNT = 'J'
+            and MSR = %(msr)s
+            and RPRTNG_LVL = 'GEO'
+            and EHS_FUNC_DESC is null
+            and EHS_BU_DESC is null
+            and FSCL_MNTH_NO is not null
+            and FSCL_QRTR is not null
+            and FSCL_YR is not null -- overall sum
+            and BUILDING_ID is not null;""",
+        'columns': [
+            'MSR',
+            'SYSTM_SPCFIC_MSR',
+            'BUILDING_ID',
+            'Cntry',
+            'FSCL_MNTH_NO',
+            'FSCL_QRTR',
+            'FSCL_YR',
+            'R_MSR_VAL',
+            'R_MSR_UNT']
+    },
+    'natural_gas': {
+        'sql': """
+            select
+                FldrPth,
+                Building_ID,
+                Cntry,
+                Rprtg_Prd_Key_2,
+                Rfrnc_Key,
+                Cd_Key_2,
+                Unvrsl_Val,
+                Unvrsl_Unt
+            from gms_us_mart.txn_cnspn_mtrcs_glbl
+            where Cd_Key_2 like '%%Energy.2a%%'
+            ;""",
+        'columns': [
+            'FOLDERPATH',
+            'BUILDING_ID',
+            'Cntry',
+            'Month',
+            'MSR',
+            'SYSTM_SPCFIC_MSR',
+            'y',
+            'R_MSR_UNT']
+    },
+    'steam': {
+        'sql': """
+            select
+                FldrPth,
+                Building_ID,
+                Cntry,
+                Rprtg_Prd_Key_2,
+                Rfrnc_Key,
+                Cd_Key_2,
+                Unvrsl_Val,
+                Unvrsl_Unt
+            from gms_us_mart.txn_cnspn_mtrcs_glbl
+            where Cd_Key_2 like '%%Energy.11a.mass%%'
+                or Cd_Key_2 like '%%Energy.11a.nrg%%'
+            ;""",
+        'columns': [
+            'FOLDERPATH',
+            'BUILDING_ID',
+            'Cntry',
+            'Month',
+            'MSR',
+            'SYSTM_SPCFIC_MSR',
+            'y',
+            'R_MSR_UNT']
+    },
+    'tango': {
+        'sql': """
+            select
+                distinct
+                Building_ID,
+                FldrPth
+            from
+                GMS_US_MART.TXN_CNSPN_MTRCS_GLBL;""",
+        'columns': ['BUILDING_ID', 'FOLDERPATH']
+    },
+    'flag': {
+        'sql': """
+            select
+                BUILDING_ID,
+                BUILDING_NM,
+                BUILDING_STAT_DESC,
+                EHS_DATA_SHOW_FLG
+            from GMS_US_MART.REF_MRT_EHS_TANGO_FOOTPRINT
+            where EHS_DATA_SHOW_FLG = %(show_flag)s
+            """,
+        'columns': [
+            'BUILDING_ID',
+            'BUILDING_NM',
+            'BUILDING_STAT_DESC',
+            'EHS_DATA_SHOW_FLG']
+    },
+    'leaks': {
+        'sql': """
+            select distinct
+                MSR,
+                SYSTM_SPCFIC_MSR,
+                BUILDING_ID,
+                FSCL_MNTH_NO,
+                FSCL_QRTR,
+                FSCL_YR,
+                R_MSR_VAL,
+                R_MSR_UNT
+            from GMS_US_MART.TXN_MRT_EHS_TANGO_MSR_ROLLUPS_GLBL
+            where R_MSR_UNT = %(unit)s
+            and MSR = %(msr)s
+            and RPRTNG_LVL = 'GEO'
+            and EHS_FUNC_DESC is null
+            and EHS_BU_DESC is null
+            and FSCL_MNTH_NO is not null
+            and FSCL_QRTR is not null
+            and FSCL_YR is not null
+            and BUILDING_ID is not null
+            """,
+        'columns': [
+            'MSR',
+            'SYSTM_SPCFIC_MSR',
+            'BUILDING_ID',
+            'FSCL_MNTH_NO',
+            'FSCL_QRTR',
+            'FSCL_YR',
+            'R_MSR_VAL',
+            'R_MSR_UNT']
+    },
+    'fleet': {
+        'sql': """
+            select
+                FldrPth,
+                Building_ID,
+                Rprtg_Prd_Key_2,
+                Rfrnc_Key,
+                Cd_Key_2,
+                Unvrsl_Val,
+                Unvrsl_Unt
+            from gms_us_mart.txn_cnspn_mtrcs_glbl
+            where Cd_Key_2 like '%%FLEET.Scp1.Cot.GHG.M%%'
+            and Cnspn_Typ == %(cnspn_typ)s
+            ;""",
+        'columns': [
+            'FOLDERPATH',
+            'BUILDING_ID',
+            'DATE',
+            'MSR',
+            'SYSTM_SPCFIC_MSR',
+            'R_MSR_VAL',
+            'R_MSR_UNT']
+    },
+    'measures': {
+        'sql': """
+            select distinct
+                MSR,
+                SYSTM_SPCFIC_MSR
+            from  GMS_US_MART.TXN_MRT_EHS_TANGO_MSR_ROLLUPS_GLBL
+            """,
+        'columns': ['MSR', 'EMSourceID']
+    },
+    'ecf': {
+        'sql': """
+            select
+                FldrPth,
+                Rprtg_Prd_Key_2,
+                Rfrnc_Key,
+                Cd_Key_2,
+                Unit,
+                Nmbr_Val
+            from gms_us_mart.txn_cnspn_mtrcs_glbl
+            where Cd_Key_2 == %(cd_key)s
+            """,
+        'columns': [
+            'FOLDERPATH',
+            'Month',
+            'Rfrnc_Key',
+            'Cd_Key_2',
+            'Unit',
+            'Nmbr_Val']
+    },
+    'scf': {
+        'sql': """
+            select
+                FldrPth,
+                Rprtg_Prd_Key_2,
+                Rfrnc_Key,
+                Cd_Key_2,
+                Unit,
+                Nmbr_Val
+            from gms_us_mart.txn_cnspn_mtrcs_glbl
+            where Cd_Key_2 == %(cd_key_nrg)s or
+            Cd_Key_2 == %(cd_key_mass)s
+            """,
+        'columns': [
+            'FOLDERPATH',
+            'Month',
+            'Rfrnc_Key',
+            'Cd_Key_2',
+            'Unit',
+            'Nmbr_Val']
+    },
+    'spot': {
+        'sql': """
+            SELECT [SPOT ID]
+              ,a.[Project Name]
+              ,a.[Project Manager]
+              ,a.[CAPS Project]
+              ,a.[Environmental Portfolio]
+              ,a.[Impact Realization Date]
+              ,a.[Project Phase]
+              ,a.[Project State]
+              ,a.[Emissions Impact (tons CO2)]
+              ,b.[ProblemID]
+              ,b.[ProblemUniqueID]
+              ,b.[EnergyImpact]
+              ,c.[ProjectID]
+              ,c.[EMSourceID]
+              ,c.[EMImpactTonsCO2Year]
+              ,c.[EMUnit]
+              ,d.[EM Source Name]
+              ,d.[TonsCO2]
+              ,d.[Net Energy GJ]
+            FROM [dbo].[Z_CAPS_Consolidated_Project_Listing_Carbon] as a INNER JOIN
+                [dbo].[ProblemCapture] as b on b.ProblemID = a.[SPOT ID] INNER JOIN
+                [dbo].[EMData] AS c ON c.ProjectID = b.ProblemUniqueID FULL JOIN
+                [dbo].[FWM_CAPS-Emission Data (Projected Emission Abatement)] as d on d.[Project ID] = a.[SPOT ID] and d.[EM Source ID] = c.EMSourceID
+            WHERE a.[Project Phase] IN ('Active', 'Completed')
+                AND a.[Project State] IN ('Close', 'Track', 'Execute')
+                AND b.EnergyImpact <> 0
+                AND b.EnergyImpact IS NOT NULL
+                AND c.EMImpactTonsCO2Year IS NOT NULL
+                and d.TonsCO2 IS NOT NULL
+            """,
+        'columns': None
+    },
+    'spot_empo': {
+        'sql': """
+            SELECT
+                [EMPortfolioOwnerUniqueID],
+                [EMPortfolioOwnerGroup],
+                [EMPortfolioOwnerID],
+                [LocationReferenceID],
+                [LocationReferenceName],
+                [Comments]
+            FROM [dbo].[EMPortfolioOwner]
+            """,
+        'columns': None
+    },
+    'spot_sppo': {
+        'sql': """
+            SELECT
+                [PortfolioOwnerID],
+                [PortfolioID],
+                [PortfolioOwner],
+                [PortfolioGroup],
+                [OpU],
+                [Country],
+                [Region],
+                [PFID]
+            FROM [dbo].[SPOTPortfolioOwner]
+            """,
+        'columns': None
+    },
+    'vppa': {
+        'sql': """
+            SELECT
+                a.ProblemID,
+                a.ProblemUniqueID,
+                a.ProjectDescription,
+                a.IsCapsProject,
+                a.EmissionPortfolioID,
+                a.EmissionsImpactRealizationDate,
+                a.CalculatedEmissionsImpact,
+                a.EnergyImpact,
+                a.EnergyCostImpactPerYear,
+                a.NoCarbonImpact,
+                b.PortfolioOwner,
+                b.IsEmissionPortfolio
+            FROM
+                dbo.ProblemCapture AS a INNER JOIN
+                dbo.SPOTPortfolioOwner AS b ON a.EmissionPortfolioID = b.PortfolioOwnerID
+            WHERE (a.ProjectDescription = 'VPPA')
+            """,
+        'columns': None
+    }
+}
+
+
+
+###############################################################################
+### query result cache
+# results are cached per statement, parameters and snapshot date (one snapshot per day by default)
+# the in-memory cache serves repeated pulls within a run; set QUERY_CACHE_DIR to keep results
+# on disk across runs of a dev session; set QUERY_CACHE=0 to disable caching altogether
+_query_cache = dict()
+
+
+def get_snapshot_date():
+    """
+    Returns the snapshot date used in the cache key. Defaults to today, can be pinned
+    with the SNAPSHOT_DATE environment variable (format YYYY-MM-DD).
+    """
+    return os.environ.get('SNAPSHOT_DATE', datetime.now().strftime('%Y-%m-%d'))
+
+
+def get_cache_key(name, params=None):
+    """
+    Creates the cache key of a query result from the statement, the parameters and the snapshot date.
+
+    Args:
+        name (str): The name of the statement in QUERIES.
+        params (dict): The query parameters.
+
+    Returns:
+        str: The cache key.
+    """
+    params = params or dict()
+    key = QUERIES[name]['sql'] + repr(sorted(params.items())) + get_snapshot_date()
+    return name + '_' + hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def cached_query(name, params, fetch):
+    """
+    Returns the result of a registered query from the cache or runs fetch() on a cache miss.
+    A copy is returned because the preprocess functions modify their input data in place.
+
+    Args:
+        name (str): The name of the statement in QUERIES.
+        params (dict): The query parameters.
+        fetch (callable): Function without arguments that runs the query and returns a DataFrame.
+
+    Returns:
+        pandas.DataFrame: The query result.
+    """
+    if os.environ.get('QUERY_CACHE', '1') == '0':
+        return fetch()
+    key = get_cache_key(name, params)
+    cache_dir = os.environ.get('QUERY_CACHE_DIR')
+    if key not in _query_cache and cache_dir is not None:
+        path = os.path.join(cache_dir, key + '.pkl')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                _query_cache[key] = pickle.load(f)
+    if key not in _query_cache:
+        dat = fetch()
+        _query_cache[key] = dat
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(os.path.join(cache_dir, key + '.pkl'), 'wb') as f:
+                pickle.dump(dat, f)
+    return _query_cache[key].copy()
+
+
+def clear_query_cache():
+    """
+    Empties the in-memory query cache (the on-disk cache is left untouched).
+    """
+    _query_cache.clear()
+
+
+
+###############################################################################
+### run registered queries
+def run_query(cursor, name, params=None):
+    """
+    Runs a registered, parameterized statement on an EDB cursor and returns the result
+    with the column names defined in the registry.
+
+    Args:
+        cursor: The database cursor object.
+        name (str): The name of the statement in QUERIES.
+        params (dict): The query parameters.
+
+    Returns:
+        pandas.DataFrame: The query result.
+    """
+    def fetch():
+        dat = pd.DataFrame(cursor.execute(QUERIES[name]['sql'], params).fetchall())
+        dat.columns = QUERIES[name]['columns']
+        return dat
+    return cached_query(name, params, fetch)
+
+
+def read_query(connect, name):
+    """
+    Reads a registered statement from the SPOT database. The connection is only
+    opened on a cache miss.
+
+    Args:
+        connect (callable): Function without arguments that returns a database connection.
+        name (str): The name of the statement in QUERIES.
+
+    Returns:
+        pandas.DataFrame: The query result.
+    """
+    def fetch():
+        cnxn = connect()
+        dat = pd.read_sql_query(QUERIES[name]['sql'], cnxn)
+        cnxn.close()
+        return dat
+    return cached_query(name, None, fetch)
@@ -0,0 +1,291 @@
+################
+### registry ###
+################
+
+from datetime import datetime
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+
+from baseline import(
+    BaselineModel
+)
+from codec import(
+    dumps,
+    loads
+)
+from log import(
+    get_logger
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### model registry
+# the full models of every pipeline run on disk, one file per building:
+#   <MODEL_REGISTRY_DIR>/<run id>/<measure>/<building>.json    Prophet (model_to_json) or baseline model
+#   <MODEL_REGISTRY_DIR>/<run id>/<measure>/<name>.pkl         other objects of the run (forecasts, ...)
+#   <MODEL_REGISTRY_DIR>/manifest.json                         index of the runs, measures, buildings and files
+# a single model is loaded from its own file, so a rollback or an incremental refresh reads only the
+# buildings it needs; the manifest is rewritten atomically
+# MODEL_REGISTRY_DIR: the registry root; the pipeline registers its models only if it is set (default ./model_registry)
+# MODEL_REGISTRY_KEEP: number of runs kept, older runs are evicted after every save (default 5, 0 keeps all)
+# MODEL_RUN_ID: the run id (default: a new id per pipeline run, see new_run_id); run_prediction and
+#   run_prediction_dag create the id of their run and pass it to every save
+MANIFEST = 'manifest.json'
+
+_manifest_lock = threading.Lock()
+
+
+def get_registry_dir():
+    return os.environ.get('MODEL_REGISTRY_DIR', './model_registry')
+
+
+def is_registry_enabled():
+    return bool(os.environ.get('MODEL_REGISTRY_DIR'))
+
+
+def get_registry_keep():
+    return int(os.environ.get('MODEL_REGISTRY_KEEP', 5))
+
+
+def new_run_id():
+    """
+    Creates the id of a pipeline run: MODEL_RUN_ID if set, else the start time and a random suffix
+    (several runs of one process get different ids).
+    """
+    if os.environ.get('MODEL_RUN_ID'):
+        return os.environ['MODEL_RUN_ID']
+    return datetime.now().strftime('%Y%m%dT%H%M%S%f') + '-' + uuid.uuid4().hex[:8]
+
+
+def get_file_name(name):
+    # building ids and measures as file names
+    return re.sub(r'[^A-Za-z0-9._-]', '_', str(name))
+
+
+
+###############################################################################
+### manifest
+def read_manifest(registry_dir=None):
+    """
+    Reads the manifest of the registry: {'runs': {run id: {'created': str, 'measures': {measure:
+    {'models': {building: {'file': str, 'kind': str}}, 'objects': {name: file}}}}}}.
+    """
+    path = os.path.join(registry_dir or get_registry_dir(), MANIFEST)
+    if not os.path.exists(path):
+        return {'runs': dict()}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, registry_dir=None):
+    path = os.path.join(registry_dir or get_registry_dir(), MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def update_manifest(run_id, measure, models=None, objects=None, registry_dir=None):
+    """
+    Adds the files of one measure of a run to the manifest.
+    """
+    registry_dir = registry_dir or get_registry_dir()
+    with _manifest_lock:
+        manifest = read_manifest(registry_dir)
+        run = manifest['runs'].setdefault(run_id, {'created': datetime.now().isoformat(timespec='microseconds'), 'measures': dict()})
+        entry = run['measures'].setdefault(measure, {'models': dict(), 'objects': dict()})
+        entry['models'].update(models or dict())
+        entry['objects'].update(objects or dict())
+        write_manifest(manifest, registry_dir)
+
+
+def list_runs(measure=None, registry_dir=None):
+    """
+    Lists the run ids of the registry, newest first; only the runs with the measure if given.
+    """
+    runs = read_manifest(registry_dir)['runs']
+    run_ids = [run_id for run_id, run in runs.items() if measure is None or measure in run['measures']]
+    return sorted(run_ids, key=lambda run_id: (runs[run_id]['created'], run_id), reverse=True)
+
+
+def get_measure_entry(measure, run_id=None, registry_dir=None):
+    """
+    Returns the run id and the manifest entry of a measure (default: the newest run with the measure).
+    """
+    runs = read_manifest(registry_dir)['runs']
+    if run_id is None:
+        run_ids = sorted([r for r in runs if measure in runs[r]['measures']], key=lambda r: (runs[r]['created'], r), reverse=True)
+        if not run_ids:
+            raise KeyError('no registered models for ' + measure)
+        run_id = run_ids[0]
+    if run_id not in runs or measure not in runs[run_id]['measures']:
+        raise KeyError('no registered models for ' + measure + ' in run ' + run_id)
+    return run_id, runs[run_id]['measures'][measure]
+
+
+
+###############################################################################
+### serialization
+def serialize_model(model):
+    """
+    Serializes a model: Prophet as JSON (prophet.serialize), baseline models as JSON, other objects
+    as encoded pickle.
+
+    Returns:
+        kind (str): 'prophet', 'baseline' or 'pickle'.
+        data (bytes): The serialized model.
+    """
+    if isinstance(model, BaselineModel):
+        return 'baseline', json.dumps({'method': model.method, 'params': model.params}, default=float).encode('utf-8')
+    try:
+        from prophet import Prophet
+        from prophet.serialize import model_to_json
+        if isinstance(model, Prophet):
+            return 'prophet', model_to_json(model).encode('utf-8')
+    except ImportError:
+        pass
+    return 'pickle', dumps(model)
+
+
+def deserialize_model(kind, data):
+    if kind == 'baseline':
+        model = json.loads(data)
+        return BaselineModel(model['method'], model['params'])
+    if kind == 'prophet':
+        from prophet.serialize import model_from_json
+        return model_from_json(data.decode('utf-8'))
+    return loads(data)
+
+
+
+###############################################################################
+### save and load
+def save_models(measure, prophet_models, run_id=None, registry_dir=None):
+    """
+    Writes the models of one measure to the registry (one file per building) and evicts old runs.
+
+    Args:
+        measure (str): The measure/indicator.
+        prophet_models (dict): The model per building (buildings without model are skipped).
+        run_id (str): The run (default: a new run, new_run_id()).
+        registry_dir (str): The registry root (default: MODEL_REGISTRY_DIR).
+
+    Returns:
+        str: The run id.
+    """
+    registry_dir = registry_dir or get_registry_dir()
+    run_id = run_id or new_run_id()
+    measure_dir = os.path.join(run_id, get_file_name(measure))
+    os.makedirs(os.path.join(registry_dir, measure_dir), exist_ok=True)
+    models = dict()
+    for i, model in prophet_models.items():
+        if model is None:
+            continue
+        kind, data = serialize_model(model)
+        file_name = os.path.join(measure_dir, get_file_name(i) + ('.pkl' if kind == 'pickle' else '.json'))
+        with open(os.path.join(registry_dir, file_name), 'wb') as f:
+            f.write(data)
+        models[i] = {'file': file_name, 'kind': kind}
+    update_manifest(run_id, measure, models=models, registry_dir=registry_dir)
+    logger.info('registry %s %s: %s models', run_id, measure, len(models))
+    evict_runs(registry_dir=registry_dir)
+    return run_id
+
+
+def save_run_objects(measure, objects, run_id=None, registry_dir=None):
+    """
+    Writes further objects of one measure (e.g. forecasts, cross-validation results) to the registry.
+
+    Args:
+        measure (str): The measure/indicator.
+        objects (dict): The objects per name.
+        run_id (str): The run (default: a new run, new_run_id()).
+        registry_dir (str): The registry root (default: MODEL_REGISTRY_DIR).
+    """
+    registry_dir = registry_dir or get_registry_dir()
+    run_id = run_id or new_run_id()
+    measure_dir = os.path.join(run_id, get_file_name(measure))
+    os.makedirs(os.path.join(registry_dir, measure_dir), exist_ok=True)
+    files = dict()
+    for name, obj in objects.items():
+        files[name] = os.path.join(measure_dir, get_file_name(name) + '.pkl')
+        with open(os.path.join(registry_dir, files[name]), 'wb') as f:
+            f.write(dumps(obj))
+    update_manifest(run_id, measure, objects=files, registry_dir=registry_dir)
+    return run_id
+
+
+def read_model(model, registry_dir):
+    # model: the manifest entry of a building
+    if model is None:
+        return None
+    with open(os.path.join(registry_dir, model['file']), 'rb') as f:
+        return deserialize_model(model['kind'], f.read())
+
+
+def load_model(measure, building, run_id=None, registry_dir=None):
+    """
+    Loads the model of one building (default: from the newest run with the measure); None if the
+    building has no registered model.
+    """
+    registry_dir = registry_dir or get_registry_dir()
+    run_id, entry = get_measure_entry(measure, run_id, registry_dir)
+    return read_model(entry['models'].get(building), registry_dir)
+
+
+def load_models(measure, buildings=None, run_id=None, registry_dir=None):
+    """
+    Loads the models of one measure, only those of the given buildings if any.
+
+    Returns:
+        dict: The model per building.
+    """
+    registry_dir = registry_dir or get_registry_dir()
+    run_id, entry = get_measure_entry(measure, run_id, registry_dir)
+    buildings = entry['models'].keys() if buildings is None else buildings
+    return {i: read_model(entry['models'].get(i), registry_dir) for i in buildings}
+
+
+def load_run_object(measure, name, run_id=None, registry_dir=None):
+    """
+    Loads one object written with save_run_objects; None if the run has no such object.
+    """
+    registry_dir = registry_dir or get_registry_dir()
+    run_id, entry = get_measure_entry(measure, run_id, registry_dir)
+    if name not in entry['objects']:
+        return None
+    with open(os.path.join(registry_dir, entry['objects'][name]), 'rb') as f:
+        return loads(f.read())
+
+
+
+###############################################################################
+### retention
+def evict_runs(keep=None, registry_dir=None):
+    """
+    Deletes the oldest runs beyond the number of runs to keep (MODEL_REGISTRY_KEEP, 0 keeps all).
+
+    Returns:
+        list: The evicted run ids.
+    """
+    registry_dir = registry_dir or get_registry_dir()
+    keep = get_registry_keep() if keep is None else keep
+    if keep <= 0:
+        return []
+    with _manifest_lock:
+        manifest = read_manifest(registry_dir)
+        runs = manifest['runs']
+        evicted = sorted(runs, key=lambda run_id: (runs[run_id]['created'], run_id), reverse=True)[keep:]
+        for run_id in evicted:
+            del runs[run_id]
+        write_manifest(manifest, registry_dir)
+    for run_id in evicted:
+        shutil.rmtree(os.path.join(registry_dir, run_id), ignore_errors=True)
+        logger.info('registry evict %s', run_id)
+    return evicted
@@ -0,0 +1,120 @@
+##################
+### regressors ###
+##################
+
+import os
+import pandas as pd
+
+from log import(
+    get_logger,
+    shape
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### registry
+# exogenous series attached to the Prophet models of the buildings they are available for
+# name: the regressor name in the Prophet model (column of the regressor table)
+# mode: 'additive' or 'multiplicative' (Prophet.add_regressor)
+# vol: production volume from prepare_volume; further regressors can be registered or placed as
+# <name>.csv (columns BUILDING_ID, Month, value) in DATA_DIR/regressors
+REGRESSORS = {
+    'vol': {'mode': 'additive'}
+}
+# a regressor is used for a building only if it covers the whole forecast horizon and at least this
+# share of the history months (history months without a value are dropped from the fit)
+MIN_HISTORY_COVERAGE = 0.9
+
+
+def register_regressor(name, mode='additive'):
+    """
+    Registers an exogenous regressor (see REGRESSORS).
+    """
+    REGRESSORS[name] = {'mode': mode}
+
+
+
+###############################################################################
+### regressor table
+def get_regressor_sources(vol=None, data_dir=None):
+    """
+    Collects the regressor series: the production volume and the files in DATA_DIR/regressors.
+
+    Args:
+        vol (pd.DataFrame): prepare_volume output (BUILDING_ID, Month, Volume).
+        data_dir (str): The data directory (default: DATA_DIR or ./data).
+
+    Returns:
+        dict: One DataFrame (BUILDING_ID, Month, value) per regressor name.
+    """
+    sources = dict()
+    if vol is not None:
+        sources['vol'] = vol[['BUILDING_ID', 'Month', 'Volume']].rename(columns={'Volume': 'value'})
+    regressor_dir = os.path.join(data_dir or os.environ.get('DATA_DIR', './data'), 'regressors')
+    if os.path.isdir(regressor_dir):
+        for file_name in sorted(os.listdir(regressor_dir)):
+            if not file_name.endswith('.csv'):
+                continue
+            name = file_name[:-4]
+            sources[name] = pd.read_csv(os.path.join(regressor_dir, file_name))[['BUILDING_ID', 'Month', 'value']]
+            if name not in REGRESSORS:
+                register_regressor(name)
+    return sources
+
+
+def get_regressor_table(sources):
+    """
+    Joins the regressor series into one table indexed by (BUILDING_ID, Month), one column per
+    registered regressor. A prepared table is returned unchanged, a prepare_volume output is
+    converted into a table with the volume regressor.
+
+    Args:
+        sources (dict or pd.DataFrame): get_regressor_sources output, a regressor table or prepare_volume output.
+
+    Returns:
+        pd.DataFrame: The regressor table (sorted index).
+    """
+    if isinstance(sources, pd.DataFrame):
+        if list(sources.index.names) == ['BUILDING_ID', 'Month']:
+            return sources
+        sources = {'vol': sources[['BUILDING_ID', 'Month', 'Volume']].rename(columns={'Volume': 'value'})}
+    columns = []
+    for name, dat in (sources or dict()).items():
+        if name not in REGRESSORS:
+            logger.warning('regressor %s is not registered', name)
+            continue
+        dat = dat.dropna().assign(Month = lambda x: pd.to_datetime(x['Month']), value = lambda x: x['value'].astype(float))
+        columns.append(dat.groupby(['BUILDING_ID', 'Month'])['value'].mean().rename(name))
+    if not columns:
+        return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=['BUILDING_ID', 'Month']))
+    table = pd.concat(columns, axis=1).sort_index()
+    logger.debug('regressor table %s', shape(table))
+    return table
+
+
+def get_building_regressors(table, buildings_with_regressors, building, months, periods=36):
+    """
+    Selects the regressors of one building that cover its forecast horizon and its history
+    (checked before the fit, so a fit never fails on missing future values).
+
+    Args:
+        table (pd.DataFrame): The regressor table (get_regressor_table()).
+        buildings_with_regressors (set): The buildings in the table.
+        building (str): The building id.
+        months (pd.DatetimeIndex): The history months of the building.
+        periods (int): The forecast horizon in months.
+
+    Returns:
+        names (list): The regressors to add.
+        values (pd.DataFrame): The regressor values of the building over history and horizon (Month index).
+    """
+    if building not in buildings_with_regressors or len(months) == 0:
+        return [], None
+    future = pd.date_range(months.max(), periods=periods + 1, freq='MS')[1:]
+    values = table.loc[building].reindex(months.union(future))
+    names = [name for name in values.columns
+             if values[name].reindex(future).notna().all() and values[name].reindex(months).notna().mean() >= MIN_HISTORY_COVERAGE]
+    return names, values[names]
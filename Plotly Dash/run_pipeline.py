@@ -1,26 +1,43 @@
 # import packages
+from concurrent.futures import Future, ThreadPoolExecutor
+import json
 import numpy as np
 import os
 import pandas as pd
-import pickle
-import redis
+import threading
 
 
 # import functions
 from load import(
+    EDB_EXTRACTS,
+    SPOT_EXTRACTS,
+    extract_edb,
+    fix_vppa,
     get_edb,
     load_enablon,
     get_local_files,
     get_spot
 )
 
+from queries import(
+    get_snapshot_date
+)
+
 from preprocess import(
     preprocess,
+    prepare_ecf,
+    prepare_fleet,
+    prepare_leaks,
+    prepare_scf,
+    prepare_spot,
+    prepare_spot_fp_po,
     prepare_volume
 )
 
 from model import(
     get_prophet,
+    get_warm_start,
+    get_warm_start_summary,
     get_cv,
     get_metrics,
     get_prophet_residuals
@@ -42,18 +59,86 @@ from store import(
     store_data
 )
 
+from codec import(
+    dumps,
+    loads
+)
+
+from artifacts import(
+    get_model_artifacts,
+    write_cold_models
+)
+
+from registry import(
+    new_run_id
+)
+
+from backends import(
+    get_many,
+    get_store,
+    publish_many
+)
+
+from definition_bu import business_unit
+
+from regressors import(
+    get_regressor_sources,
+    get_regressor_table
+)
+
+from tuning import(
+    tune_prophet
+)
+
+from uncertainty import(
+    get_n_draws,
+    get_predictive_samples
+)
+
+from hierarchy import(
+    get_portfolio_dataframe,
+    reconcile_hierarchy
+)
+
+from scenario import(
+    SPOT_COLUMNS
+)
+
+from dag import(
+    Stage,
+    run_dag
+)
+
+from instrument import(
+    RunReport,
+    count_rows
+)
+
 from helper_functions import(
     date_conversion,
     get_fiscal_month,
     get_quarter
 )
 
+from log import(
+    get_logger,
+    shape
+)
+
+logger = get_logger(__name__)
+
 
 ###############################################################################
 ### extract transform load
-def run_etl():
+def run_etl(concurrent=False, max_edb_queries=4, max_spot_queries=2):
     """
     Runs the Extract Transform Load (ETL) process.
+    With concurrent=True the extractions run in thread pools (see run_etl_concurrent).
+    
+    Args:
+        concurrent (bool): Run the extract and preprocess steps concurrently.
+        max_edb_queries (int): Maximum number of parallel EDB (Databricks) queries in concurrent mode.
+        max_spot_queries (int): Maximum number of parallel SPOT (SQL Server) queries in concurrent mode.
     
     Returns:
         tuple: A tuple containing the transformed data.
@@ -67,6 +152,8 @@ def run_etl():
             - cf (data frame): The transformed data related to conversion factors.
             - ecf (data frame): The transformed data related to electricity conversion factors.
     """
+    if concurrent:
+        return run_etl_concurrent(max_edb_queries, max_spot_queries)
     # run extract functions (saved in extract.py and load.py)
     Spot_EMPortfolioOwner, Spot_SpotPortfolioOwner, spot, vppa = get_spot()
     leaks, fleet, tango_fp, flag, msrs, ecf, scf = get_edb()
@@ -77,81 +164,544 @@ def run_etl():
 
 
 
+def submit_when_done(pool, function, inputs):
+    """
+    Submits a function to a thread pool once all its input futures are done: no worker of the pool
+    blocks on another task, so chained steps cannot deadlock whatever the pool size.
+    
+    Args:
+        pool (ThreadPoolExecutor): The pool running the function.
+        function (callable): Called with the results of the inputs in order.
+        inputs (list): The input futures.
+    
+    Returns:
+        Future: The result of the function; the exception of a failed input or of the function.
+    """
+    future = Future()
+    remaining = [len(inputs)]
+    lock = threading.Lock()
+    def run():
+        try:
+            future.set_result(function(*[i.result() for i in inputs]))
+        except BaseException as e:
+            future.set_exception(e)
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        try:
+            pool.submit(run)
+        except RuntimeError as e:
+            # the pool was shut down after a failure
+            future.set_exception(e)
+    if not inputs:
+        pool.submit(run)
+    for i in inputs:
+        i.add_done_callback(on_done)
+    return future
+
+
+
+def run_etl_concurrent(max_edb_queries=4, max_spot_queries=2):
+    """
+    Runs the Extract Transform Load (ETL) process concurrently. SPOT (SQL Server) and EDB (Databricks)
+    are independent and bound by network latency: each extract function runs in a thread pool with a
+    per-source limit on parallel queries, every EDB extraction on its own cursor. Each preprocess step
+    is started as soon as its inputs have arrived, so the ETL wall time approaches the slowest query.
+    
+    Args:
+        max_edb_queries (int): Maximum number of parallel EDB (Databricks) queries.
+        max_spot_queries (int): Maximum number of parallel SPOT (SQL Server) queries.
+    
+    Returns:
+        tuple: Same as run_etl().
+    """
+    edb_pool = ThreadPoolExecutor(max_workers=max_edb_queries)
+    spot_pool = ThreadPoolExecutor(max_workers=max_spot_queries)
+    local_pool = ThreadPoolExecutor(max_workers=1)
+    # preprocess steps are submitted once their inputs have arrived (submit_when_done), no worker waits for another step
+    preprocess_pool = ThreadPoolExecutor(max_workers=4)
+    try:
+        # run extract functions
+        futures = dict()
+        for name, extract_function in EDB_EXTRACTS.items():
+            futures[name] = edb_pool.submit(extract_edb, extract_function)
+        for name, extract_function in SPOT_EXTRACTS.items():
+            futures[name] = spot_pool.submit(extract_function)
+        futures['local_files'] = local_pool.submit(get_local_files)
+        # run transform functions as soon as their inputs are available
+        def submit_preprocess(function, *inputs):
+            return submit_when_done(preprocess_pool, function, [futures[i] for i in inputs])
+        for j, name in enumerate(['cf', 'spot_lookup', 'vol_past', 'vol_future']):
+            futures[name] = submit_when_done(local_pool, lambda local_files, j=j: local_files[j], [futures['local_files']])
+        futures['spot_fp_po'] = submit_preprocess(prepare_spot_fp_po, 'Spot_EMPortfolioOwner', 'Spot_SpotPortfolioOwner')
+        futures['spot_prepared'] = submit_preprocess(prepare_spot, 'spot', 'spot_lookup')
+        futures['vppa_prepared'] = submit_preprocess(fix_vppa, 'vppa')
+        futures['vol'] = submit_preprocess(prepare_volume, 'vol_past', 'vol_future')
+        futures['leaks_prepared'] = submit_preprocess(prepare_leaks, 'leaks', 'tango_fp', 'spot_fp_po')
+        futures['fleet_prepared'] = submit_preprocess(prepare_fleet, 'fleet')
+        futures['ecf_prepared'] = submit_preprocess(prepare_ecf, 'ecf')
+        futures['scf_prepared'] = submit_preprocess(prepare_scf, 'scf')
+        results = {name: future.result() for name, future in futures.items()}
+    finally:
+        for pool in [edb_pool, spot_pool, local_pool, preprocess_pool]:
+            pool.shutdown(wait=False, cancel_futures=True)
+    logger.info('end concurrent etl')
+    return results['spot_fp_po'], results['spot_prepared'], results['leaks_prepared'], results['fleet_prepared'], \
+        results['tango_fp'], results['flag'], results['vppa_prepared'], results['msrs'], results['cf'], \
+        results['ecf_prepared'], results['scf_prepared'], results['vol']
+
+
+
 ###############################################################################
 ### run prediction
-def run_prediction(scope, measure, spot_fp_po, spot, tango_fp, flag, vppa, cf, ecf, scf, vol):
+# the VPPA contracts (virtual power purchase agreements) replace the purchased electricity emissions
+# in their contract windows; the team decided to ignore them, INCLUDE_VPPA=1 turns them on
+VPPA_MEASURE = 'Purchased Electricity - Usage'
+VPPA_USAGE_COEFF = 0.8
+
+
+def get_include_vppa():
+    return os.environ.get('INCLUDE_VPPA', '0') != '0'
+
+
+def run_prediction(scope, measure, spot_fp_po, spot, tango_fp, flag, vppa, cf, ecf, scf, vol, reconciliation=None, include_vppa=None, run_id=None):
     """
     Run the prediction per measure
+    With reconciliation (mint, wls, ols or bottom_up; default: RECONCILIATION environment variable)
+    the building forecasts are reconciled over the hierarchy building -> PortfolioOwner -> business unit
+    -> global instead of summed per portfolio owner (see hierarchy.py).
+    The predictive samples of the buildings (UNCERTAINTY_DRAWS per month, 0 disables them) are published
+    for the intervals of the app selections (see uncertainty.py).
+    With include_vppa (default: INCLUDE_VPPA environment variable, off) the VPPA contracts replace the
+    electricity emissions in their contract windows (see add_vppa).
+    The full models are registered under run_id (default: a new run per call, see registry.py); pass
+    the same id to register the measures of one pipeline run together.
     """
-    
-    print('start run prediction')
-    df = load_enablon(measure, tango_fp, spot_fp_po, flag, cf, ecf, scf) # df.loc[(df['PortfolioOwner']=='Global-BioLife US') & (df['BUILDING_ID']=='US-AME-01')]
+    reconciliation = reconciliation or os.environ.get('RECONCILIATION')
+    include_vppa = get_include_vppa() if include_vppa is None else include_vppa
+    run_id = run_id or new_run_id()
+
+    logger.info('start run prediction')
+    report = RunReport(measure)
+    df = report.call('load_enablon', load_enablon, measure, tango_fp, spot_fp_po, flag, cf, ecf, scf) # df.loc[(df['PortfolioOwner']=='Global-BioLife US') & (df['BUILDING_ID']=='US-AME-01')]
     po_bu = df[['BUILDING_ID','PortfolioOwner']].drop_duplicates()
-    print('modeling')
-    prophet_models, prophet_fcst, prophet_reg_coeff = get_prophet(df, vol)
-    print('cross-validation')
-    cv_dict, pm_dict = get_cv(df, prophet_models)
-    print('post-processing')
-    prophet_residuals = get_prophet_residuals(prophet_fcst, df)
-    print('get metrics')
-    mape_scores, rmse_scores, rmse_prophet, mape_prophet = get_metrics(pm_dict, prophet_residuals)
+    logger.info('modeling')
+    fit_times = dict()
+    warm_starts = dict()
+    previous_models, previous_fit_times = load_previous_run(measure)
+    prophet_params = load_prophet_params(measure)
+    # production volume and local regressor files joined into one indexed table
+    regressor_table = report.call('get_regressor_table', get_regressor_table, get_regressor_sources(vol))
+    prophet_models, prophet_fcst, prophet_reg_coeff = report.call('get_prophet', get_prophet, df, regressor_table, fit_times, None, None, previous_models, warm_starts, prophet_params)
+    report.add_building_times('get_prophet', fit_times)
+    report.add_summary('warm_start', get_warm_start_summary(fit_times, warm_starts, previous_fit_times))
+    logger.info('cross-validation')
+    cv_times = dict()
+    cv_dict, pm_dict = report.call('get_cv', get_cv, df, prophet_models, cv_times)
+    report.add_building_times('get_cv', cv_times)
+    logger.info('post-processing')
+    prophet_residuals = report.call('get_prophet_residuals', get_prophet_residuals, prophet_fcst, df)
+    logger.info('get metrics')
+    mape_scores, rmse_scores, rmse_prophet, mape_prophet = report.call('get_metrics', get_metrics, pm_dict, prophet_residuals)
     prd_dic = prophet_fcst.copy()
-    print(prd_dic)
-    print('get prd df')
-    prd_df = get_prd_dataframe(prd_dic)
-    print(prd_df)
-    print('get app df')
-    df_app = get_app_dataframe(df, prd_df)
+    logger.debug('prd_dic %s', shape(prd_dic))
+    logger.info('get prd df')
+    prd_df = report.call('get_prd_dataframe', get_prd_dataframe, prd_dic)
+    logger.debug('prd_df %s', shape(prd_df))
+    logger.info('get app df')
+    df_app = report.call('get_app_dataframe', get_app_dataframe, df, prd_df)
     # add portfolio owner, add Country too (required for conversion of natural gas)
     # add systm_spcf_msr for energy conversion, folderpath for energy and steam
-    df_app = add_columns(df_app, df)
-    df_app = get_energy_conversion(df_app, measure, cf, ecf, scf) # need building
-    df_app = aggregate_on_portfolio_level(df_app)
-    print('add spot')
-    df_global = add_spot(df_app, spot, measure) 
-    print('date conversion')
-    df_global = date_conversion(df_global)
-    print('add vppa')
-    # take out vppa (team decided to ignore VPPA contracts)
-    #if measure == 'Purchased Electricity - Usage':
-    #    usage_coeff = 0.8
-    #    df_global = add_vppa(df_global, vppa, usage_coeff)
-    print('negative to zero')
-    df_global = negative_to_zero(df_global)
-    print('select columns')
-    df_global = select_columns(df_global)
-    
-    # convert the list of dictionaries to a JSON serializable format
-    print('pickle dumps')
-    prophet_models_json = pickle.dumps(prophet_models)
-    prophet_fcst_json = pickle.dumps(prophet_fcst)
-    prophet_residuals_json = pickle.dumps(prophet_residuals)
-    prophet_reg_coeff_json = pickle.dumps(prophet_reg_coeff)
-    cv_dict_json = pickle.dumps(cv_dict)
-    df_global_json = pickle.dumps(df_global)
-    mape_scores_json = pickle.dumps(mape_scores)
-    rmse_scores_json = pickle.dumps(rmse_scores)
-    mape_prophet_json = pickle.dumps(mape_prophet)
-    rmse_prophet_json = pickle.dumps(rmse_prophet)
-    po_bu_json = pickle.dumps(po_bu)
-    
-    # set up redis client
-    print('establish redis')
-    redis_client = redis.Redis(host='localhost', port=6379, db=0)
-    redis_client =   redis.StrictRedis.from_url(os.environ.get("REDIS_URL", "redis://127.0.0.1:6379"))
-    
-    # save model to redis
-    print('redis set')
-    redis_client.set('prophet_models' + measure, prophet_models_json)
-    redis_client.set('prophet_fcst' + measure, prophet_fcst_json)
-    redis_client.set('prophet_residuals' + measure, prophet_residuals_json)
-    redis_client.set('prophet_reg_coeff' + measure, prophet_reg_coeff_json)
-    redis_client.set('cv_dict' + measure, cv_dict_json)
-    redis_client.set('df_global' + measure, df_global_json) 
-    redis_client.set('mape_scores' + measure, mape_scores_json)
-    redis_client.set('rmse_scores' + measure, rmse_scores_json)
-    redis_client.set('rmse_prophet' + measure, rmse_prophet_json)
-    redis_client.set('mape_prophet' + measure, mape_prophet_json)
-    redis_client.set('po_bu' + measure, po_bu_json)
-    print('end run prediction')
-    return
\ No newline at end of file
+    df_app = report.call('add_columns', add_columns, df_app, df)
+    df_app = report.call('get_energy_conversion', get_energy_conversion, df_app, measure, cf, ecf, scf) # need building
+    samples = None
+    if get_n_draws() > 0:
+        logger.info('predictive samples')
+        try:
+            samples = report.call('get_predictive_samples', get_predictive_samples, df_app, prophet_models, prophet_fcst)
+        except:
+            logger.warning('predictive samples failed, app intervals are summed')
+    hierarchy = None
+    if reconciliation:
+        logger.info('reconcile hierarchy')
+        try:
+            hierarchy = report.call('reconcile_hierarchy', reconcile_hierarchy, df_app, prophet_residuals, business_unit, reconciliation)
+        except:
+            logger.warning('reconciliation failed, sum per portfolio owner')
+    if hierarchy is not None:
+        df_app = get_portfolio_dataframe(hierarchy)
+    else:
+        df_app = report.call('aggregate_on_portfolio_level', aggregate_on_portfolio_level, df_app)
+    logger.info('add spot')
+    df_global = report.call('add_spot', add_spot, df_app, spot, measure)
+    logger.info('date conversion')
+    df_global = report.call('date_conversion', date_conversion, df_global)
+    if include_vppa and measure == VPPA_MEASURE:
+        logger.info('add vppa')
+        df_global = report.call('add_vppa', add_vppa, df_global, vppa, VPPA_USAGE_COEFF)
+    logger.info('negative to zero')
+    df_global = report.call('negative_to_zero', negative_to_zero, df_global)
+    logger.info('select columns')
+    df_global = report.call('select_columns', select_columns, df_global)
+    report.call('publish_prediction', publish_prediction, measure, prophet_models, prophet_fcst, prophet_residuals, prophet_reg_coeff, cv_dict, df_global, mape_scores, rmse_scores, rmse_prophet, mape_prophet, po_bu, run_id, rows_in=count_rows(df_global))
+    if hierarchy is not None:
+        publish_hierarchy(measure, hierarchy)
+    if samples is not None:
+        publish_samples(measure, samples)
+    publish_spot(measure, spot)
+    publish_report(measure, report)
+    logger.info('end run prediction')
+    return
+
+
+
+###############################################################################
+### previous run
+def load_previous_run(measure):
+    """
+    Loads the models and the per-building fit times of the previous run of one measure from redis
+    (warm start of the fits and speedup report). Missing or unreadable objects are returned as None.
+    
+    Args:
+        measure (str): The measure/indicator.
+    
+    Returns:
+        previous_models (dict): The models per building ('prophet_models' + measure).
+        previous_fit_times (dict): The fit time per building (run report 'run_report' + measure).
+    """
+    previous_models = None
+    previous_fit_times = None
+    try:
+        blobs = get_many(['prophet_models' + measure, 'run_report' + measure])
+        previous_models_json = blobs['prophet_models' + measure]
+        if previous_models_json is not None:
+            previous_models = loads(previous_models_json)
+        report_json = blobs['run_report' + measure]
+        if report_json is not None:
+            previous_fit_times = json.loads(report_json).get('buildings', dict()).get('get_prophet')
+    except:
+        logger.warning('previous run could not be loaded, fit without warm start')
+    return previous_models, previous_fit_times
+
+
+
+def load_prophet_params(measure):
+    """
+    Loads the tuned Prophet parameters per building of one measure ('prophet_params' + measure, see run_tuning).
+    Returns None if the measure was not tuned.
+    """
+    try:
+        prophet_params_json = get_store().get('prophet_params' + measure)
+        if prophet_params_json is not None:
+            return loads(prophet_params_json)
+    except:
+        logger.warning('tuned parameters could not be loaded, use default parameters')
+    return None
+
+
+
+###############################################################################
+### hyperparameter tuning
+def run_tuning(measures, tango_fp, spot_fp_po, flag, cf, ecf, scf, configs=None, max_workers=None, vol=None):
+    """
+    Tuning mode: searches the Prophet configuration of every building (see tuning.py) and saves the
+    winners to redis ('prophet_params' + measure). The nightly run_prediction fits the saved configuration
+    only, so the search runs separately (e.g. weekly) and does not add to the nightly cost.
+    
+    Args:
+        measures (list): The measures/indicators to tune.
+        tango_fp, spot_fp_po, flag, cf, ecf, scf: The outputs of run_etl().
+        configs (list): The configurations to evaluate (default: tuning.get_configs()).
+        max_workers (int): The number of parallel fits (default: TUNING_WORKERS or 4).
+        vol (pd.DataFrame): The production volumes (run_etl() output); buildings with regressors are tuned with them.
+    
+    Returns:
+        dict: The tuned parameters per measure and building.
+    """
+    # the regressors of run_prediction: production volume and local regressor files
+    regressor_table = get_regressor_table(get_regressor_sources(vol))
+    results = dict()
+    for measure in measures:
+        logger.info('start tuning %s', measure)
+        df = load_enablon(measure, tango_fp.copy(), spot_fp_po, flag, cf, ecf, scf)
+        prophet_params = tune_prophet(df, configs, max_workers=max_workers, vol=regressor_table)
+        # buildings not tuned in this run keep their previous parameters
+        previous = load_prophet_params(measure) or dict()
+        previous.update(prophet_params)
+        get_store().set('prophet_params' + measure, dumps(previous))
+        results[measure] = previous
+        logger.info('end tuning %s: %s buildings', measure, len(prophet_params))
+    return results
+
+
+
+###############################################################################
+### publish prediction
+def publish_prediction(measure, prophet_models, prophet_fcst, prophet_residuals, prophet_reg_coeff, cv_dict, df_global, mape_scores, rmse_scores, rmse_prophet, mape_prophet, po_bu, run_id=None):
+    """
+    Save the results of the prediction of one measure to redis (or the store selected with STORE_BACKEND).
+    The models and forecasts are stored as slim artifacts, the full models go to the model registry if
+    MODEL_REGISTRY_DIR is set (see registry.py), in the run run_id (default: a new run).
+    """
+    try:
+        write_cold_models(measure, prophet_models, run_id)
+    except:
+        logger.warning('full models not written to cold storage')
+    prophet_models, prophet_fcst = get_model_artifacts(prophet_models, prophet_fcst)
+    # pickle and compress the objects (STORE_CODEC, see codec.py)
+    logger.info('encode objects')
+    prophet_models_json = dumps(prophet_models)
+    prophet_fcst_json = dumps(prophet_fcst)
+    prophet_residuals_json = dumps(prophet_residuals)
+    prophet_reg_coeff_json = dumps(prophet_reg_coeff)
+    cv_dict_json = dumps(cv_dict)
+    df_global_json = dumps(df_global)
+    mape_scores_json = dumps(mape_scores)
+    rmse_scores_json = dumps(rmse_scores)
+    mape_prophet_json = dumps(mape_prophet)
+    rmse_prophet_json = dumps(rmse_prophet)
+    po_bu_json = dumps(po_bu)
+    
+    # save model to redis: one transactional pipeline for all objects of the measure and a new published data version
+    logger.info('redis set')
+    publish_many({
+        'prophet_models' + measure: prophet_models_json,
+        'prophet_fcst' + measure: prophet_fcst_json,
+        'prophet_residuals' + measure: prophet_residuals_json,
+        'prophet_reg_coeff' + measure: prophet_reg_coeff_json,
+        'cv_dict' + measure: cv_dict_json,
+        'df_global' + measure: df_global_json,
+        'mape_scores' + measure: mape_scores_json,
+        'rmse_scores' + measure: rmse_scores_json,
+        'rmse_prophet' + measure: rmse_prophet_json,
+        'mape_prophet' + measure: mape_prophet_json,
+        'po_bu' + measure: po_bu_json
+    })
+    return
+
+
+
+def publish_hierarchy(measure, hierarchy):
+    """
+    Save the reconciled forecasts of all hierarchy levels and the business unit covariances
+    of one measure to redis (key 'hierarchy' + measure). The app reads the totals and intervals
+    of a selection from it instead of summing the portfolio owners.
+    
+    Args:
+        measure (str): The measure/indicator.
+        hierarchy (dict): reconcile_hierarchy output.
+    """
+    publish_many({'hierarchy' + measure: dumps(hierarchy)})
+    return
+
+
+
+def publish_samples(measure, samples):
+    """
+    Save the predictive samples of the buildings of one measure to redis (key 'samples' + measure).
+    The app sums the draws of the selected portfolio owners and measures to derive their intervals.
+    
+    Args:
+        measure (str): The measure/indicator.
+        samples (dict): get_predictive_samples output.
+    """
+    publish_many({'samples' + measure: dumps(samples, protocol=4)})
+    return
+
+
+
+def publish_spot(measure, spot):
+    """
+    Save the SPOT projects of one measure to redis (key 'spot' + measure). The scenario engine
+    (scenario.py) recomputes the forecasts with SPOT impacts from them and the published df_global.
+    
+    Args:
+        measure (str): The measure/indicator.
+        spot (pd.DataFrame): prepare_spot output (all measures).
+    """
+    spot = spot.loc[spot['Enablon Source Name']==measure, [col for col in SPOT_COLUMNS if col in spot.columns]]
+    publish_many({'spot' + measure: dumps(spot)})
+    return
+
+
+
+def publish_report(measure, report):
+    """
+    Save the JSON run report of one measure next to its results in redis (key 'run_report' + measure).
+    If the environment variable RUN_REPORT_DIR is set, the report is also written to that directory.
+    
+    Args:
+        measure (str): The measure/indicator.
+        report (RunReport): The run report (see instrument.py).
+    """
+    report_json = report.to_json()
+    redis_client = get_store()
+    redis_client.set('run_report' + measure, report_json)
+    report_dir = os.environ.get('RUN_REPORT_DIR')
+    if report_dir is not None:
+        os.makedirs(report_dir, exist_ok=True)
+        file_name = 'run_report_' + report.started.strftime('%Y%m%d_%H%M%S') + '_' + measure.replace('/', '_') + '.json'
+        with open(os.path.join(report_dir, file_name), 'w') as f:
+            f.write(report_json)
+    return
+
+
+
+###############################################################################
+### run prediction as a DAG of stages
+# the stage cache key covers the inputs and the code of the stage functions (see dag.py); the
+# environment settings read by the stages are passed as stage params (the publish stages are not
+# cached, their params only keep their keys complete)
+MODEL_CONFIG = ['MCMC_SAMPLES', 'MIN_PROPHET_MONTHS', 'WARM_START', 'WARM_START_TOLERANCE', 'WARM_START_MAX_NEW_MONTHS']
+UNCERTAINTY_CONFIG = ['UNCERTAINTY_DRAWS']
+PUBLISH_CONFIG = ['STORE_CODEC', 'STORE_CODEC_LEVEL', 'STORE_CODEC_MIN_BYTES']
+
+
+def get_stage_config(names):
+    # unset settings are None: their defaults are part of the code
+    return {name: os.environ.get(name) for name in names}
+
+
+def get_prediction_stages(measure, reconciliation=None, include_vppa=False, run_id=None):
+    """
+    Declares the stages of run_prediction for one measure with their inputs and outputs.
+    Intermediate outputs are prefixed with the measure, so the stages of several measures
+    can be combined in a single DAG. Stage functions that modify their inputs in place
+    receive copies: cached outputs must stay identical to what the stage produced.
+    Besides the run_etl outputs, the stages read the run inputs measure + '/previous_models'
+    (load_previous_run, warm start of the fits) and measure + '/prophet_params' (load_prophet_params,
+    tuned parameters).
+    
+    Args:
+        measure (str): The measure/indicator.
+        reconciliation (str): The hierarchy reconciliation method; None sums per portfolio owner.
+        include_vppa (bool): Apply the VPPA contracts (electricity only).
+        run_id (str): The model registry run of the published models.
+    
+    Returns:
+        list: The Stage definitions (see dag.py).
+    """
+    def n(name):
+        return measure + '/' + name
+    def get_po_bu(df):
+        return df[['BUILDING_ID','PortfolioOwner']].drop_duplicates()
+    def get_prophet_stage(df, vol, previous_models, prophet_params):
+        return get_prophet(df, vol, previous_models=previous_models, prophet_params=prophet_params)
+    def get_metrics_stage(pm_dict, prophet_residuals):
+        # get_metrics drops missing residuals in place, the published residuals include this cleanup
+        prophet_residuals = prophet_residuals.copy()
+        mape_scores, rmse_scores, rmse_prophet, mape_prophet = get_metrics(pm_dict, prophet_residuals)
+        return mape_scores, rmse_scores, rmse_prophet, mape_prophet, prophet_residuals
+    include_vppa = include_vppa and measure == VPPA_MEASURE
+    def get_global_stage(df_app, spot, vppa=None):
+        df_global = add_spot(df_app, spot.copy(), measure)
+        df_global = date_conversion(df_global)
+        if include_vppa:
+            df_global = add_vppa(df_global, vppa, VPPA_USAGE_COEFF)
+        df_global = negative_to_zero(df_global)
+        df_global = select_columns(df_global)
+        return df_global
+    def get_samples_stage(df_app, prophet_models, prophet_fcst):
+        # as in run_prediction, the app falls back on summed intervals without samples
+        try:
+            return get_predictive_samples(df_app, prophet_models, prophet_fcst)
+        except:
+            logger.warning('predictive samples failed, app intervals are summed')
+            return None
+    def publish_stage(*args):
+        publish_prediction(measure, *args, run_id=run_id)
+    if reconciliation:
+        portfolio_stages = [
+            Stage(n('reconcile_hierarchy'), lambda df_app, prophet_residuals: reconcile_hierarchy(df_app, prophet_residuals, business_unit, reconciliation),
+                [n('df_app_converted'), n('prophet_residuals_clean')], [n('hierarchy')]),
+            Stage(n('get_portfolio_dataframe'), get_portfolio_dataframe, [n('hierarchy')], [n('df_portfolio')]),
+            Stage(n('publish_hierarchy'), lambda hierarchy: publish_hierarchy(measure, hierarchy), [n('hierarchy')], [], cache=False,
+                params=get_stage_config(PUBLISH_CONFIG))]
+    else:
+        portfolio_stages = [
+            Stage(n('aggregate_on_portfolio_level'), aggregate_on_portfolio_level, [n('df_app_converted')], [n('df_portfolio')])]
+    if get_n_draws() > 0:
+        portfolio_stages += [
+            Stage(n('get_predictive_samples'), get_samples_stage,
+                [n('df_app_converted'), n('prophet_models'), n('prophet_fcst')], [n('samples')], params=get_stage_config(UNCERTAINTY_CONFIG)),
+            Stage(n('publish_samples'), lambda samples: samples is not None and publish_samples(measure, samples), [n('samples')], [], cache=False,
+                params=get_stage_config(PUBLISH_CONFIG))]
+    return [
+        Stage(n('load_enablon'), lambda tango_fp, spot_fp_po, flag, cf, ecf, scf: load_enablon(measure, tango_fp.copy(), spot_fp_po, flag, cf, ecf, scf),
+            ['tango_fp', 'spot_fp_po', 'flag', 'cf', 'ecf', 'scf'], [n('df')],
+            # load_enablon queries the warehouse: the snapshot date (as in queries.cached_query) keeps a cached df to one day
+            params={'snapshot': get_snapshot_date()}),
+        Stage(n('po_bu'), get_po_bu, [n('df')], [n('po_bu')]),
+        Stage(n('get_prophet'), get_prophet_stage, [n('df'), 'vol', n('previous_models'), n('prophet_params')], [n('prophet_models'), n('prophet_fcst'), n('prophet_reg_coeff')],
+            params=get_stage_config(MODEL_CONFIG)),
+        Stage(n('get_cv'), get_cv, [n('df'), n('prophet_models')], [n('cv_dict'), n('pm_dict')]),
+        Stage(n('get_prophet_residuals'), get_prophet_residuals, [n('prophet_fcst'), n('df')], [n('prophet_residuals')]),
+        Stage(n('get_metrics'), get_metrics_stage, [n('pm_dict'), n('prophet_residuals')],
+            [n('mape_scores'), n('rmse_scores'), n('rmse_prophet'), n('mape_prophet'), n('prophet_residuals_clean')]),
+        Stage(n('get_prd_dataframe'), lambda prophet_fcst: get_prd_dataframe(prophet_fcst.copy()), [n('prophet_fcst')], [n('prd_df')]),
+        Stage(n('get_app_dataframe'), get_app_dataframe, [n('df'), n('prd_df')], [n('df_app')]),
+        Stage(n('add_columns'), lambda df_app, df: add_columns(df_app.copy(), df), [n('df_app'), n('df')], [n('df_app_columns')]),
+        Stage(n('get_energy_conversion'), lambda df_app, cf, ecf, scf: get_energy_conversion(df_app.copy(), measure, cf, ecf, scf),
+            [n('df_app_columns'), 'cf', 'ecf', 'scf'], [n('df_app_converted')])
+    ] + portfolio_stages + [
+        # vppa is an input only if the contracts are applied, so new contracts do not invalidate the other measures
+        Stage(n('get_global'), get_global_stage,
+            [n('df_portfolio'), 'spot'] + (['vppa'] if include_vppa else []), [n('df_global')]),
+        Stage(n('publish_spot'), lambda spot: publish_spot(measure, spot), ['spot'], [], cache=False, params=get_stage_config(PUBLISH_CONFIG)),
+        Stage(n('publish'), publish_stage,
+            [n('prophet_models'), n('prophet_fcst'), n('prophet_residuals_clean'), n('prophet_reg_coeff'), n('cv_dict'), n('df_global'),
+             n('mape_scores'), n('rmse_scores'), n('rmse_prophet'), n('mape_prophet'), n('po_bu')],
+            [], cache=False, params=get_stage_config(PUBLISH_CONFIG))
+    ]
+
+
+
+def run_prediction_dag(measures, spot_fp_po, spot, tango_fp, flag, vppa, cf, ecf, scf, vol, cache_dir='./dag_cache', max_workers=4, reconciliation=None, include_vppa=None):
+    """
+    Run the prediction for several measures as one DAG: independent stages (e.g. cross-validation and
+    the post-processing of the forecasts, or the stages of different measures) run concurrently, stage
+    outputs are cached on disk by input hash, and a failed run resumes from the last good stages
+    when it is started again with the same inputs.
+    
+    Args:
+        measures (list): The measures/indicators to predict.
+        spot_fp_po, spot, tango_fp, flag, vppa, cf, ecf, scf, vol: The outputs of run_etl().
+        cache_dir (str): Directory of the stage output cache.
+        max_workers (int): Maximum number of stages running at the same time.
+        reconciliation (str): The hierarchy reconciliation method (default: RECONCILIATION environment variable).
+        include_vppa (bool): Apply the VPPA contracts (default: INCLUDE_VPPA environment variable, off).
+    
+    Returns:
+        dict: The df_global per measure.
+    """
+    logger.info('start run prediction dag')
+    inputs = {
+        'spot_fp_po': spot_fp_po,
+        'spot': spot,
+        'vppa': vppa,
+        'tango_fp': tango_fp,
+        'flag': flag,
+        'cf': cf,
+        'ecf': ecf,
+        'scf': scf,
+        # the regressors are joined once for all measures
+        'vol': get_regressor_table(get_regressor_sources(vol))
+    }
+    reconciliation = reconciliation or os.environ.get('RECONCILIATION')
+    include_vppa = get_include_vppa() if include_vppa is None else include_vppa
+    # one model registry run for all measures of the dag
+    run_id = new_run_id()
+    stages = []
+    for measure in measures:
+        # the models of the previous run (slim artifacts) warm start the fits and are part of the
+        # get_prophet cache key; without warm starts they are not loaded and do not invalidate the cache
+        inputs[measure + '/previous_models'] = load_previous_run(measure)[0] if get_warm_start() else None
+        # new tuned parameters invalidate the fits of the measure
+        inputs[measure + '/prophet_params'] = load_prophet_params(measure)
+        stages.extend(get_prediction_stages(measure, reconciliation, include_vppa, run_id))
+    targets = [measure + '/df_global' for measure in measures]
+    results = run_dag(stages, inputs, targets=targets, cache_dir=cache_dir, max_workers=max_workers)
+    logger.info('end run prediction dag')
+    return {measure: results[measure + '/df_global'] for measure in measures}
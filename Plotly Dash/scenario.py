@@ -0,0 +1,183 @@
+################
+### scenario ###
+################
+
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+
+from backends import(
+    get_store
+)
+from codec import(
+    dumps,
+    loads
+)
+from helper_functions import(
+    compact_frame
+)
+from log import(
+    get_logger,
+    shape
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### scenarios
+# a scenario changes the SPOT projects of a measure; the published baseline forecasts (df_global,
+# without SPOT) stay the same and only y_with_spot / y_ghg_with_spot are recomputed
+# scenario: {'name': str, 'changes': [change, ...]}, one change per project (SPOT ID):
+#   {'SPOT ID': id, 'drop': True}                              the project is not realized
+#   {'SPOT ID': id, 'Impact Realization Date': '2026-03-15'}   the project is realized at another date
+#   {'SPOT ID': id, 'EMImpactTonsCO2Year': -120, 'EMUnit': -800}  other yearly impacts
+#   {'SPOT ID': id, 'impact_factor': 0.5}                      the impacts are scaled
+# a change of a project with several rows (EM sources) applies to all its rows; the baseline
+# scenario has no changes
+SCENARIO_CHANGES = ['drop', 'Impact Realization Date', 'EMImpactTonsCO2Year', 'EMUnit', 'impact_factor']
+SPOT_COLUMNS = ['SPOT ID', 'Impact Month', 'PortfolioOwner', 'EMImpactTonsCO2Year', 'EMUnit', 'EMSourceID', 'Enablon Source Name']
+
+
+def get_scenario_hash(scenario, version=''):
+    """
+    Hashes the changes of a scenario (not its name) and the version of the baseline data.
+
+    Args:
+        scenario (dict): The scenario.
+        version (str): The hash of the baseline data the scenario is applied to.
+
+    Returns:
+        str: The scenario hash.
+    """
+    key = json.dumps({'changes': scenario.get('changes', []), 'version': version}, sort_keys=True, default=str)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def apply_scenarios(projects, scenarios):
+    """
+    Applies the changes of several scenarios to the SPOT projects at once.
+
+    Args:
+        projects (pd.DataFrame): The SPOT projects of one measure (prepare_spot output).
+        scenarios (list): The scenarios.
+
+    Returns:
+        pd.DataFrame: The projects of all scenarios (column scenario: position in scenarios).
+    """
+    n = len(scenarios)
+    dat = projects.iloc[np.tile(np.arange(len(projects)), n)].reset_index(drop=True)
+    dat['scenario'] = np.repeat(np.arange(n), len(projects))
+    changes = pd.DataFrame(
+        [dict(change, scenario=k) for k, scenario in enumerate(scenarios) for change in scenario.get('changes', [])],
+        columns=['scenario', 'SPOT ID'] + SCENARIO_CHANGES)
+    # the last change of a project in a scenario wins
+    changes = changes.drop_duplicates(['scenario', 'SPOT ID'], keep='last')
+    changes = changes.rename(columns={col: 'change ' + col for col in SCENARIO_CHANGES})
+    dat = pd.merge(dat, changes, how='left', on=['scenario', 'SPOT ID'])
+    dat = dat.loc[~dat['change drop'].fillna(False).astype(bool)]
+    # ceiling month of the realization date, as in prepare_spot
+    realization = pd.to_datetime(dat['change Impact Realization Date'])
+    dat['Impact Month'] = (realization + pd.DateOffset(months=1) - pd.offsets.MonthBegin(1)).fillna(dat['Impact Month'])
+    factor = dat['change impact_factor'].astype(float).fillna(1)
+    for col in ['EMImpactTonsCO2Year', 'EMUnit']:
+        dat[col] = dat['change ' + col].astype(float).fillna(dat[col].astype(float)) * factor
+    return dat[['scenario'] + [col for col in SPOT_COLUMNS if col in dat.columns]]
+
+
+
+###############################################################################
+### evaluation
+def get_scenario_frames(baseline, projects, scenarios):
+    """
+    Computes the forecasts with SPOT impacts of several scenarios in one pass: the monthly impacts
+    of all scenarios are summed into a (scenarios x portfolio owners x months) array and accumulated
+    over the months, as in add_spot.
+
+    Args:
+        baseline (pd.DataFrame): The published df_global of one measure.
+        projects (pd.DataFrame): The SPOT projects of the measure.
+        scenarios (list): The scenarios.
+
+    Returns:
+        list: One df_global per scenario with recomputed impact and *_with_spot columns.
+    """
+    owners = pd.Index(baseline['PortfolioOwner'].astype(str).unique())
+    months = pd.DatetimeIndex(sorted(baseline['Impact Month'].unique()))
+    shape_ = (len(scenarios), len(owners), len(months))
+    dat = apply_scenarios(projects, scenarios)
+    owner_code = owners.get_indexer(dat['PortfolioOwner'].astype(str))
+    month_code = months.get_indexer(pd.to_datetime(dat['Impact Month']))
+    # impacts of portfolio owners or months outside the forecasts are not added (as the merge in add_spot)
+    inside = (owner_code >= 0) & (month_code >= 0)
+    flat = np.ravel_multi_index((dat['scenario'].values[inside], owner_code[inside], month_code[inside]), shape_)
+    def accumulate(values):
+        # monthly impact: yearly value / 12
+        monthly = np.bincount(flat, weights=values[inside] / 12, minlength=np.prod(shape_)).reshape(shape_)
+        return monthly, np.cumsum(monthly, axis=2)
+    emission, emission_accumulated = accumulate(dat['EMImpactTonsCO2Year'].astype(float).values)
+    energy, energy_accumulated = accumulate(dat['EMUnit'].astype(float).values)
+    baseline = compact_frame(baseline)
+    row_owner = owners.get_indexer(baseline['PortfolioOwner'].astype(str))
+    row_month = months.get_indexer(pd.to_datetime(baseline['Impact Month']))
+    y = baseline['y'].values.astype(float)
+    y_ghg = baseline['y_ghg'].values.astype(float)
+    frames = []
+    for k in range(len(scenarios)):
+        frame = baseline.copy()
+        frame['Emission Impact Sum'] = emission[k, row_owner, row_month].astype(np.float32)
+        frame['Emission Impact Accumulated'] = emission_accumulated[k, row_owner, row_month].astype(np.float32)
+        frame['Energy Impact Sum'] = energy[k, row_owner, row_month].astype(np.float32)
+        frame['Energy Impact Accumulated'] = energy_accumulated[k, row_owner, row_month].astype(np.float32)
+        # as negative_to_zero after add_spot
+        frame['y_with_spot'] = np.maximum(y + energy_accumulated[k, row_owner, row_month], 0).astype(np.float32)
+        frame['y_ghg_with_spot'] = np.maximum(y_ghg + emission_accumulated[k, row_owner, row_month], 0).astype(np.float32)
+        frames.append(frame)
+    logger.debug('scenarios %s', shape_)
+    return frames
+
+
+
+###############################################################################
+### cached scenario runs
+# the baseline of a measure (df_global + measure) and its SPOT projects (spot + measure) are published
+# by the pipeline; scenario results are stored under 'scenario' + measure + hash, where the hash covers
+# the changes and the published data, so a new pipeline run invalidates the cached scenarios
+def run_scenarios(measure, scenarios, store=None):
+    """
+    Evaluates SPOT scenarios against the published forecasts of one measure. Cached scenarios are
+    loaded, the others are computed together and cached.
+
+    Args:
+        measure (str): The measure/indicator.
+        scenarios (list): The scenarios.
+        store: The result store (default: get_store()).
+
+    Returns:
+        dict: The df_global per scenario name (the hash if the scenario has no name).
+    """
+    store = store or get_store()
+    baseline_blob = store.get('df_global' + measure)
+    spot_blob = store.get('spot' + measure)
+    if baseline_blob is None or spot_blob is None:
+        raise KeyError('no published forecasts or SPOT projects for ' + measure)
+    version = hashlib.sha256(baseline_blob + spot_blob).hexdigest()[:16]
+    hashes = [get_scenario_hash(scenario, version) for scenario in scenarios]
+    results = dict()
+    missing = []
+    for scenario_hash in dict.fromkeys(hashes):
+        blob = store.get('scenario' + measure + scenario_hash)
+        if blob is not None:
+            results[scenario_hash] = loads(blob)
+        else:
+            missing.append(scenario_hash)
+    logger.info('scenarios %s: %s cached, %s computed', measure, len(results), len(missing))
+    if missing:
+        frames = get_scenario_frames(loads(baseline_blob), loads(spot_blob), [scenarios[hashes.index(h)] for h in missing])
+        for scenario_hash, frame in zip(missing, frames):
+            store.set('scenario' + measure + scenario_hash, dumps(frame))
+            results[scenario_hash] = frame
+            logger.debug('scenario %s %s', scenario_hash, shape(frame))
+    return {scenario.get('name', scenario_hash): results[scenario_hash] for scenario, scenario_hash in zip(scenarios, hashes)}
@@ -3,28 +3,32 @@
 #############
 
 import numpy as np
-import os
 import pandas as pd
-import pickle
-import redis
+
+from backends import(
+    publish_many
+)
+from codec import(
+    dumps
+)
 
 
 def store_data(leaks, fleet, spot, vppa, flag, vol):    
-    leaks_json = pickle.dumps(leaks)
-    fleet_json = pickle.dumps(fleet)
-    spot_json = pickle.dumps(spot)
-    vppa_json = pickle.dumps(vppa)
-    flag_json = pickle.dumps(flag)
-    vol_json = pickle.dumps(vol)
-    # establish redis
-    redis_client = redis.StrictRedis.from_url(os.environ.get("REDIS_URL", "redis://127.0.0.1:6379"))
-    # to redis
-    redis_client.set('leaks', leaks_json)
-    redis_client.set('fleet', fleet_json)
-    redis_client.set('spot', spot_json)
-    redis_client.set('vppa', vppa_json)
-    redis_client.set('flag', flag_json)
-    redis_client.set('vol', vol_json)
+    leaks_json = dumps(leaks)
+    fleet_json = dumps(fleet)
+    spot_json = dumps(spot)
+    vppa_json = dumps(vppa)
+    flag_json = dumps(flag)
+    vol_json = dumps(vol)
+    # to redis: one transactional pipeline with a new published data version
+    publish_many({
+        'leaks': leaks_json,
+        'fleet': fleet_json,
+        'spot': spot_json,
+        'vppa': vppa_json,
+        'flag': flag_json,
+        'vol': vol_json
+    })
     # to csv
     #leaks.to_csv('./input_data/leaks.csv')
     #spot.to_csv('./input_data/spot.csv')
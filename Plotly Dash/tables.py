@@ -0,0 +1,175 @@
+##############
+### tables ###
+##############
+
+from collections import OrderedDict
+import math
+import os
+import pandas as pd
+import threading
+import time
+
+from log import(
+    get_logger,
+    shape
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### server-side DataTables
+# the DataTables of the dashboard page, sort and filter on the server (page_action, sort_action and
+# filter_action 'custom'): the callbacks send one page of rows whatever the size of the selection
+# the table of a selection is built once and kept in an in-process cache (TABLE_CACHE_SIZE tables,
+# default 32, for TABLE_CACHE_SECONDS, default 300), together with its sorted and filtered views,
+# so turning a page only slices a cached frame; the callbacks key the tables by the published data
+# version (backends.get_published_version), so a publish is visible at once and not only after the expiry
+TABLE_OPTIONS = dict(page_current=0, page_action='custom', sort_action='custom', sort_mode='multi', sort_by=[],
+    filter_action='custom', filter_query='')
+# filter operators of the DataTable filter row, in the order they are matched
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='], ['contains '], ['datestartswith ']]
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def get_cache_size():
+    return int(os.environ.get('TABLE_CACHE_SIZE', 32))
+
+
+def get_cache_seconds():
+    return int(os.environ.get('TABLE_CACHE_SECONDS', 300))
+
+
+def get_cached(key, build):
+    """
+    Returns a cached frame, building and caching it if it is missing or expired.
+
+    Args:
+        key (tuple): The cache key.
+        build (function): Builds the frame.
+
+    Returns:
+        pd.DataFrame: The frame.
+    """
+    with _tables_lock:
+        entry = _tables.get(key)
+        if entry is not None and time.time() - entry[0] < get_cache_seconds():
+            _tables.move_to_end(key)
+            return entry[1]
+    dat = build()
+    with _tables_lock:
+        _tables[key] = (time.time(), dat)
+        _tables.move_to_end(key)
+        while len(_tables) > get_cache_size():
+            _tables.popitem(last=False)
+    return dat
+
+
+
+###############################################################################
+### filter and sort
+def split_filter_part(filter_part):
+    """
+    Splits one condition of a DataTable filter query ('{column} operator value').
+
+    Returns:
+        tuple: column, operator and value (text without quotes); None for conditions that cannot be parsed.
+    """
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value = value_part.strip()
+                if not value:
+                    return None, None, None
+                if value[0] == value[-1] and value[0] in ("'", '"', '`'):
+                    value = value[1:-1].replace('\\' + value[0], value[0])
+                return name, operator_type[0].strip(), value
+    return None, None, None
+
+
+def filter_frame(dat, filter_query):
+    """
+    Applies a DataTable filter query (conditions joined with ' && '). The values are compared as
+    numbers, dates or text depending on the column; conditions on unknown columns or with values
+    that cannot be compared are ignored.
+    """
+    if not filter_query:
+        return dat
+    for filter_part in filter_query.split(' && '):
+        col, operator, value = split_filter_part(filter_part)
+        if col not in dat.columns:
+            continue
+        try:
+            values = dat[col]
+            if operator in ['contains', 'datestartswith']:
+                text = values.astype(str)
+                mask = text.str.contains(value, regex=False) if operator == 'contains' else text.str.startswith(value)
+            else:
+                if pd.api.types.is_datetime64_any_dtype(values):
+                    value = pd.to_datetime(value)
+                elif pd.api.types.is_numeric_dtype(values):
+                    value = float(value)
+                else:
+                    values = values.astype(str)
+                mask = {
+                    'eq': lambda: values == value,
+                    'ne': lambda: values != value,
+                    'lt': lambda: values < value,
+                    'le': lambda: values <= value,
+                    'gt': lambda: values > value,
+                    'ge': lambda: values >= value}[operator]()
+            dat = dat.loc[mask.values]
+        except:
+            logger.debug('filter %s ignored', filter_part)
+    return dat
+
+
+def sort_frame(dat, sort_by):
+    """
+    Applies the sort_by of a DataTable (list of {'column_id', 'direction'}).
+    """
+    sort_by = [s for s in (sort_by or []) if s['column_id'] in dat.columns]
+    if not sort_by:
+        return dat
+    return dat.sort_values([s['column_id'] for s in sort_by], ascending=[s['direction'] == 'asc' for s in sort_by], kind='stable')
+
+
+
+###############################################################################
+### pages
+def get_page(key, build, page_current, page_size, sort_by=None, filter_query=''):
+    """
+    Serves one page of a cached table.
+
+    Args:
+        key (tuple): The cache key of the table (e.g. the table name, the published data version and the selection).
+        build (function): Builds the table if it is not cached.
+        page_current (int): The page (from 0).
+        page_size (int): The rows per page.
+        sort_by (list): The DataTable sort_by.
+        filter_query (str): The DataTable filter_query.
+
+    Returns:
+        records (list): The rows of the page (to_dict('records')).
+        columns (list): The DataTable columns.
+        page_count (int): The number of pages.
+    """
+    dat = get_cached(key, build)
+    sort_key = tuple((s['column_id'], s['direction']) for s in (sort_by or []))
+    if filter_query or sort_key:
+        view = get_cached(key + ('view', filter_query or '', sort_key), lambda: sort_frame(filter_frame(dat, filter_query), sort_by))
+    else:
+        view = dat
+    page_size = page_size or 25
+    page_count = max(1, math.ceil(view.shape[0] / page_size))
+    # a filter can leave fewer pages than the current one: serve the last page
+    page_current = min(page_current or 0, page_count - 1)
+    page = view.iloc[page_current * page_size:(page_current + 1) * page_size]
+    logger.debug('page %s of %s', page_current, shape(view))
+    columns = [{"name": i, "id": i} for i in dat.columns]
+    return page.to_dict('records'), columns, page_count
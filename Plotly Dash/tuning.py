@@ -0,0 +1,171 @@
+##############
+### tuning ###
+##############
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import itertools
+import numpy as np
+import os
+import pandas as pd
+from prophet import Prophet
+
+from model import(
+    DEFAULT_PROPHET_PARAMS,
+    get_cutoffs
+)
+from regressors import(
+    REGRESSORS,
+    get_building_regressors,
+    get_regressor_table
+)
+from log import(
+    get_logger
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### search space
+# every building is scored on the cross-validation cutoffs of get_cv (12 months after every cutoff);
+# all configurations are evaluated on the first cutoff, only the best TUNING_KEEP_FRACTION (default 0.5)
+# are evaluated on the remaining cutoffs; the configuration with the smallest mean RMSE wins
+# the fits use the MAP estimate: the ranking of the configurations, not the intervals, is compared
+# buildings with regressors are tuned with the regressors get_prophet fits them with
+# TUNING_RANDOM_CONFIGS: evaluate a random subset of the grid (default: the full grid)
+# TUNING_WORKERS: number of fits running at the same time (default 4)
+PARAM_GRID = {
+    'changepoint_prior_scale': [0.01, 0.05, 0.1, 0.5],
+    'seasonality_prior_scale': [1.0, 10.0],
+    'seasonality_mode': ['multiplicative', 'additive']
+}
+
+
+def get_configs(grid=None, n_random=None, seed=0):
+    """
+    Lists the configurations of a parameter grid, or a random subset of them. The default
+    configuration (DEFAULT_PROPHET_PARAMS) is always evaluated.
+
+    Args:
+        grid (dict): The values per Prophet parameter; defaults to PARAM_GRID.
+        n_random (int): The number of random configurations (default: TUNING_RANDOM_CONFIGS or all).
+        seed (int): The seed of the random subset.
+
+    Returns:
+        list: The configurations (dictionaries of Prophet parameters).
+    """
+    grid = grid or PARAM_GRID
+    n_random = n_random or int(os.environ.get('TUNING_RANDOM_CONFIGS', 0))
+    configs = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+    if n_random and n_random < len(configs):
+        rng = np.random.default_rng(seed)
+        configs = [configs[k] for k in sorted(rng.choice(len(configs), n_random, replace=False))]
+    default = dict(DEFAULT_PROPHET_PARAMS)
+    if default not in configs:
+        configs.insert(0, default)
+    return configs
+
+
+
+###############################################################################
+### evaluation
+def evaluate_config(df_prophet, config, cutoff, horizon_months=12, regressors=None):
+    """
+    Fits one configuration on the months up to a cutoff and scores the following months.
+
+    Args:
+        df_prophet (pd.DataFrame): The series of one building (ds, y and the regressor columns).
+        config (dict): The Prophet parameters.
+        cutoff (pd.Timestamp): The last month of the training data.
+        horizon_months (int): The number of scored months after the cutoff.
+        regressors (list): The regressors of the building (get_building_regressors()).
+
+    Returns:
+        float: The RMSE of the forecast (inf if the fit fails).
+    """
+    try:
+        train = df_prophet.loc[df_prophet['ds'] <= cutoff]
+        test = df_prophet.loc[(df_prophet['ds'] > cutoff) & (df_prophet['ds'] <= cutoff + relativedelta(months=horizon_months))]
+        m = Prophet(mcmc_samples=0, uncertainty_samples=0, **config)
+        for name in regressors or []:
+            m.add_regressor(name, mode=REGRESSORS[name]['mode'])
+        m.fit(train)
+        fcst = m.predict(test[['ds'] + list(regressors or [])])
+        return float(np.sqrt(np.mean((fcst['yhat'].values - test['y'].astype(float).values) ** 2)))
+    except:
+        logger.debug('configuration %s failed at cutoff %s', config, cutoff)
+        return np.inf
+
+
+def tune_prophet(df, configs=None, keep_fraction=None, max_workers=None, vol=None):
+    """
+    Hyperparameter search per building: evaluates the configurations on the cross-validation
+    cutoffs in parallel and prunes the poor configurations after the first cutoff.
+
+    Args:
+        df (pd.DataFrame): The input data of one measure (load_enablon output).
+        configs (list): The configurations (default: get_configs()).
+        keep_fraction (float): The share of configurations evaluated beyond the first cutoff (default: TUNING_KEEP_FRACTION or 0.5).
+        max_workers (int): The number of parallel fits (default: TUNING_WORKERS or 4).
+        vol (pd.DataFrame): The regressor table (regressors.get_regressor_table()) or the production volumes (prepare_volume output).
+
+    Returns:
+        dict: Per building the winning configuration: {'params': dict, 'rmse': float, 'configs': int, 'cutoffs': int, 'tuned': str}.
+            Buildings without cutoffs (short series) are not tuned.
+    """
+    configs = configs or get_configs()
+    keep_fraction = keep_fraction or float(os.environ.get('TUNING_KEEP_FRACTION', 0.5))
+    max_workers = max_workers or int(os.environ.get('TUNING_WORKERS', 4))
+    # the regressors of every building as selected by get_prophet
+    regressor_table = get_regressor_table(vol)
+    buildings_with_regressors = set(regressor_table.index.get_level_values('BUILDING_ID'))
+    series = dict()
+    cutoffs = dict()
+    regressors = dict()
+    for i, dat in df.groupby('BUILDING_ID'):
+        df_prophet = dat[['Month', 'y']].rename(columns={'Month': 'ds'})
+        df_prophet['ds'] = pd.to_datetime(df_prophet['ds'])
+        names, regressor_values = get_building_regressors(regressor_table, buildings_with_regressors, i, pd.DatetimeIndex(df_prophet['ds'].unique()))
+        if names:
+            df_prophet = df_prophet.join(regressor_values, on='ds')
+        df_prophet = df_prophet.dropna(subset=['y'] + names).sort_values('ds')
+        if df_prophet.shape[0] == 0:
+            continue
+        building_cutoffs = get_cutoffs(df_prophet['ds'])
+        if len(building_cutoffs) > 0:
+            series[i] = df_prophet
+            cutoffs[i] = building_cutoffs
+            regressors[i] = names
+    logger.info('tune %s configurations for %s buildings', len(configs), len(series))
+    # scores[building][config index] = list of RMSE per evaluated cutoff
+    scores = {i: {k: [] for k in range(len(configs))} for i in series}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for round_number in range(max(len(c) for c in cutoffs.values()) if cutoffs else 0):
+            tasks = dict()
+            for i in series:
+                if round_number >= len(cutoffs[i]):
+                    continue
+                for k in scores[i]:
+                    tasks[(i, k)] = executor.submit(evaluate_config, series[i], configs[k], cutoffs[i][round_number], regressors=regressors[i])
+            for (i, k), future in tasks.items():
+                scores[i][k].append(future.result())
+            # prune after the first cutoff: keep the best configurations per building
+            if round_number == 0:
+                for i in scores:
+                    ranked = sorted(scores[i], key=lambda k: scores[i][k][0])
+                    n_keep = max(1, int(np.ceil(len(ranked) * keep_fraction)))
+                    scores[i] = {k: scores[i][k] for k in ranked[:n_keep]}
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    prophet_params = dict()
+    tuned = datetime.now().isoformat(timespec='seconds')
+    for i in scores:
+        best = min(scores[i], key=lambda k: np.mean(scores[i][k]))
+        rmse = float(np.mean(scores[i][best]))
+        if np.isfinite(rmse):
+            prophet_params[i] = {'params': configs[best], 'rmse': rmse, 'configs': len(configs), 'cutoffs': len(cutoffs[i]), 'tuned': tuned}
+    return prophet_params
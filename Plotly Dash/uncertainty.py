@@ -0,0 +1,173 @@
+###################
+### uncertainty ###
+###################
+
+import copy
+import numpy as np
+import os
+import pandas as pd
+from statistics import NormalDist
+
+from baseline import(
+    BaselineModel
+)
+from log import(
+    get_logger,
+    shape
+)
+
+logger = get_logger(__name__)
+
+
+
+###############################################################################
+### predictive samples
+# the intervals of a sum of buildings (or portfolio owners, or measures) are not the sums of their
+# bounds: the pipeline stores a float32 matrix of predictive draws per building node (building and
+# SYSTM_SPCFIC_MSR, nodes x months x draws, in GJ) for the forecast months, and the app sums the
+# draws of any selection and takes quantiles
+# draws of Prophet models come from the posterior predictive distribution (Prophet.predictive_samples),
+# draws of baseline models (and Prophet models that cannot be sampled) from a normal distribution
+# fitted to the forecast interval; draws of different buildings and measures are independent
+# UNCERTAINTY_DRAWS: number of draws per building and month (default 100)
+def get_n_draws():
+    return int(os.environ.get('UNCERTAINTY_DRAWS', 100))
+
+
+def get_standardized_draws(model, fcst, months, n_draws, z, rng):
+    """
+    Draws standardized forecast errors of one building ((draw - yhat) / sigma, months x draws).
+
+    Args:
+        model: The Prophet model or BaselineModel of the building.
+        fcst (pd.DataFrame): The forecast of the building (ds, yhat, yhat_lower, yhat_upper).
+        months (pd.DatetimeIndex): The forecast months.
+        n_draws (int): The number of draws.
+        z (float): The normal quantile of the interval bounds.
+        rng (np.random.Generator): The random number generator.
+
+    Returns:
+        np.ndarray: The standardized draws (float32).
+    """
+    if model is not None and fcst is not None and not isinstance(model, BaselineModel):
+        try:
+            fcst = fcst.set_index('ds').reindex(months)
+            # predictive_samples draws uncertainty_samples paths: draw only what is stored, on a shallow
+            # copy so that the shared model (also read by get_cv) is not modified
+            sampler = copy.copy(model)
+            sampler.uncertainty_samples = n_draws
+            draws = sampler.predictive_samples(pd.DataFrame({'ds': months}))['yhat'][:, :n_draws]
+            sigma = ((fcst['yhat_upper'] - fcst['yhat_lower']) / (2 * z)).values[:, None]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                draws = (draws - fcst['yhat'].values[:, None]) / sigma
+            if draws.shape[1] == n_draws:
+                return np.nan_to_num(draws, nan=0, posinf=0, neginf=0).astype(np.float32)
+        except:
+            logger.debug('predictive samples failed, draw from normal distribution')
+    return rng.standard_normal((len(months), n_draws), dtype=np.float32)
+
+
+def get_predictive_samples(df_app, prophet_models, prophet_fcst, n_draws=None, interval_width=0.8, seed=0):
+    """
+    Builds the predictive sample matrix of one measure from the building forecasts after energy
+    conversion. Months with actuals enter the samples with their value (no uncertainty).
+
+    Args:
+        df_app (pd.DataFrame): get_energy_conversion output (building level, actuals and predictions).
+        prophet_models (dict): The model per building (Prophet or BaselineModel).
+        prophet_fcst (dict): The forecast per building (before energy conversion).
+        n_draws (int): The number of draws; defaults to get_n_draws().
+        interval_width (float): The coverage of the forecast intervals (0.8 like Prophet).
+        seed (int): The seed of the normal draws.
+
+    Returns:
+        dict:
+            - months (pd.DatetimeIndex): The forecast months.
+            - nodes, BUILDING_ID, PortfolioOwner (np.ndarray): One entry per building node.
+            - samples (np.ndarray): The draws in GJ (nodes x months x draws, float32).
+            - ghg_ratio (np.ndarray): The emissions per GJ of every node and month (nodes x months, float32).
+            - interval_width (float).
+    """
+    n_draws = n_draws or get_n_draws()
+    z = NormalDist().inv_cdf(0.5 + interval_width / 2)
+    rng = np.random.default_rng(seed)
+    dat = df_app[['Impact Month', 'BUILDING_ID', 'SYSTM_SPCFIC_MSR', 'PortfolioOwner', 'y', 'yhat_lower', 'yhat_upper', 'y_ghg', 'type']]\
+        .drop_duplicates().dropna(subset=['PortfolioOwner'])
+    dat = dat.assign(node = dat['BUILDING_ID'].astype(str) + ' | ' + dat['SYSTM_SPCFIC_MSR'].fillna('').astype(str))
+    for col in ['y', 'yhat_lower', 'yhat_upper', 'y_ghg']:
+        dat[col] = dat[col].astype(float)
+    months = pd.DatetimeIndex(sorted(dat.loc[dat['type'] == 'Predicted', 'Impact Month'].unique()))
+    dat = dat.loc[dat['Impact Month'].isin(months)]
+    nodes = dat[['node', 'BUILDING_ID', 'PortfolioOwner']].drop_duplicates('node').sort_values('node').reset_index(drop=True)
+    grouped = dat.groupby(['node', 'Impact Month'])
+    def pivot(values):
+        return values.unstack('Impact Month').reindex(index=nodes['node'], columns=months).values
+    values = np.nan_to_num(pivot(grouped['y'].sum()))
+    values_ghg = np.nan_to_num(pivot(grouped['y_ghg'].sum()))
+    sigma = np.nan_to_num(pivot(grouped['yhat_upper'].sum() - grouped['yhat_lower'].sum()) / (2 * z))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ghg_ratio = np.nan_to_num(np.where(values != 0, values_ghg / values, 0))
+    # one set of standardized draws per building, shared by its nodes
+    draws = dict()
+    for building in nodes['BUILDING_ID'].unique():
+        draws[building] = get_standardized_draws(prophet_models.get(building), prophet_fcst.get(building), months, n_draws, z, rng)
+    standardized = np.stack([draws[building] for building in nodes['BUILDING_ID']]) if len(nodes) else np.zeros((0, len(months), n_draws), np.float32)
+    samples = values.astype(np.float32)[:, :, None] + sigma.astype(np.float32)[:, :, None] * standardized
+    logger.debug('samples %s', samples.shape)
+    return {
+        'months': months,
+        'nodes': nodes['node'].values,
+        'BUILDING_ID': nodes['BUILDING_ID'].values,
+        'PortfolioOwner': nodes['PortfolioOwner'].values,
+        'samples': samples,
+        'ghg_ratio': ghg_ratio.astype(np.float32),
+        'interval_width': interval_width}
+
+
+
+###############################################################################
+### aggregation of selections
+def aggregate_samples(sample_sets, portfolio_owners=None, unit='y', by_portfolio_owner=False):
+    """
+    Sums the draws of a selection of portfolio owners over one or several measures and derives
+    the intervals from the quantiles of the summed draws.
+
+    Args:
+        sample_sets (list): get_predictive_samples outputs, one per measure.
+        portfolio_owners (list): The selected portfolio owners; all if None or empty.
+        unit (str): 'y' (energy, GJ) or 'y_ghg' (emissions, t).
+        by_portfolio_owner (bool): One interval per portfolio owner instead of one for the total.
+
+    Returns:
+        pd.DataFrame: Columns Impact Month, (PortfolioOwner,) yhat_lower, yhat_upper.
+    """
+    months = pd.DatetimeIndex(sorted(set().union(*[set(s['months']) for s in sample_sets])))
+    n_draws = min(s['samples'].shape[2] for s in sample_sets)
+    interval_width = sample_sets[0]['interval_width']
+    owners = sorted(set().union(*[set(s['PortfolioOwner']) for s in sample_sets]))
+    if portfolio_owners:
+        owners = [po for po in owners if po in set(portfolio_owners)]
+    owner_index = pd.Index(owners)
+    n_groups = len(owners) if by_portfolio_owner else 1
+    total = np.zeros((n_groups, len(months), n_draws), np.float32)
+    for s in sample_sets:
+        code = owner_index.get_indexer(s['PortfolioOwner'])
+        selected = code >= 0
+        samples = s['samples'][selected, :, :n_draws]
+        if unit == 'y_ghg':
+            samples = samples * s['ghg_ratio'][selected][:, :, None]
+        # sum the nodes per group with one matrix product (groups x nodes) @ (nodes x months*draws)
+        group = code[selected] if by_portfolio_owner else np.zeros(int(selected.sum()), int)
+        indicator = np.zeros((n_groups, group.shape[0]), np.float32)
+        indicator[group, np.arange(group.shape[0])] = 1
+        summed = (indicator @ samples.reshape(group.shape[0], -1)).reshape(n_groups, samples.shape[1], n_draws)
+        total[:, months.get_indexer(s['months'])] += summed
+    lower, upper = np.quantile(total, [0.5 - interval_width / 2, 0.5 + interval_width / 2], axis=2)
+    dat = pd.DataFrame({
+        'Impact Month': np.tile(months.values, n_groups),
+        'yhat_lower': lower.ravel(),
+        'yhat_upper': upper.ravel()})
+    if by_portfolio_owner:
+        dat.insert(1, 'PortfolioOwner', np.repeat(owners, len(months)))
+    logger.debug('aggregated intervals %s', shape(dat))
+    return dat